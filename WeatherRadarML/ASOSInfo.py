@@ -3,11 +3,17 @@ from datetime import datetime
 import requests
 import csv
 import json
+import numpy as np
 # from WeatherRadar import WeatherRadar
 
 _dir  = os.path.realpath( os.path.dirname(__file__) )
 _asos = os.path.join( _dir, 'data', 'asos-stations.txt' )
 
+def _read_range(fid, offset, nbytes):
+    """Private function to read the lines in a byte range of an open (binary) file"""
+    fid.seek( offset )
+    return fid.read( nbytes ).decode().splitlines()
+
 
 class ASOSInfo( object ):
     def __init__(self, infile = _asos ):
@@ -211,6 +217,110 @@ class ASOSInfo( object ):
             for chunk in page.iter_content(chunk_size=512):
                 fd.write(chunk)
 
+    @staticmethod
+    def day_index(file=os.path.join(_dir, 'data', 'scraper.txt')):
+        """
+        Name:
+            day_index
+        Purpose:
+            Index the observations of each day in a file downloaded with
+            download_data, so a day can be read without scanning the whole
+            file; see the ranges keyword of read_data. The file is read
+            once. IEM files are sorted by station, then time, so each day
+            is one run of lines per station.
+        Inputs:
+            file (string):
+                The path to the file the data has been downloaded to
+        Keywords:
+            None.
+        Returns:
+            A dictionary of 'YYYY-MM-DD' to a list of (offset, nbytes) byte
+            ranges holding the observations of that day
+        """
+        index = {}
+        with open(file, 'rb') as f:
+            offset = 0
+            for line in f:                                                          # Skip comments to the header
+                offset += len(line)
+                if line.strip() and not line.startswith(b'#'): break
+            col   = next(csv.reader([line.decode()])).index('valid')
+            day   = None
+            for line in f:
+                key = line.split(b',', col+1)[col][:10].decode()                    # Date part of the valid time
+                if key == day:
+                    runs[-1][1] += len(line)
+                else:
+                    day  = key
+                    runs = index.setdefault(day, [])
+                    runs.append([offset, len(line)])
+                offset += len(line)
+        return {day : [tuple(run) for run in runs] for day, runs in index.items()}
+
+    @staticmethod
+    def read_data(file=os.path.join(_dir, 'data', 'scraper.txt'), missing='M', trace='T', start=None, end=None, region=None, ranges=None):
+        """
+        Name:
+            read_data
+        Purpose:
+            Read observations downloaded with download_data into arrays
+        Inputs:
+            file (string):
+                The path to the file the data has been downloaded to
+            missing (string):
+                How missing data are represented in the file
+            trace (string):
+                How trace reports are represented in the file. Trace
+                values are set to 0.0001
+        Keywords:
+            start (datetime):
+                Only keep observations at or after this time
+            end (datetime):
+                Only keep observations before this time
+            region (tuple):
+                Only keep observations in (lonMin, lonMax, latMin, latMax)
+            ranges (list):
+                Only read these (offset, nbytes) byte ranges of the file;
+                e.g., the ranges of a day from day_index
+            Rows are filtered by time while the file is read, so only the
+            observations kept are held in memory.
+        Returns:
+            A dictionary of numpy arrays with 'station', 'time' (datetime64),
+            'lon', and 'lat' keys, plus one array for each data column in
+            the file. Numeric columns are float32 with missing values set
+            to NaN; other columns are strings with missing values set to ''
+        """
+        with open(file, 'rb') as f:
+            reader = (line for line in csv.reader(text.decode() for text in f) if line and not line[0].startswith('#'))
+            header = next(reader)
+            rows   = reader
+            if ranges is not None:                                                  # Seek to each range instead of reading the rest of the file
+                rows = csv.reader(text for off, n in ranges for text in _read_range(f, off, n))
+            if start is not None or end is not None:
+                col  = header.index('valid')
+                t0   = start.strftime('%Y-%m-%d %H:%M') if start else ''      # Times in file sort as strings
+                t1   = end.strftime('%Y-%m-%d %H:%M') if end else None
+                rows = (row for row in rows if row[col] >= t0 and (t1 is None or row[col] < t1))
+            rows = list(rows)
+
+        cols   = list(zip(*rows)) if rows else [()] * len(header)
+        out    = {}
+        for key, col in zip(header, cols):
+            if key == 'station':
+                out[key] = np.asarray(col, dtype='<U4')
+            elif key == 'valid':
+                out['time'] = np.asarray(col, dtype='datetime64[m]')
+            else:
+                try:
+                    out[key] = np.asarray(['nan' if (v == missing or v == '') else '0.0001' if v == trace else v for v in col],
+                                          dtype=np.float32)
+                except ValueError:                                                  # Text column; e.g., skyc1, wxcodes, metar
+                    out[key] = np.asarray(['' if v == missing else v for v in col], dtype=str)
+        if region is not None:
+            keep = (out['lon'] >= region[0]) & (out['lon'] <= region[1]) & \
+                   (out['lat'] >= region[2]) & (out['lat'] <= region[3])
+            out  = {key : val[keep] for key, val in out.items()}
+        return out
+
     def _parse_page(self, file=os.path.join(_dir, 'data', 'scraper.txt'), destination=os.path.join(_dir, 'data', 'json.txt')):
         """
         Name:
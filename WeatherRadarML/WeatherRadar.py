@@ -7,6 +7,9 @@ import fiona
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 
+from WeatherRadarML.wwaVTEC import points_in_geometry
+from WeatherRadarML.readWarnings import clean_geometry
+
 # A list of weather stations, name and location, represented as points
 stations = [ ['KDWH', (-95.553, 30.062)], 
              ['KIAH', (-95.342, 29.985)], 
@@ -41,6 +44,8 @@ def WeatherRadar(shapeFile, count):
         Prints information about stations that are within a warning
     """
     collection = fiona.open(shapeFile)
+    lons       = [station[1][0] for station in stations]
+    lats       = [station[1][1] for station in stations]
 
     # Loop through the weather reports and check if any weather station is in bounds of it
     for i in range(count):
@@ -50,20 +55,16 @@ def WeatherRadar(shapeFile, count):
         except:
             break
 
-        coords = record['geometry']['coordinates'][0]
-        # Check if it's even possible to convert the coordinates into a polygon
-        if len(coords) >= 3:
-            try:
-                poly = Polygon(coords)
-            except AssertionError:
-                continue
-        else:
+        # Convert the coordinates into a valid polygon, repairing it if needed
+        poly = clean_geometry(record['geometry'])
+        if poly is None:
             continue
 
+        # Test all stations at once; stations outside the bounding box skip the polygon test
+        inside = points_in_geometry(poly, lons, lats)
         for station_counter in range(len(stations)):
-            location = Point(stations[station_counter][1])
             station = stations[station_counter][0]
-            if location.within(poly):
+            if inside[station_counter]:
                 if in_bound is False:
                     print('Index:', record['id'])
                     # issued = datetime.strptime(record['properties']['ISSUED'], '%Y%m%d%H%M')
@@ -0,0 +1,312 @@
+import logging
+import os, gc, json, time, platform, subprocess, tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from WeatherRadarML import syntheticData
+from WeatherRadarML.version import __version__
+
+_dateFMT = '%Y-%m-%dT%H:%M:%S'                                                  # Format of dates in results files
+_cache   = os.path.join( os.path.expanduser('~'), '.cache', 'WeatherRadarML', 'benchmarks' )   # Default directory for synthetic data
+
+# Problem sizes; full is close to one day of data for the CONUS
+SIZES = {
+    'small' : {'nsweeps' : 4,  'npoints' : 200,  'nwarnings' : 200,  'nstations' : 100,  'nradar' : 100},
+    'full'  : {'nsweeps' : 14, 'npoints' : 2000, 'nwarnings' : 2000, 'nstations' : None, 'nradar' : 1000},
+}
+
+_station = 'KTLX'                                                               # Station of synthetic volumes
+_time    = datetime(2017, 8, 28)                                                # Start of synthetic data
+
+###############################################################################
+def synthetic_data(size = 'small', data_dir = None):
+    """
+    Name:
+        synthetic_data
+    Purpose:
+        Function to get paths to the synthetic inputs for a problem size,
+        writing any that do not exist yet. Files are kept in data_dir so
+        they are only generated once; everything is generated offline.
+    Inputs:
+        None.
+    Keywords:
+        size     : Problem size; key of SIZES
+        data_dir : Directory for synthetic data
+    Outputs:
+        Returns dictionary with paths to level2 volume, vtec zip, and asos
+        observations
+    """
+    log      = logging.getLogger(__name__)
+    opts     = SIZES[size]
+    data_dir = os.path.join( data_dir or _cache, size )
+    paths    = {'level2' : os.path.join( data_dir, '{}{}_V06'.format(_station, _time.strftime('%Y%m%d_%H%M%S')) ),
+                'vtec'   : os.path.join( data_dir, 'vtec.zip' ),
+                'asos'   : os.path.join( data_dir, 'asos.csv' )}
+    if not os.path.isfile( paths['level2'] ):
+        log.info( 'Writing synthetic volume: {}'.format(paths['level2']) )
+        syntheticData.write_level2( paths['level2'], station = _station, time = _time,
+                                    angles = syntheticData.VCP_ANGLES[:opts['nsweeps']] )
+    if not os.path.isfile( paths['vtec'] ):
+        log.info( 'Writing synthetic warnings: {}'.format(paths['vtec']) )
+        syntheticData.write_vtec_zip( paths['vtec'], opts['nwarnings'],
+                                      start = _time, end = _time + timedelta(days = 1) )
+    if not os.path.isfile( paths['asos'] ):
+        log.info( 'Writing synthetic observations: {}'.format(paths['asos']) )
+        stations, locations = syntheticData.asos_stations( opts['nstations'] )
+        syntheticData.write_asos( paths['asos'], stations, locations,
+                                  start = _time, end = _time + timedelta(days = 1) )
+    return paths
+
+###############################################################################
+def _radar_points(n, max_range = 230.0e3, seed = 0):
+    """Private function to draw lon/lat of random points within range of the synthetic volume's station"""
+    from WeatherRadarML.nexrad.utils.radar_geometry import station_location, cartesian_to_geographic
+    rng        = np.random.default_rng( seed )
+    lon0, lat0 = station_location( _station )[:2]
+    r          = max_range * np.sqrt( rng.random( n ) )
+    az         = rng.uniform( 0.0, 2.0*np.pi, n )
+    return cartesian_to_geographic( r * np.sin(az), r * np.cos(az), lon0, lat0 )
+
+def _stations(paths):
+    """Private function to get unique ASOS station locations from the synthetic observations"""
+    from WeatherRadarML.ASOSInfo import ASOSInfo
+    obs       = ASOSInfo().read_data( paths['asos'] )
+    _, index  = np.unique( obs['station'], return_index = True )
+    return obs['lon'][index].astype(np.float64), obs['lat'][index].astype(np.float64)
+
+def _records(paths):
+    """Private function to read the synthetic warnings; raises if none could be read, so a benchmark does not time an empty loop"""
+    from WeatherRadarML.readWarnings import read_warnings
+    records = read_warnings( paths['vtec'] )
+    if (len(records) == 0):
+        raise Exception( 'No warnings read from {}'.format(paths['vtec']) )
+    return records
+
+###############################################################################
+# Benchmarks. Each one is a setup function that takes the paths from
+# synthetic_data and the problem size options, does any work that should
+# not be timed, and returns the function to time and the number of items
+# (e.g., points, warnings) it processes.
+###############################################################################
+def _level2_reader(paths, opts):
+    from WeatherRadarML.nexrad.utils.nexrad_level2_reader import nexrad_level2_reader
+    def run():
+        return nexrad_level2_reader( paths['level2'] ).get_field( 0, 'reflectivity' )
+    return run, 1
+
+def _level2_pyart(paths, opts):
+    import pyart
+    def run():
+        return pyart.io.read( paths['level2'] )
+    return run, 1
+
+def _nearest_pixels(method):
+    def setup(paths, opts):
+        from WeatherRadarML.nexrad.utils.nexrad_level2_reader import nexrad_level2_reader
+        from WeatherRadarML.nexrad.utils.get_nearest_pixels import radar_nearest_pixels
+        radar    = nexrad_level2_reader( paths['level2'] )
+        lon, lat = _radar_points( opts['npoints'] )
+        radar.get_field( 0, 'reflectivity' )                                    # Decompress sweep outside of timing
+        def run():
+            return radar_nearest_pixels( radar, lon, lat, 'reflectivity', sweeps = [0], method = method )
+        return run, lon.size
+    return setup
+
+def _nearest_radar(paths, opts):
+    from WeatherRadarML.nexrad.utils.get_nearest_radar import get_nearest_radar
+    lon, lat = _stations( paths )
+    lon, lat = lon[:opts['nradar']], lat[:opts['nradar']]
+    get_nearest_radar( lon[0], lat[0] )                                         # Build cached station footprints outside of timing
+    def run():
+        return [get_nearest_radar( x, y ) for x, y in zip(lon, lat)]
+    return run, lon.size
+
+def _read_warnings(paths, opts):
+    from WeatherRadarML.readWarnings import read_warnings
+    nrecords = len( _records( paths ) )
+    def run():
+        return read_warnings( paths['vtec'] )
+    return run, nrecords
+
+def _station_in_warning_loop(paths, opts):
+    from shapely.geometry import Point
+    records  = _records( paths )
+    points   = [Point( x, y ) for x, y in zip( *_stations( paths ) )]
+    def run():                                                                  # Same loop as bin/wwaVTEC_Tests.py
+        return [[point.within( record.geometry ) for point in points] for record in records if record.is_valid]
+    return run, len(records) * len(points)
+
+def _station_in_warning_vectorized(paths, opts):
+    import shapely
+    records  = _records( paths )
+    lon, lat = _stations( paths )
+    def run():                                                                  # As done in datasetBuilder
+        return [shapely.contains_xy( record.geometry, lon, lat ) for record in records]
+    return run, len(records) * lon.size
+
+def _station_in_warning_prefilter(paths, opts):
+    records  = _records( paths )
+    lon, lat = _stations( paths )
+    def run():                                                                  # Bounding box prefilter and cached prepared geometry
+        return [record.contains_points( lon, lat ) for record in records]
+    return run, len(records) * lon.size
+
+def _station_in_warning_store(paths, opts):
+    from WeatherRadarML.readWarnings import ingest_warnings
+    from WeatherRadarML.warningStore import warningStore
+    store    = warningStore.from_records( ingest_warnings( paths['vtec'] ) )
+    lon, lat = _stations( paths )
+    def run():                                                                  # Once per unique geometry, shared by records
+        return store.contains( lon, lat )
+    return run, len(store) * lon.size
+
+def _warning_mask_lookup(paths, opts):
+    import tempfile
+    from WeatherRadarML.ASOSInfo import ASOSInfo
+    from WeatherRadarML.warningMasks import warningMask
+    records = _records( paths )
+    obs     = ASOSInfo().read_data( paths['asos'] )
+    mask    = warningMask.build( os.path.join( tempfile.mkdtemp(), 'mask.npy' ), records,
+                                 _time, _time + timedelta(days = 2) )
+    def run():
+        return mask.lookup( obs['time'], obs['lon'], obs['lat'] )
+    return run, obs['time'].size
+
+def _asos_read(paths, opts):
+    from WeatherRadarML.ASOSInfo import ASOSInfo
+    info = ASOSInfo()
+    def run():
+        return info.read_data( paths['asos'] )
+    return run, None
+
+BENCHMARKS = {
+    'level2_reader_lowest_sweep'    : _level2_reader,
+    'level2_pyart_read'             : _level2_pyart,
+    'nearest_pixels_kdtree'         : _nearest_pixels( 'kdtree' ),
+    'nearest_pixels_polar'          : _nearest_pixels( 'polar' ),
+    'nearest_radar'                 : _nearest_radar,
+    'read_warnings'                 : _read_warnings,
+    'station_in_warning_loop'       : _station_in_warning_loop,
+    'station_in_warning_vectorized' : _station_in_warning_vectorized,
+    'station_in_warning_prefilter'  : _station_in_warning_prefilter,
+    'station_in_warning_store'      : _station_in_warning_store,
+    'warning_mask_lookup'           : _warning_mask_lookup,
+    'asos_read'                     : _asos_read,
+}
+
+###############################################################################
+def _metadata(size, repeat):
+    """Private function to describe the machine and code a run was made with"""
+    try:
+        commit = subprocess.run( ['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                                 cwd = os.path.dirname( os.path.abspath(__file__) ) ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'date'     : datetime.utcnow().strftime( _dateFMT ),
+            'version'  : __version__,
+            'commit'   : commit,
+            'python'   : platform.python_version(),
+            'numpy'    : np.__version__,
+            'platform' : platform.platform(),
+            'cpus'     : os.cpu_count(),
+            'size'     : size,
+            'repeat'   : repeat}
+
+def run_benchmarks(names = None, size = 'small', repeat = 3, data_dir = None, outfile = None):
+    """
+    Name:
+        run_benchmarks
+    Purpose:
+        Function to run benchmarks of the hot paths on synthetic data. Each
+        benchmark is timed repeat times, then run once more under
+        tracemalloc to get its peak memory (tracemalloc slows code down, so
+        it is not on while timing). A benchmark that fails is recorded with
+        its error and the others still run.
+    Inputs:
+        None.
+    Keywords:
+        names    : Names of benchmarks to run (keys of BENCHMARKS); default
+                    is all
+        size     : Problem size; key of SIZES
+        repeat   : Number of timed runs
+        data_dir : Directory for synthetic data; see synthetic_data
+        outfile  : Path of JSON file to write results to
+    Outputs:
+        Returns dictionary with 'meta' and 'results' keys. Results of each
+        benchmark have: items, times (s), best (s), median (s), throughput
+        (items/s, from best time), peak_mb (tracemalloc peak), and error
+        (None unless it failed)
+    """
+    log     = logging.getLogger(__name__)
+    opts    = SIZES[size]
+    paths   = synthetic_data( size, data_dir )
+    names   = list(BENCHMARKS) if names is None else names
+    results = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise Exception( 'Unknown benchmark: {}; must be one of {}'.format(name, list(BENCHMARKS)) )
+        res = {'items' : None, 'times' : [], 'best' : None, 'median' : None,
+               'throughput' : None, 'peak_mb' : None, 'error' : None}
+        try:
+            run, res['items'] = BENCHMARKS[name]( paths, opts )
+            for i in range( repeat ):
+                gc.collect()
+                t0 = time.perf_counter()
+                run()
+                res['times'].append( time.perf_counter() - t0 )
+            gc.collect()
+            tracemalloc.start()
+            try:
+                run()
+                res['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1.0e6
+            finally:
+                tracemalloc.stop()
+        except Exception as err:
+            log.error( 'Benchmark {} failed: {}'.format(name, err) )
+            res['error'] = '{}: {}'.format(type(err).__name__, err)
+        if res['times']:
+            res['best']   = min( res['times'] )
+            res['median'] = float( np.median( res['times'] ) )
+            if res['items']: res['throughput'] = res['items'] / res['best']
+        log.info( '{:32} {}'.format(name, 'FAILED' if res['error'] else '{:10.4f} s'.format(res['best'])) )
+        results[name] = res
+
+    out = {'meta' : _metadata( size, repeat ), 'results' : results}
+    if outfile is not None:
+        dirname = os.path.dirname( outfile )
+        if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+        with open( outfile, 'w' ) as fid:
+            json.dump( out, fid, indent = 2 )
+    return out
+
+###############################################################################
+def compare_results(base, new, threshold = 0.10):
+    """
+    Name:
+        compare_results
+    Purpose:
+        Function to compare two benchmark runs; e.g., before and after a
+        change
+    Inputs:
+        base      : Results dictionary (or path to JSON file) of reference run
+        new       : Results dictionary (or path to JSON file) to compare
+    Keywords:
+        threshold : Fractional change in best time flagged as a regression
+                     or improvement
+    Outputs:
+        Returns list of (name, base best, new best, ratio, flag) tuples for
+        benchmarks in both runs; flag is 'slower', 'faster', or ''
+    """
+    if isinstance(base, str):
+        with open( base, 'r' ) as fid: base = json.load( fid )
+    if isinstance(new, str):
+        with open( new, 'r' ) as fid: new = json.load( fid )
+    out = []
+    for name, res in new['results'].items():
+        ref = base['results'].get( name, None )
+        if (ref is None) or (ref['best'] is None) or (res['best'] is None): continue
+        ratio = res['best'] / ref['best']
+        flag  = 'slower' if (ratio > 1.0 + threshold) else ('faster' if (ratio < 1.0 - threshold) else '')
+        out.append( (name, ref['best'], res['best'], ratio, flag,) )
+    return out
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+import logging
+import os
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+
+from WeatherRadarML.ASOSInfo import ASOSInfo
+from WeatherRadarML.warningStore import warningStore, update_store
+from WeatherRadarML.timeAlign import asof_join, window_aggregate
+from WeatherRadarML.warningMasks import warningMask
+from WeatherRadarML.profiling import timer, snapshot, merge
+from WeatherRadarML.nexrad.utils.get_nearest_radar import get_nearest_radar
+from WeatherRadarML.nexrad.utils.radar_coverage import load_coverage
+from WeatherRadarML.nexrad.utils.get_nearest_pixels import radar_nearest_pixels
+from WeatherRadarML.nexrad.utils.nexrad_level2_files import nexrad_level2_files
+from WeatherRadarML.nexrad.utils.nexrad_level2_reader import nexrad_level2_reader
+
+_shardFMT = '%Y%m%d'                                                            # Shard files are named by day
+_warnings = {}                                                                  # Per-process cache of warnings for one year; see _load_warnings
+
+def build_dataset(start, end, region, outdir, asos_file, warnings_dir,
+        field       = 'reflectivity',
+        sweeps      = (0,),
+        k           = 9,
+        max_dist    = 1.0,
+        method      = 'polar',
+        phenom      = 'FF',
+        tolerance   = timedelta(minutes = 10),
+        engine      = None,
+        accumulate  = None,
+        window      = timedelta(hours = 1),
+        nexrad_root = '/data1/',
+        mask        = None,
+        concurrency = 4):
+    """
+    Name:
+        build_dataset
+    Purpose:
+        Function to build labeled training samples by joining ASOS
+        observations, radar pixels closest to the ASOS station, and
+        whether the station was inside an active NWS warning. The ASOS file
+        is indexed by day once; each day is then processed by a worker
+        process, which reads only that day's byte ranges of the file, and
+        written to its own shard file in outdir, so memory use is bounded
+        by one day of data per worker. The warning
+        store of each year is built or refreshed once before the workers
+        start, and each worker keeps the year it last used in memory.
+        Days whose shard already exists are skipped, so an interupted
+        build can be resumed by running the same command again.
+    Inputs:
+        start        : Datetime of first day to build
+        end          : Datetime of last day to build (inclusive)
+        region       : Region to use stations from; (lonMin, lonMax, latMin, latMax)
+        outdir       : Directory to write shard files to
+        asos_file    : Path to ASOS observations downloaded with
+                        ASOSInfo.download_data
+        warnings_dir : Directory containing the YYYY_all.zip files
+                        downloaded with getWWAZips
+    Keywords:
+        field        : Radar field to extract
+        sweeps       : Sweeps to extract radar pixels for
+        k            : Number of radar pixels per sweep
+        max_dist     : Maximum distance (km) of radar pixels from the station
+        method       : Pixel lookup method; see get_nearest_pixels
+        phenom       : 2 character VTEC phenomenon code used for labels
+        tolerance    : Maximum time difference between an observation and
+                        the radar volume used for it
+        engine       : radar_features instance; if set, its feature vector
+                        is also computed for each observation
+        accumulate   : If set, also aggregate radar pixels from all volumes
+                        in the window before each observation; one of sum,
+                        mean, count, max, min. See timeAlign.window_aggregate
+        window       : Length of the accumulation window
+        nexrad_root  : Top-level root directory of local Level 2 files
+        mask         : Path to a warning mask built with warningMask.build
+                        for the same phenom; if set, labels are looked up
+                        in it instead of testing points against polygons
+        concurrency  : Number of days to process at once
+    Outputs:
+        Returns list of paths to shard files covering start to end. Each
+        shard is an .npz file with one array (column) per key:
+            station, time, lon, lat : ASOS station and observation time
+            radar, volume_time      : Radar and volume the pixels are from
+            features                : [nrow, nsweep, k] radar pixels
+            features_<accumulate>   : [nrow, nsweep, k] accumulated pixels
+            stats                   : [nrow, nfeatures] radar features; see
+                                       engine.feature_names
+            obs_<name>              : ASOS observation columns
+            label                   : 1 if inside an active warning
+    """
+    log = logging.getLogger(__name__)
+    t0  = timer('dataset.total').start()
+    if not os.path.isdir( outdir ): os.makedirs( outdir )                       # If output directory does NOT exist, create it
+
+    config = {'field' : field, 'sweeps' : tuple(sweeps), 'k' : k, 'max_dist' : max_dist,
+              'method' : method, 'phenom' : phenom, 'nexrad_root' : nexrad_root,
+              'tolerance' : tolerance, 'accumulate' : accumulate, 'window' : window,
+              'engine' : engine, 'asos_file' : asos_file, 'region' : tuple(region),
+              'stores' : {}, 'mask' : mask}
+
+    with timer('dataset.asos_index'):
+        days = ASOSInfo.day_index( asos_file )                                  # Byte ranges of each day's observations
+
+    shards = []
+    tasks  = []
+    date   = datetime(start.year, start.month, start.day)
+    while (date <= end):                                                        # Iterate over days
+        shard = os.path.join( outdir, date.strftime(_shardFMT) + '.npz' )
+        shards.append( shard )
+        if os.path.isfile( shard ):                                             # If shard already built
+            log.debug( 'Shard exists, skipping: {}'.format(shard) )
+        else:
+            tasks.append( (date, shard, days.get( date.strftime('%Y-%m-%d'), [] ), config,) )
+        date += timedelta(days = 1)
+
+    if mask:                                                                    # Labels must mean the same with or without a mask
+        built = warningMask( mask ).phenom
+        if (built != sorted( set( np.atleast_1d( phenom ).tolist() ) )):
+            raise Exception( 'Mask {} was built for phenom {}, not {}'.format(mask, built, phenom) )
+    if not mask:                                                                # Build or refresh stores here, once, so workers only read them
+        for year in sorted( set( task[0].year for task in tasks ) ):
+            config['stores'][year] = _year_store( year, warnings_dir )
+
+    log.info( 'Building {} of {} shards with {} workers'.format(len(tasks), len(shards), concurrency) )
+    nrows = 0
+    with Pool( concurrency ) as pool:                                           # Workers are reused so each year's store is read once per worker
+        for shard, n, prof in pool.imap_unordered( _build_day, tasks, chunksize = 1 ):
+            merge( prof )                                                       # Add timers of worker
+            log.info( '   {:8d} rows : {}'.format(n, shard) )
+            nrows += n
+    log.info( 'Built {} rows in {:0.1f} s'.format(nrows, t0.stop()) )
+    return shards
+
+###############################################################################
+def read_shards(shards):
+    """
+    Name:
+        read_shards
+    Purpose:
+        Function to concatenate shard files written by build_dataset
+    Inputs:
+        shards : List of paths to shard files
+    Keywords:
+        None.
+    Outputs:
+        Returns dictionary of numpy arrays; one per column
+    """
+    data = {}
+    for shard in shards:
+        with np.load( shard ) as fid:
+            for key in fid.files:
+                data.setdefault( key, [] ).append( fid[key] )
+    return {key : np.concatenate( val ) for key, val in data.items()}
+
+###############################################################################
+def _build_day(args):
+    """
+    Name:
+        _build_day
+    Purpose:
+        Private function to build one shard; runs in a worker process
+    Inputs:
+        args : Tuple of (date, shard, byte ranges of the day in the ASOS
+                file, config) built by build_dataset
+    Keywords:
+        None.
+    Outputs:
+        Returns path to the shard, number of rows in it, and profiling
+        snapshot of the worker
+    """
+    date, shard, ranges, config = args
+    obs      = ASOSInfo.read_data( config['asos_file'], start = date, end = date + timedelta(days = 1),
+                                   region = config['region'], ranges = ranges ) # Only this day's part of the file is read
+    nobs     = obs['station'].size
+    nsweep   = len( config['sweeps'] )
+    radar    = np.full( nobs, '', dtype = '<U4' )
+
+    # Pair each station with its closest radar
+    stations, index = np.unique( obs['station'], return_index = True )
+    statRadar       = np.full( stations.size, '', dtype = '<U4' )
+    statAlt         = np.full( stations.size, np.nan )                          # Station elevation (m) for height-aware pixel lookup
+    coverage        = load_coverage()                                           # Precomputed pairs of known ASOS stations
+    for i, j in enumerate( index ):
+        if stations[i] in coverage:
+            statRadar[i] = coverage.nearest( stations[i] )
+            statAlt[i]   = coverage.elevation( stations[i] )
+            continue
+        radars = get_nearest_radar( float(obs['lon'][j]), float(obs['lat'][j]) )
+        if (len(radars) > 0): statRadar[i] = radars[0][0]
+    radar[:] = statRadar[ np.searchsorted( stations, obs['station'] ) ]
+
+    # List volumes from all radars
+    volRadar, volTime, volFile = [], [], []
+    for statid in np.unique( statRadar[statRadar != ''] ):
+        times, files = nexrad_level2_files( date - timedelta(days = 1), statid,
+                                root = config['nexrad_root'], days = 3 )
+        volRadar.append( np.full( times.size, statid, dtype = '<U4' ) )
+        volTime.append( times )
+        volFile.extend( files )
+    volRadar = np.concatenate( volRadar ) if volRadar else np.zeros( 0, dtype = '<U4' )
+    volTime  = np.concatenate( volTime  ) if volTime  else np.zeros( 0, dtype = 'datetime64[s]' )
+
+    # Volumes needed; closest to each observation and, if accumulating, all in the window before it
+    match, _ = asof_join( radar, obs['time'], volRadar, volTime,
+                    tolerance = config['tolerance'], direction = 'nearest' )
+    need     = np.zeros( volTime.size, dtype = bool )
+    need[ match[match >= 0] ] = True
+    if config['accumulate']:
+        after, _ = asof_join( volRadar, volTime, radar, obs['time'],
+                        tolerance = config['window'], direction = 'forward' )
+        need    |= after >= 0
+
+    # Extract radar pixels at all stations using a radar; each volume is opened once
+    rowStat, rowTime, rowPix, rowEng = [], [], [], []
+    for v in np.flatnonzero( need ):
+        sel = np.flatnonzero( statRadar == volRadar[v] )
+        try:
+            rad = nexrad_level2_reader( volFile[v] )
+        except ValueError:
+            import pyart
+            rad = pyart.io.read( volFile[v], delay_field_loading = True )
+        kwargs = {}
+        if (config['method'] == 'height'):                                      # Missing elevations fall back to the radar's
+            kwargs['alt'] = statAlt[sel]
+        rowPix.append( radar_nearest_pixels( rad, obs['lon'][index[sel]], obs['lat'][index[sel]],
+                            config['field'], k = config['k'], max_dist = config['max_dist'],
+                            sweeps = config['sweeps'], method = config['method'], **kwargs ) )
+        if config['engine']:
+            rowEng.append( config['engine'].compute( rad, obs['lon'][index[sel]], obs['lat'][index[sel]] ) )
+        rowStat.append( stations[sel] )
+        rowTime.append( np.full( sel.size, volTime[v] ) )
+    rowStat = np.concatenate( rowStat ) if rowStat else np.zeros( 0, dtype = '<U4' )
+    rowTime = np.concatenate( rowTime ) if rowTime else np.zeros( 0, dtype = 'datetime64[s]' )
+    rowPix  = np.concatenate( rowPix  ) if rowPix  else np.zeros( (0, nsweep, config['k']), dtype = np.float32 )
+
+    row, dt  = asof_join( obs['station'], obs['time'], rowStat, rowTime,
+                    tolerance = config['tolerance'], direction = 'nearest' )
+    features = np.full( (nobs, nsweep, config['k']), np.nan, dtype = np.float32 )
+    features[row >= 0] = rowPix[ row[row >= 0] ]
+    if config['engine']:
+        rowEng = np.concatenate( rowEng ) if rowEng else np.zeros( (0, config['engine'].nfeatures), dtype = np.float32 )
+        stats  = np.full( (nobs, config['engine'].nfeatures), np.nan, dtype = np.float32 )
+        stats[row >= 0] = rowEng[ row[row >= 0] ]
+    volume   = obs['time'].astype('datetime64[s]') + dt                         # NaT where no volume matched
+
+    # Label observations inside an active warning
+    label = np.zeros( nobs, dtype = np.int8 )
+    if config['mask']:                                                          # Look up labels in rasterized warnings
+        with timer('labels.mask_lookup'):
+            label[:] = warningMask( config['mask'] ).lookup( obs['time'], obs['lon'], obs['lat'] )
+    else:
+        store = _load_warnings( config['stores'].get( date.year, None ) )
+        if store is not None:
+            with timer('labels.polygon_contains'):
+                label[:] = store.label( obs['time'], obs['lon'], obs['lat'], phenom = config['phenom'] )
+
+    out = {'station' : obs['station'], 'time' : obs['time'], 'lon' : obs['lon'], 'lat' : obs['lat'],
+           'radar' : radar, 'volume_time' : volume, 'features' : features, 'label' : label}
+    if config['engine']:
+        out['stats'] = stats
+    if config['accumulate']:                                                    # Radar pixels over the window before each observation
+        out['features_' + config['accumulate']] = window_aggregate(
+                obs['station'], obs['time'], rowStat, rowTime, rowPix,
+                window = config['window'], how = config['accumulate'] ).astype( np.float32 )
+    for key, val in obs.items():
+        if key not in out: out['obs_' + key] = val
+
+    tmp = shard + '.tmp.npz'
+    np.savez_compressed( tmp, **out )
+    os.replace( tmp, shard )                                                    # Atomic rename so partial shards never look complete
+    return shard, nobs, snapshot()
+
+###############################################################################
+def _year_store(year, warnings_dir):
+    """
+    Name:
+        _year_store
+    Purpose:
+        Private function to build or refresh the warningStore of a year.
+        The store is kept on disk next to the zip file so only new records
+        are ingested when the zip changes. Runs in the parent process
+        before any worker starts, so workers never write the same store.
+    Inputs:
+        year         : Year of warnings
+        warnings_dir : Directory containing YYYY_all.zip files
+    Keywords:
+        None.
+    Outputs:
+        Returns path to the store, or None if there is no zip file
+    """
+    zipfile = os.path.join( warnings_dir, '{}_all.zip'.format(year) )
+    if not os.path.isfile( zipfile ): return None
+    path    = os.path.splitext( zipfile )[0] + '.npz'
+    update_store( zipfile, path )
+    return path
+
+def _load_warnings(path):
+    """
+    Name:
+        _load_warnings
+    Purpose:
+        Private function to read a store written by _year_store. The store
+        is kept for the life of the worker process, so days of the same
+        year share it. Point-in-polygon tests run once per unique geometry.
+    Inputs:
+        path : Path to store; None if there are no warnings
+    Keywords:
+        None.
+    Outputs:
+        Returns warningStore instance, or None
+    """
+    if path is None: return None
+    if path not in _warnings:
+        _warnings.clear()                                                       # Only keep one year in memory
+        _warnings[path] = warningStore.load( path )
+    return _warnings[path]
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig( level = logging.INFO )
+    if (len(sys.argv) != 7):
+        print( 'Usage: datasetBuilder.py YYYYMMDD YYYYMMDD lonMin,lonMax,latMin,latMax outdir asos_file warnings_dir' )
+        exit(1)
+    build_dataset( datetime.strptime(sys.argv[1], '%Y%m%d'), datetime.strptime(sys.argv[2], '%Y%m%d'),
+                   [float(x) for x in sys.argv[3].split(',')], *sys.argv[4:] )
@@ -1,46 +1,198 @@
 #!/usr/bin/env python3
-import os, time
+import logging
+import os, json
 from datetime import datetime
-from urllib.request import urlopen
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+from multiprocessing.pool import ThreadPool
+
+from WeatherRadarML.profiling import timer, count
 
 _baseURL   = 'https://mesonet.agron.iastate.edu/pickup/wwa/'                    # Base URL for all wwa zip files
 _startYear = 1986                                                               # Start year for zip files
-def getWWAZips( outDir ):
+_fileFMT   = '{}_all.zip'                                                       # File name for year
+_manifest  = 'manifest.json'                                                    # Name of manifest file in output directory
+_partial   = '.part'                                                            # Suffix of files being downloaded
+_chunkSize = 1 << 20                                                            # Bytes to read from URL at a time
+
+###############################################################################
+def getWWAZips( outDir,
+        baseURL     = _baseURL,
+        years       = None,
+        concurrency = 4,
+        refresh     = False,
+        timeout     = 60):
+    """
+    Name:
+        getWWAZips
+    Purpose:
+        Function to download the yearly watch/warning/advisory zip files
+        from IEM. Files are fetched concurrently and streamed to disk in
+        chunks. The ETag, Last-Modified, and size of each file are kept in
+        a manifest in the output directory:
+            - Files of past years that are complete are not requested again
+            - Other files are requested with If-None-Match/If-Modified-Since,
+              so unchanged files are not downloaded
+            - Interrupted downloads are resumed with a Range request if the
+              server supports it
+        A nightly run thus only refetches the current year's file.
+    Inputs:
+        outDir      : Directory to download files to
+    Keywords:
+        baseURL     : URL of directory with the zip files; e.g., a local
+                        http.server for testing
+        years       : Years to download; default is 1986 to current year
+        concurrency : Number of concurrent downloads
+        refresh     : Set to check all files with the server, not just
+                        the current year
+        timeout     : Timeout (s) for connecting/reading from the server
+    Outputs:
+        Returns dictionary with number of files downloaded, not modified,
+        skipped, and failed
+    """
+    log = logging.getLogger(__name__)
     if not os.path.isdir( outDir ): os.makedirs( outDir )                       # If output directory does NOT exist, create it
+    if not baseURL.endswith('/'): baseURL += '/'
+
+    now      = datetime.utcnow().year
+    years    = range(_startYear, now+1) if years is None else years
+    manifest = _read_manifest( outDir )
+    status   = {'downloaded' : 0, 'not_modified' : 0, 'skipped' : 0, 'failed' : 0}
+
+    tasks = []
+    for year in years:                                                          # Iterate over years
+        fileName = _fileFMT.format(year)
+        entry    = manifest.get( fileName, None )
+        if (not refresh) and (year < now) and _complete( outDir, fileName, entry ):  # Past years do not change once complete
+            status['skipped'] += 1
+            continue
+        tasks.append( (baseURL + fileName, os.path.join( outDir, fileName ), entry, timeout,) )
+
+    t0 = timer('download.wwa_total').start()
+    with ThreadPool( max(min(concurrency, len(tasks)), 1) ) as pool:
+        for fileName, state, entry in pool.imap_unordered( _fetch, tasks ):
+            status[state] += 1
+            if entry is not None:
+                manifest[fileName] = entry
+                _write_manifest( outDir, manifest )                             # Write after each file so an interrupted run keeps its progress
+    dt = t0.stop()
+    log.info( 'WWA zips: {downloaded} downloaded, {not_modified} not modified, '
+              '{skipped} skipped, {failed} failed in {dt:0.1f} s'.format(dt = dt, **status) )
+    return status
+
+###############################################################################
+def _read_manifest(outDir):
+    """Private function to read manifest of downloaded files; empty if missing or unreadable"""
+    path = os.path.join( outDir, _manifest )
+    try:
+        with open( path, 'r' ) as fid:
+            return json.load( fid )
+    except:
+        return {}
+
+def _write_manifest(outDir, manifest):
+    """Private function to write manifest atomically"""
+    path = os.path.join( outDir, _manifest )
+    with open( path + '.tmp', 'w' ) as fid:
+        json.dump( manifest, fid, indent = 1, sort_keys = True )
+    os.replace( path + '.tmp', path )
+
+def _complete(outDir, fileName, entry):
+    """Private function to check if local file matches manifest entry"""
+    path = os.path.join( outDir, fileName )
+    return (entry is not None) and (entry.get('size', None) is not None) and \
+            os.path.isfile( path ) and (os.stat( path ).st_size == entry['size'])
+
+###############################################################################
+def _fetch(args):
+    """
+    Name:
+        _fetch
+    Purpose:
+        Private thread worker to download one file, conditionally and with
+        resume
+    Inputs:
+        args : Tuple of (url, outFile, manifest entry, timeout)
+    Keywords:
+        None.
+    Outputs:
+        Returns file name, status (downloaded, not_modified, or failed),
+        and new manifest entry (None if unchanged)
+    """
+    url, outFile, entry, timeout = args
+    log      = logging.getLogger(__name__)
+    fileName = os.path.basename( outFile )
+    part     = outFile + _partial
+    entry    = entry or {}
+    headers  = {}
+    offset   = os.stat( part ).st_size if os.path.isfile( part ) else 0
+
+    validator = entry.get('etag', None) or entry.get('last_modified', None)
+    if offset > 0 and validator:                                                # Resume only if we know the partial file is of the same version
+        headers['Range']    = 'bytes={}-'.format(offset)
+        headers['If-Range'] = validator
+    elif _complete( os.path.dirname(outFile), fileName, entry ):                # Only ask for the file if it changed
+        if entry.get('etag', None):          headers['If-None-Match']     = entry['etag']
+        if entry.get('last_modified', None): headers['If-Modified-Since'] = entry['last_modified']
 
-    t0      = time.time()
-    totSize = 0
-    for year in range(_startYear, datetime.now().year+1):                       # Iterate from start year to current year
-        fileName = '{}_all.zip'.format(year)                                    # Set file name based on year
-        outFile  = os.path.join( outDir, fileName )                             # Set outFile using outDir and fileName 
-        url      = _baseURL + fileName                                          # Set url using _baseURL and file name
-        try:                                                                    # Try to
-            res  = urlopen( url )                                               # Open the url
-            size = int(res.getheader('Content-Length') )                        # Get size of remote file
-        except:                                                                 # On exception
-            print( 'Failed to open URL: {}'.format( url ) )                     # Print error
-            continue                                                            # Skip to next file
-
-        if os.path.isfile( outFile ):                                           # If the output file exists
-            if (os.stat(outFile).st_size == size):                              # If the local file's size matches the remote size
-                print( 'File already downloaded: {}'.format(outFile) )
-                continue                                                        # Skip to next file
+    new = None                                                                  # Manifest entry for the version being downloaded
+    try:
+        with timer('download.wwa'), urlopen( Request( url, headers = headers ), timeout = timeout ) as res:
+            resume = (res.status == 206)                                        # Server is sending the rest of the file
+            new    = {'etag'          : res.getheader('ETag'),
+                      'last_modified' : res.getheader('Last-Modified'),
+                      'size'          : None,
+                      'url'           : url}
+            size   = res.getheader('Content-Length')
+            size   = None if size is None else int(size) + (offset if resume else 0)
+            if resume:
+                log.info( 'Resuming at {} bytes: {} --> {}'.format(offset, url, outFile) )
             else:
-                print( 'File size missmatch, redownloading: {}'.format(outFile) )
+                log.info( 'Downloading: {} --> {}'.format(url, outFile) )
+            nbytes = _stream( res, part, 'ab' if resume else 'wb' )
+    except HTTPError as err:
+        if (err.code == 304):                                                   # Not modified
+            log.debug( 'Not modified: {}'.format(url) )
+            return fileName, 'not_modified', None
+        if (err.code == 416) and os.path.isfile( part ):                        # Partial file is not valid for the remote file; start over next time
+            os.remove( part )
+        log.error( 'Failed to download {}: {}'.format(url, err) )
+        return fileName, 'failed', None
+    except Exception as err:                                                    # Partial file is kept so the download can be resumed
+        log.error( 'Failed to download {}: {}'.format(url, err) )
+        return fileName, 'failed', new if new and (new['etag'] or new['last_modified']) else None
 
-        print( 'Downloading: {} --> {}'.format(url, outFile) )                  # Print information
-        with open(outFile, 'wb') as fid:                                        # Open local file for writing
-            fid.write( res.read() )                                             # Read data from URL and write to file
-        totSize += size                                                         # Increment total size of download
+    count( 'download.wwa_bytes', nbytes )
+    total = os.stat( part ).st_size
+    if (size is not None) and (total != size):
+        log.error( 'Incomplete download, will resume next time: {}'.format(url) )
+        return fileName, 'failed', new
+    os.replace( part, outFile )
+    new['size'] = total
+    return fileName, 'downloaded', new
 
-    if (size > 0):                                                              # If size greater than zero
-        dt = time.time()-t0                                                     # Compute download time
-        print( 'Downloaded {} bytes in {} seconds'.format(totSize,dt) )         # Print information
+def _stream(res, path, mode):
+    """Private function to copy response to file in chunks; returns number of bytes written"""
+    nbytes = 0
+    with open( path, mode ) as fid:
+        while True:
+            chunk = res.read( _chunkSize )
+            if not chunk: break
+            fid.write( chunk )
+            nbytes += len(chunk)
+    return nbytes
 
 
 if __name__ == "__main__":
-    import sys
-    if (len(sys.argv) != 2):
-        print( 'Must enter output directory' )
-        exit(1)
-    getWWAZips( sys.argv[1] )
+    import argparse
+    parser = argparse.ArgumentParser( description = 'Download IEM watch/warning/advisory zip files' )
+    parser.add_argument( 'outdir',        help = 'Directory to download files to' )
+    parser.add_argument( '--base-url',    default = _baseURL, help = 'URL of directory with zip files' )
+    parser.add_argument( '--years',       type = int, nargs = '+', help = 'Years to download; default is all' )
+    parser.add_argument( '--concurrency', type = int, default = 4, help = 'Number of concurrent downloads' )
+    parser.add_argument( '--refresh',     action = 'store_true', help = 'Check all files with server, not just current year' )
+    args = parser.parse_args()
+    logging.basicConfig( level = logging.INFO )
+    status = getWWAZips( args.outdir, baseURL = args.base_url, years = args.years,
+                         concurrency = args.concurrency, refresh = args.refresh )
+    exit( 1 if status['failed'] > 0 else 0 )
@@ -0,0 +1,205 @@
+import logging
+import warnings
+
+import numpy as np
+
+from ...profiling import timer, publish
+
+_refField = 'reference_velocity'                                                # Name of reference field added to sweeps sent to workers
+
+###############################################################################
+def _import_pyart():
+    """Import pyart, suppressing FutureWarning; pyart messes up the user's path, so only import when needed"""
+    warnings.filterwarnings('ignore', category=FutureWarning)
+    import pyart
+    warnings.resetwarnings()
+    return pyart
+
+###############################################################################
+def velocity_sweeps(radar, vel_field = 'velocity', sweeps = None):
+    """
+    Name:
+        velocity_sweeps
+    Purpose:
+        Function to find the sweeps of a volume that need dealiasing; i.e.,
+        sweeps that have any valid radial velocity. The surveillance cuts
+        of NEXRAD split cut VCPs have no velocity and are skipped.
+    Inputs:
+        radar     : pyart.core.Radar object
+    Keywords:
+        vel_field : Name of radial velocity field
+        sweeps    : Sweeps that are exported; default is all sweeps
+    Outputs:
+        Returns list of sweep numbers
+    """
+    if vel_field not in radar.fields:
+        return []
+    data = radar.fields[vel_field]['data']
+    if sweeps is None: sweeps = range( radar.nsweeps )
+    out  = []
+    for sweep in sweeps:
+        vals = data[ radar.get_slice( sweep ) ]
+        if np.ma.count( vals ) > 0: out.append( sweep )
+    return out
+
+###############################################################################
+def _sweep_key(radar, sweep):
+    """Private function to get key of sweep; (fixed angle rounded to 0.1 degree, number of earlier sweeps at that angle), so SAILS repeats are kept apart"""
+    angles = np.round( radar.fixed_angle['data'][:sweep+1].astype(np.float64), 1 )
+    return (float(angles[-1]), int( np.count_nonzero( angles[:-1] == angles[-1] ) ),)
+
+def volume_state(radar, corr_vel_field = 'corrected_velocity', sweeps = None):
+    """
+    Name:
+        volume_state
+    Purpose:
+        Function to keep the dealiased velocities of a volume so that they
+        can be used as reference for the next volume of the same station.
+        Sweeps are keyed by fixed angle (rounded to 0.1 degree) and
+        occurrence of that angle in the volume, so the repeated low-level
+        cuts of SAILS volumes each keep their own reference.
+    Inputs:
+        radar          : pyart.core.Radar object with dealiased velocity
+    Keywords:
+        corr_vel_field : Name of dealiased velocity field
+        sweeps         : Sweeps to keep; default is all sweeps
+    Outputs:
+        Returns dictionary of (azimuth, range, velocity) tuples
+    """
+    state = {}
+    if corr_vel_field not in radar.fields:
+        return state
+    data = radar.fields[corr_vel_field]['data']
+    if sweeps is None: sweeps = range( radar.nsweeps )
+    for sweep in sweeps:
+        ray = radar.get_slice( sweep )
+        state[ _sweep_key( radar, sweep ) ] = (radar.azimuth['data'][ray].copy(), radar.range['data'].copy(), data[ray].copy(),)
+    return state
+
+###############################################################################
+def reference_velocity(state, radar, sweep):
+    """
+    Name:
+        reference_velocity
+    Purpose:
+        Function to map dealiased velocities of the previous volume onto a
+        sweep of the current volume, using the nearest ray in azimuth and
+        the nearest gate in range. The sweep at the same angle and
+        occurrence is used; if the previous volume has fewer sweeps at the
+        angle (e.g., another number of SAILS cuts), its last one is used.
+    Inputs:
+        state : Output of volume_state for the previous volume
+        radar : pyart.core.Radar object
+        sweep : Sweep number
+    Keywords:
+        None.
+    Outputs:
+        Returns [nrays, ngates] masked array, or None if the previous volume
+        has no sweep at the same angle
+    """
+    if not state: return None
+    key = _sweep_key( radar, sweep )
+    if key not in state:
+        same = [k for k in state if k[0] == key[0]]
+        if (len(same) == 0): return None
+        key  = max( same )                                                      # Latest sweep at this angle
+    az0, rng0, vel0 = state[key]
+    az   = radar.azimuth['data'][ radar.get_slice( sweep ) ]
+    rng  = radar.range['data']
+    order = np.argsort( az0 )
+    azs   = az0[order]
+    i     = np.searchsorted( azs, az ) % azs.size                               # Ray after each azimuth, wrapping around north
+    j     = (i - 1) % azs.size                                                  # Ray before
+    di    = np.abs( (azs[i] - az + 180.0) % 360.0 - 180.0 )
+    dj    = np.abs( (azs[j] - az + 180.0) % 360.0 - 180.0 )
+    rays  = order[ np.where( di < dj, i, j ) ]
+    gates = np.clip( np.round( (rng - rng0[0]) / (rng0[1] - rng0[0]) ).astype(np.int64), 0, rng0.size - 1 )
+    ref   = vel0[ rays[:,None], gates[None,:] ]
+    return np.ma.masked_where( np.broadcast_to( (rng < rng0[0]) | (rng > rng0[-1]), ref.shape ), ref )
+
+###############################################################################
+def _sweep_radar(radar, sweep, vel_field, reference):
+    """Private function to extract a single sweep with only the velocity (and reference) fields; keeps data sent to workers small"""
+    fields = radar.fields
+    radar.fields = {vel_field : fields[vel_field]}
+    try:
+        sub = radar.extract_sweeps( [sweep] )
+    finally:
+        radar.fields = fields
+    if reference is not None:
+        sub.add_field( _refField, {'data' : reference}, replace_existing = True )
+    return sub
+
+def _dealias_sweep(args):
+    """Private worker; dealias one sweep; errors are logged, not raised"""
+    sweep, sub, vel_field, kwargs = args
+    pyart = _import_pyart()
+    log   = logging.getLogger(__name__)
+    try:
+        with timer('convert.dealias_sweep'):
+            out = pyart.correct.dealias_region_based( sub,
+                        vel_field     = vel_field,
+                        ref_vel_field = _refField if _refField in sub.fields else None,
+                        **kwargs )
+    except Exception as err:
+        log.error( 'Failed to dealias sweep {}: {}'.format(sweep, err) )
+        return sweep, None
+    finally:
+        publish( log )                                                          # Send timers to main process; no-op if run in main process
+    return sweep, out['data']
+
+###############################################################################
+def dealias_volume(radar, pool,
+        vel_field      = 'velocity',
+        corr_vel_field = 'corrected_velocity',
+        sweeps         = None,
+        state          = None,
+        **kwargs):
+    """
+    Name:
+        dealias_volume
+    Purpose:
+        Function to dealias radial velocity with the Py-ART region based
+        algorithm, one sweep per worker. The algorithm works on each sweep
+        independently, so sweeps are sent to the pool as single-sweep radar
+        objects that only carry the velocity field, and the results are put
+        back into a field of the volume.
+    Inputs:
+        radar          : pyart.core.Radar object; corrected field is added
+        pool           : multiprocessing.Pool to dealias sweeps in; may be
+                          shared by several threads
+    Keywords:
+        vel_field      : Name of radial velocity field
+        corr_vel_field : Name of dealiased velocity field to add
+        sweeps         : Sweeps that are exported; other sweeps are not
+                          dealiased. Default is all sweeps
+        state          : Output of volume_state for the previous volume of
+                          the station. Its dealiased velocities are used as
+                          reference to pick the Nyquist interval of each
+                          sweep, so consecutive volumes are consistent
+        All other keywords are passed to dealias_region_based
+    Outputs:
+        Returns volume_state of this volume for use with the next one
+    """
+    log    = logging.getLogger(__name__)
+    t0     = timer('convert.dealias').start()
+    todo   = velocity_sweeps( radar, vel_field, sweeps )
+    data   = np.ma.masked_all( radar.fields[vel_field]['data'].shape, dtype = np.float32 ) \
+                if vel_field in radar.fields else None
+    tasks  = [(sweep, _sweep_radar( radar, sweep, vel_field, reference_velocity( state, radar, sweep ) ), vel_field, kwargs,)
+                for sweep in todo]
+    ndone  = 0
+    for sweep, vals in pool.imap_unordered( _dealias_sweep, tasks ):
+        if vals is None: continue
+        data[ radar.get_slice( sweep ) ] = vals
+        ndone += 1
+
+    if data is None:
+        log.warning( 'No {} field to dealias'.format(vel_field) )
+        return {}
+    pyart = _import_pyart()
+    field = pyart.config.get_metadata( corr_vel_field )
+    field['data'] = data
+    radar.add_field( corr_vel_field, field, replace_existing = True )
+    log.debug( 'Dealiased {} of {} sweeps in {:0.1f} s'.format(ndone, radar.nsweeps, t0.stop()) )
+    return volume_state( radar, corr_vel_field, todo )
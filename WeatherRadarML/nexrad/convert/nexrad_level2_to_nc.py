@@ -1,36 +1,42 @@
 import logging
 from logging.handlers import QueueHandler
 
-import os, shutil, time, secrets, warnings
+import os, shutil, secrets, warnings
 
 from datetime import datetime, timedelta
 from subprocess import Popen, PIPE, STDOUT, DEVNULL
 from multiprocessing import Process, Queue
 from threading import Thread, Event
 
-import DCOTSS_py
-from DCOTSS_py.utils.handlers import mpLogHandler
-from DCOTSS_py.utils.managers import processManager
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
-from DCOTSS_py.nexrad.utils.nexrad_level2_directory import nexrad_level2_directory
+from ..utils.nexrad_level2_directory import nexrad_level2_directory
 
 from .convert_monitors import *
 from .wct_export import wct_export
+from .dealias import dealias_volume, _import_pyart
+from ...profiling import mpLogHandler, timer, count, publish
 
 _dateFMT = '%Y%m%d_%H%M%S'
+_nCPU    = os.cpu_count()
+
+NOAA_WCT_EXPORT       = os.environ.get( 'NOAA_WCT_EXPORT', 'wct-export' )       # Path to wct-export CLI
+NOAA_WCT_BATCH_CONFIG = os.environ.get( 'NOAA_WCT_BATCH_CONFIG', None )         # Path to batch config; None uses the one in the NOAA WCT distribution
 
 def nexrad_level2_to_nc(stations, date0, date1, 
         dynamics               = False,
         dealias                = False,
+        fields                 = None,
         concurrency            = 1,
         nexrad_level2_root     = None,
         nexrad_level2_tmp_root = None,
         noaa_wct_export        = '/data1/',
-        noaa_wct_batch_config  = DCOTSS_py.NOAA_WCT_BATCH_CONFIG,
+        noaa_wct_batch_config  = NOAA_WCT_BATCH_CONFIG,
         log_unit_num           = None):
     
     log = logging.getLogger( __name__ )
-    t0  = time.time()
+    t0  = timer('convert.total').start()
     
     if not isinstance( stations, (list, tuple,) ):                                  # If stations is NOT a list or tuple (i.e., only single station), make it one
         stations = [stations]
@@ -39,7 +45,7 @@ def nexrad_level2_to_nc(stations, date0, date1,
     log.info( 'NEXRAD_LEVEL2_RADAR_TO_NC - convert NEXRAD Level 2 file to netCDF using wct' )
     log.info( '   Station ID                        : {}'.format( ','.join(stations) ) )
     log.info( '   Analysis window start time        : {}'.format(date0) )
-    log.info( '   Analysis window end time          : {}'.format(date1)) )
+    log.info( '   Analysis window end time          : {}'.format(date1) )
     log.info( '   NEXRAD Level2 root directory      : {}'.format(nexrad_level2_root) )
     log.info( '   NEXRAD Level2 tmp root directory  : {}'.format(nexrad_level2_tmp_root) )
     
@@ -103,6 +109,7 @@ def nexrad_level2_to_nc(stations, date0, date1,
     else:    
         status = pyart_level2_to_nc(inFiles, outDirs, statsInfo,
                     dealias      = dealias, 
+                    fields       = fields,
                     log_unit_num = log_unit_num,
                     concurrency  = concurrency)    
 
@@ -114,18 +121,18 @@ def nexrad_level2_to_nc(stations, date0, date1,
         log_unit_num.write( msg + '\n' );
         log_unit_num.write( '{:=<79}\n'.format('') )
 
-    log.info( '   Conversion completed in {:0.1f} s'.format(time.time()-t0) )
+    log.info( '   Conversion completed in {:0.1f} s'.format(t0.stop()) )
 
     return [ os.path.basename(f) for f in inFiles ];                                # Return base names of all input files
 
 ##############################################################################
 def noaa_wct_level2_to_nc(inFiles, outDirs, statsInfo, 
         output_format         = 'rnc',
-        noaa_wct_export       = DCOTSS_py.NOAA_WCT_EXPORT,
-        noaa_wct_batch_config = DCOTSS_py.NOAA_WCT_BATCH_CONFIG,
+        noaa_wct_export       = NOAA_WCT_EXPORT,
+        noaa_wct_batch_config = NOAA_WCT_BATCH_CONFIG,
         noaa_wct_cache_dir    = None,
         log_unit_num          = None,
-        concurrency           = DCOTSS_py._nCPU):
+        concurrency           = _nCPU):
     """
     Name:
         noaa_wct_level2_to_nc
@@ -222,8 +229,9 @@ def noaa_wct_level2_to_nc(inFiles, outDirs, statsInfo,
                     env                = my_env)
         procs.append( proc );                                                   # Open a subrpcess (piping output to /dev/null) and append Popen to procs list
 
-    for proc in procs:                                                          # Iterate over all the processes
-        procCodes.append( proc.wait()  == 0 )
+    with timer('convert.wct_export'):                                           # Time from start of first process to end of last
+        for proc in procs:                                                      # Iterate over all the processes
+            procCodes.append( proc.wait()  == 0 )
 
     monitor.join(timeout = 60);                                                 # Give the thread 2 seconds to finish up
     event.set();                                                                # Set the event, this will force thread to exit while loop
@@ -248,8 +256,11 @@ def noaa_wct_level2_to_nc(inFiles, outDirs, statsInfo,
 ##############################################################################
 def pyart_level2_to_nc(inFiles, outDirs, statsInfo, 
         dealias      = False, 
+        fields       = None,
+        sweeps       = None,
         log_unit_num = None,
-        concurrency  = DCOTSS_py._nCPU):
+        concurrency  = _nCPU,
+        **kwargs):
     """
     Name:
         nexrad_level2_to_nc
@@ -264,29 +275,36 @@ def pyart_level2_to_nc(inFiles, outDirs, statsInfo,
         Converted native radar files to native netCDF files.
     Keywords:
         dealias      : If set, de-alias wind fields prior to writing using Py-ART tools.
+                        De-aliasing is its own stage: the files of each output
+                        directory (i.e., station) are read and written in time
+                        order by one process, and the sweeps of each volume are
+                        de-aliased in a pool of worker processes owned by that
+                        process. Stations are split over up to concurrency
+                        processes, and the workers over the stations. The
+                        de-aliased velocities of a volume are the reference for
+                        the next volume of the station.
+        fields       : Fields to write; default is all fields. Velocity is only
+                        de-aliased if 'corrected_velocity' is in fields.
+        sweeps       : Sweeps to write; default is all sweeps
         log_unit_num : File handle to write some logging informaiton to; This is
                         just passed to the monitor threads
         concurrency  : Number of concurrent conversion to run at once.
+        All other keywords are passed to dealias.dealias_volume
     Author and history:
         Cameron R. Homeyer  2016-03-08.
                             2016-04-13. Updated to make de-aliasing winds optional.
         Kyle R. Wodzicki    2019-06-27. Ported from IDL to python3
     """
-    # Import pyart, suppressing FutureWaring. Reset warnings after import
-    # It is bad practice to import inside function, but pyart based conversions
-    # do not seem to be very frequent and pyart messes up the user's path
-    # for some reason
-    warnings.filterwarnings('ignore', category=FutureWarning)
-    import pyart
-    warnings.resetwarnings()
-
     log = logging.getLogger(__name__)
     if not isinstance(inFiles, (list,tuple,)):                                  # If inFile is not an iterable
-        inFile = [inFiles];                                                     # Convert to list
+        inFiles = [inFiles];                                                    # Convert to list
     if not isinstance(outDirs, (list,tuple,)):                                  # If outDir is not an iterable
-        inDir  = [outDirs]                                                      # Convert to list
+        outDirs = [outDirs] * len(inFiles)                                      # Convert to list
+
+    if dealias and (fields is not None) and ('corrected_velocity' not in fields):
+        log.info( 'corrected_velocity is not exported; skipping de-aliasing' )
+        dealias = False
 
-    procs     = []
     logQueue  = Queue()
     retQueue  = Queue()
     monitor = Thread( target = pyart_monitor, 
@@ -296,16 +314,26 @@ def pyart_level2_to_nc(inFiles, outDirs, statsInfo,
     monitor.start()
     logThread.start()         
 
-    for i in range( len(inFiles) ):                                             # Iterate over input files
-        procs, _ = processManager( procs, concurrency = concurrency );          # Check that there aren't too many processes running; block until one finishes if too many
-        proc     = Process(target = pyart_level2_to_nc_file, 
-                        args   = (inFiles[i], outDirs[i],),
-                        kwargs = {'dealias'     : dealias, 
-                                  'returnQueue' : retQueue,
-                                  'logQueue'    : logQueue});                   # Iniialize multiprocess process
-        proc.start();                                                           # Start the process
-        procs.append(proc);                                                     # Append process handle to procs list
-    procs, _ = processManager( procs, waitall = True );                         # Wait for all remaining processes to finish
+    opts = {'fields' : fields, 'sweeps' : sweeps}
+    if dealias:
+        stations = {}
+        for inFile, outDir in sorted( zip(inFiles, outDirs) ):                  # Files of each station in time order
+            stations.setdefault( outDir, [] ).append( inFile )
+        nproc  = max( min( len(stations), concurrency ), 1 )
+        groups = [[] for i in range( nproc )]
+        for i, outDir in enumerate( sorted( stations, key = lambda d: -len(stations[d]) ) ):
+            groups[i % nproc].append( (stations[outDir], outDir,) )             # Busiest stations spread over processes first
+        procs  = [Process( target = _dealias_stations,
+                           args   = (group, opts, kwargs, max( concurrency // nproc, 1 ), retQueue, logQueue,) )
+                    for group in groups if group]
+        for proc in procs: proc.start()
+        for proc in procs: proc.join()
+    else:
+        with Pool( concurrency, initializer = _init_worker, initargs = (logQueue,), maxtasksperchild = 1 ) as pool:
+            tasks = [(inFile, outDir, opts,) for inFile, outDir in zip(inFiles, outDirs)]
+            for result in pool.imap_unordered( _convert_file, tasks ):
+                retQueue.put( result )
+
     logQueue.put(None);                                                         # Put None in the log queue, this will kill it
     retQueue.put(None);                                                         # Put None in the return queue, this will kill it
     logThread.join();                                                           # Join the logger thread; wait for it to fully finish
@@ -315,10 +343,55 @@ def pyart_level2_to_nc(inFiles, outDirs, statsInfo,
     
     return True
 
+##############################################################################
+def _init_worker(logQueue):
+    """Private Pool initializer; send worker logs to main process, and only there"""
+    log = logging.getLogger(__name__.rsplit('.', 1)[0])
+    log.addHandler( QueueHandler( logQueue ) )
+    log.propagate = False                                                       # Handlers inherited on fork would log records twice
+
+def _convert_file(args):
+    """Private Pool worker; convert one file without de-aliasing"""
+    inFile, outDir, opts = args
+    try:
+        return pyart_level2_to_nc_file( inFile, outDir, **opts )
+    finally:
+        publish( logging.getLogger(__name__) )                                  # Send timers to main process
+
+def _dealias_stations(group, opts, kwargs, nworkers, retQueue, logQueue):
+    """Private process target; convert the files of each station in group, de-aliasing sweeps in a pool owned by this process"""
+    _init_worker( logQueue )
+    try:
+        with Pool( nworkers, initializer = _init_worker, initargs = (logQueue,) ) as pool:
+            for files, outDir in group:
+                for result in _dealias_station( files, outDir, pool, opts, kwargs ):
+                    retQueue.put( result )
+    finally:
+        publish( logging.getLogger(__name__) )                                  # Send timers to main process
+
+def _dealias_station(files, outDir, pool, opts, kwargs):
+    """Private function to convert files of one station in time order; file I/O in this process, sweeps de-aliased in pool"""
+    log     = logging.getLogger(__name__)
+    state   = None
+    results = []
+    for inFile in files:
+        radar = _read_radar( inFile, **opts )
+        if radar is None:
+            results.append( (False, None,) )
+            continue
+        try:
+            state = dealias_volume( radar, pool, state = state, **kwargs )
+        except Exception as err:
+            log.error( 'Failed to dealias file: {}; {}'.format(inFile, err) )
+            state = None
+        results.append( _write_radar( radar, inFile, outDir, opts['fields'] ) )
+    return results
 
 ##############################################################################
 def pyart_level2_to_nc_file(inFile, outDir, 
         dealias     = False, 
+        fields      = None,
+        sweeps      = None,
         returnQueue = None, 
         logQueue    = None):
     """
@@ -335,6 +408,10 @@ def pyart_level2_to_nc_file(inFile, outDir,
         Converted native radar files to native netCDF files.
     Keywords:
         dealias     : If set, de-alias wind fields prior to writing using Py-ART tools.
+                        Sweeps are de-aliased one after the other in this process;
+                        see pyart_level2_to_nc for parallel de-aliasing.
+        fields      : Fields to write; default is all fields
+        sweeps      : Sweeps to write; default is all sweeps
         returnQueue : Set to a multiprocessing.Queue instance to pass return values to
                         main process when running as multiprocess.
         logQueue    : Set to a multiprocessing.Queue instance to pass logs to
@@ -345,43 +422,77 @@ def pyart_level2_to_nc_file(inFile, outDir,
         Kyle R. Wodzicki    2019-06-27. Ported from IDL to python3
     """
     log     = logging.getLogger(__name__);
-    status  = False;
-    outFile = None;
     if logQueue is not None:
         log.addHandler( QueueHandler( logQueue ) )
 
-    if not os.path.isfile( inFile ):
-        log.error('Input file does NOT exist: {}'.format(inFile));
-    else:
-        outFile = os.path.join(outDir, os.path.basename(inFile) + '.nc')
-        if os.path.isfile( outFile ):
-            log.warning(
-                'Ouput file already exists, deleting it: {}'.format(outFile)
-            )
-            os.remove( outFile );
-
-        try:
-            radar = pyart.io.read( inFile )
-        except:
-            log.exception( 'Failed to open file: {}'.format(inFile) )
-        else:
-            if dealias:
-                log.debug('Dealiasing data...')
-                dealias_data = pyart.correct.dealias_region_based(radar)
-                radar.add_field('corrected_velocity', dealias_data)
-
-            try:
-                pyart.io.cfradial.write_cfradial(outFile, radar, 
-                    format             = 'NETCDF4',
-                    arm_time_variables = True);
-            except Exception as err:
-                log.error('Failed to write netCDF file: {}'.format(outFile) )
-                if os.path.isfile( outFile ):
-                    os.remove( outFile );
-            else:
-                status  = True
+    status, outFile = False, None
+    radar = _read_radar( inFile, fields, sweeps )
+    if radar is not None:
+        if dealias and ((fields is None) or ('corrected_velocity' in fields)):
+            log.debug('Dealiasing data...')
+            with ThreadPool( 1 ) as pool:                                       # Pool interface, but sweeps run in this process
+                dealias_volume( radar, pool )
+        status, outFile = _write_radar( radar, inFile, outDir, fields )
 
     if (returnQueue is not None):
         returnQueue.put( (status, outFile) );
     return status, outFile
 
+##############################################################################
+def _read_radar(inFile, fields = None, sweeps = None):
+    """
+    Name:
+        _read_radar
+    Purpose:
+        Private function to read a NEXRAD Level 2 file with Py-ART, keeping
+        only the fields and sweeps to export. Velocity is always read if
+        corrected_velocity is to be exported.
+    """
+    log   = logging.getLogger(__name__)
+    pyart = _import_pyart()
+    if not os.path.isfile( inFile ):
+        log.error('Input file does NOT exist: {}'.format(inFile));
+        return None
+    include = None
+    if fields is not None:
+        include = list(fields) + (['velocity'] if 'corrected_velocity' in fields else [])
+    try:
+        with timer('convert.read'):
+            radar = pyart.io.read_nexrad_archive( inFile, include_fields = include,
+                        scans = None if sweeps is None else list(sweeps) )
+        count( 'convert.read.bytes', os.path.getsize( inFile ) )
+        return radar
+    except:
+        log.exception( 'Failed to open file: {}'.format(inFile) )
+        return None
+
+def _write_radar(radar, inFile, outDir, fields = None):
+    """
+    Name:
+        _write_radar
+    Purpose:
+        Private function to write radar object to netCDF file in outDir;
+        fields not in fields (e.g., velocity read only for de-aliasing) are
+        dropped. Returns status and path to output file.
+    """
+    log     = logging.getLogger(__name__)
+    pyart   = _import_pyart()
+    if fields is not None:
+        radar.fields = {key : val for key, val in radar.fields.items() if key in fields}
+    outFile = os.path.join(outDir, os.path.basename(inFile) + '.nc')
+    if os.path.isfile( outFile ):
+        log.warning(
+            'Ouput file already exists, deleting it: {}'.format(outFile)
+        )
+        os.remove( outFile );
+    try:
+        with timer('convert.write'):
+            pyart.io.cfradial.write_cfradial(outFile, radar, 
+                format             = 'NETCDF4',
+                arm_time_variables = True);
+    except Exception as err:
+        log.error('Failed to write netCDF file: {}'.format(outFile) )
+        if os.path.isfile( outFile ):
+            os.remove( outFile );
+        return False, outFile
+    return True, outFile
@@ -1,25 +1,18 @@
 import logging
 from logging.handlers import QueueHandler
 import signal
-import os, shutil, glob, time
+import os, shutil, glob
 from datetime import datetime, timedelta
 
-import boto3
-import boto3.session
-
 from threading import Thread
 from multiprocessing import Process, Event, Queue
 
 from .utils.nexrad_level2_directory import nexrad_level2_directory
+from .storage import s3_storage
+from ..profiling import mpLogHandler, timer, count, publish
 
 _dateFMT   = "%Y%m%d_%H%M%S";                                                   # Time format in NEXRAD files
-
-###############################################################################
-def mpLogHandler( queue ):
-	while True:
-		record = queue.get()
-		if record is None:
-			break
+_endOfQueue = (None, None, None, None,)                                         # Put in fileQueue after all files to stop download process
 
 ###############################################################################
 class nexrad_aws_downloader( Process ):
@@ -39,14 +32,17 @@ class nexrad_aws_downloader( Process ):
                             a file. Default is 3
             clobber    : Set to overwrite exisiting files.
                             Default is False
+            storage    : level2_storage instance to download from; if set,
+                            resource and bucketName are ignored.
+                            Default is s3_storage(bucketName, resource)
             All other keywords accepted by multiprocess.Process
         """
         attempts = kwargs.pop('attempts', 3)
         clobber  = kwargs.pop('clobber', False)
+        storage  = kwargs.pop('storage', None)
 
         super().__init__(*args, **kwargs);
-        self._resource   = resource
-        self._bucketName = bucketName
+        self._storage    = storage or s3_storage( bucketName, resource )
         self._queue      = fileQueue
         self._logQueue   = logQueue
         self._stopEvent  = stopEvent
@@ -57,9 +53,8 @@ class nexrad_aws_downloader( Process ):
     def run(self):
         log     = logging.getLogger(__name__)
         log.addHandler( QueueHandler( self._logQueue ) );                       # Add Queue Handler to the log
-        session = boto3.session.Session();                                      # Create own session as per https://boto3.amazonaws.com/v1/documentation/api/latest/guide/resources.html
-        s3conn  = boto3.resource(self._resource );                              # Start client to AWS s3
-        bucket  = s3conn.Bucket( self._bucketName )                             # Connect to bucket
+        log.propagate = False;                                                  # Main process logs the records; handlers inherited on fork would log them twice
+        storage = self._storage;                                                # Storage makes own connection in this process as per https://boto3.amazonaws.com/v1/documentation/api/latest/guide/resources.html
 
         nFail    = 0
         nSuccess = 0
@@ -67,12 +62,15 @@ class nexrad_aws_downloader( Process ):
 
         statSize = 0
         dt       = 0.0;
-        while (not self._stopEvent.is_set() or not self._queue.empty()) and not self._killEvent.is_set():  # While the event is NOT set OR the queue is NOT empty
+        station  = ''                                                           # Set to None when _endOfQueue is dequeued
+        while not self._killEvent.is_set():                                     # While the killEvent is NOT set
             try:
                 station, key, size, localFile = self._queue.get(timeout = 0.5); # Try to get information from the queue, waiting half a second
             except:                                                             # If failed to get something from the queue
                 continue;                                                       # Continue to beginning of while loop
-            
+
+            if (station is None):                                               # Scheduler is done adding files; queue.empty() is not reliable for this as items may still be in transit
+                break;
             if (key is None):                                                   # If the key grabbed from the queue is None
                 dlRate = (statSize / 1.0e6 / dt) if (dt > 0.0) else 0.0         # Compute the download rate for the station
                 log.info(
@@ -88,22 +86,23 @@ class nexrad_aws_downloader( Process ):
                     '        File already downloaded : {}'.format(key))
                 nSuccess += 1;                                                  # Increment number of successful downloads; size variables NOT incremented because didn't download anything
             else:                                                               # Else, we will try to download it
-                statObj = bucket.Object( key );                                 # Get object from bucket so that we can download
                 attempt = 0                                                     # Set attempt number to zero
                 while (attempt < self._attempts):                               # While we have not reached maximum attempts
                     log.debug(
                         '        Download attempt {:2d} of {:2d} : {}'.format(
                                     attempt+1, self._attempts, key));           # Log some info
-                    t0 = time.time()                                            # Start time of download
+                    t  = timer('download.aws')                                  # Time the download
                     try:
-                        statObj.download_file(localFile);                       # Try to download the file
+                        with t:
+                            storage.get(key, localFile);                        # Try to download the file
                         info = os.stat(localFile)                               # Get file info
                         if (info.st_size != size):                              # If file size is NOT correct OR clobber is set
                             raise Exception('File size mismatch!')
                     except:
                         attempt += 1;                                           # On exception, increment attempt counter
                     else:
-                        dt      = dt + (time.time() - t0)                       # Increment dt by the time it took to download current file
+                        dt      = dt + t.elapsed                                # Increment dt by the time it took to download current file
+                        count( 'download.aws.bytes', size )
                         attempt = self._attempts + 1;                           # Else, file donwloaded so set attempt to 1 greater than maxAttempt
                 
                 if (attempt == self._attempts):                                 # If the download attempt matches maximum number of attempts,then all attempts failed
@@ -117,18 +116,16 @@ class nexrad_aws_downloader( Process ):
                     nSuccess += 1                                               # Number of successful downloads for thread
                     totSize  += size                                            # Size of downloads for thread
                     statSize += size                                            # Size of downloads for given station
-                statObj = None;                                                 # Set to None for garbage collection of object
 
-        # Set all to None for garbage collection; may fix the SSLSocket error issue
-        bucket  = None; 
-        s3conn  = None;
-        session = None;      
+        storage = None;                                                         # Set to None for garbage collection; may fix the SSLSocket error issue
+        self._storage = None
         if self._killEvent.is_set():                                            # If killEvent set
             log.error('Received SIGINT; download cancelled.');                  # Log an errory
-            while not self._queue.empty():                                      # While the queue is NOT empty
+            while (station is not None):                                        # Until the end of the queue; scheduler always puts _endOfQueue
                 station, key, size, localFile = self._queue.get();              # Dequeue items
                 if (key is not None): nFail += 1;                               # Increment nFail if key is NOT None
         log.debug( '     AWS Download process finished' )
+        publish( log );                                                         # Send timers to main process; must be before returning statistics so it is on the logQueue before None
         self._queue.put( (nSuccess, nFail, totSize,) );                         # Return # success, # failed, and download size to the queue
 
 
@@ -156,8 +153,7 @@ class nexrad_aws_scheduler(object):
         """
         self.log = logging.getLogger(__name__);                                 # Initialize logger for the class
 
-        self.s3conn      = None                                                 # Attribute for aws connection
-        self.bucket      = None                                                 # Attribute for aws bucket
+        self.storage     = None                                                 # Attribute for storage backend (aws bucket by default)
         self.outdir      = None                                                 # Attribute for output directory
         self.t0          = None                                                 # Attribute for start time of download 
 
@@ -185,7 +181,8 @@ class nexrad_aws_scheduler(object):
             clobber     = False,
             maxAttempt  = 3,
             verbose     = False,
-            concurrency = 4):
+            concurrency = 4,
+            storage     = None):
         """
         Name:
             download
@@ -216,17 +213,21 @@ class nexrad_aws_scheduler(object):
             maxAttempt : Maximum number of times to try to download
                             file. DEFAULT: 3
             concurrency: Number of concurrent downloads to allow
+            storage    : level2_storage instance to download from; e.g.,
+                            local_storage or memory_storage for running
+                            without network. If set, resource and
+                            bucketName are ignored
         Outputs:
             Returns output directory for data files, # successful downloads,
             # failed downloads, and total size of all downloaded files.
         """
-        
-        self._enqueueFiles( date1, date2, station, resource, bucketName, 
+        if storage is None: storage = s3_storage( bucketName, resource )
+        self._enqueueFiles( date1, date2, station, storage, 
             outroot, no_MDM, no_tar, clobber, maxAttempt, verbose, concurrency)
         return self._wait() 
  
     ############################################################################
-    def _initProcesses(self, resource, bucketName, clobber, maxAttempt, concurrency):
+    def _initProcesses(self, storage, clobber, maxAttempt, concurrency):
         """
         Name:
             _initProcesses
@@ -234,8 +235,7 @@ class nexrad_aws_scheduler(object):
             Private method to initialize downloader processes for concurrent
             downloading of data.
         Inputs:
-            resource    : The AWS resource to use
-            bucketName  : Name of the AWS bucket to use
+            storage     : level2_storage instance to download from
             clobber     : Boolean that enables/disables file clobbering
             maxAttempt  : Integer maximum number of download retries
             concurrency : Integer number of concurrent downloads to allow
@@ -244,8 +244,7 @@ class nexrad_aws_scheduler(object):
         Outputs:
             None; updates class attributes
         """
-        self.s3conn     = boto3.resource(resource);                             # Start client to AWS s3
-        self.bucket     = self.s3conn.Bucket(bucketName);                       # Connect to bucket
+        self.storage    = storage;                                              # Storage to list and download files from
 
         self.logQueue   = Queue();                                              # multiprocessing.Queue for passing logs to main process
         self.logThread  = Thread(target=mpLogHandler, args=(self.logQueue,));   # Initialize thread to consume log message from queue
@@ -260,16 +259,17 @@ class nexrad_aws_scheduler(object):
         for i in range( concurrency ):                                          # Iterate over number of concurrency allowed
             self.fileQueues.append( Queue( maxsize = 500 ) );                   # Create queue with depth of 500; should be enough for one days worth of NEXRAD files
             tid = nexrad_aws_downloader(
-                    resource, bucketName, self.fileQueues[-1], 
+                    None, None, self.fileQueues[-1], 
                     self.logQueue, self.stopEvent,  self.killEvent, 
                     attempts = maxAttempt,
-                    clobber  = clobber) ;                                       # Initialize a download process
+                    clobber  = clobber,
+                    storage  = storage) ;                                       # Initialize a download process
             tid.start();                                                        # Start the process
             self.tids.append( tid );                                            # Append process to the list of processes
         
 
     ############################################################################
-    def _enqueueFiles(self, date1, date2, station, resource, bucketName, 
+    def _enqueueFiles(self, date1, date2, station, storage, 
 			outroot, no_MDM, no_tar, clobber, maxAttempt, verbose, concurrency):
 
         """
@@ -289,9 +289,7 @@ class nexrad_aws_scheduler(object):
                             DEFAULT: End of date1 day.
             station    : Scalar string or list of strings containing 
                             radar station IDs in the for KXXX
-            resource   : AWS resource to download from. Default is s3
-            bucketName : Name of the bucket to download data from.
-                            DEFAULT: noaa-nexrad_level2
+            storage    : level2_storage instance to download from
             outroot    : Top level output directory for downloaded files.
                             This function will create the following directory
                             structure in the directory:
@@ -309,7 +307,7 @@ class nexrad_aws_scheduler(object):
         """                   
         if concurrency > 10: concurrency = 10
         
-        self.t0  = time.time()
+        self.t0  = timer('download.aws_total').start()
         
         if not isinstance( station, (list,tuple,) ): 
             self.station = [station];									            # If stations is not an iterable, assume is string and make iterable
@@ -321,7 +319,7 @@ class nexrad_aws_scheduler(object):
         self.log.info( '   Sync date        : {}'.format(date1.strftime('%Y %m %d') ))
         self.log.info( '   Output directory : {}'.format(self.outdir) )
         
-        self._initProcesses( resource, bucketName, clobber, maxAttempt, concurrency) 
+        self._initProcesses( storage, clobber, maxAttempt, concurrency) 
 
         if os.path.isdir(self.outdir) and clobber:
             self.log.info( '   Deleting existing output directory and its contents' )
@@ -342,9 +340,9 @@ class nexrad_aws_scheduler(object):
                 if not os.path.isdir( stationdir[i] ): os.makedirs( stationdir[i] );    # If the output diretory does NOT exist, create it
 
                 statPrefix = datePrefix + self.station[i];                              # Create station prefix for bucket filter using datePrefix and the station ID
-                statKeys   = self.bucket.objects.filter( Prefix = statPrefix );         # Apply filter to bucket objects
-                for statKey in statKeys:                                                # Iterate over all the objects in the filter
-                    fBase = statKey.key.split('/')[-1];                                 # Get the base name of the file
+                statKeys   = self.storage.list( prefix = statPrefix );                  # Apply filter to bucket objects
+                for key, size in statKeys:                                              # Iterate over all the objects in the filter
+                    fBase = key.split('/')[-1];                                 # Get the base name of the file
                     if (no_MDM and fBase.endswith('MDM')): continue;                    # If the no_MDM keyword is set and the file ends in MDM, then skip it
                     if (no_tar and fBase.endswith('tar')): continue;                    # If the no_tar keyword is set and the file ends in tar, then skip it
                     fDate = datetime.strptime(fBase[4:19], _dateFMT);                   # Create datetime object for file using information in file name
@@ -353,7 +351,7 @@ class nexrad_aws_scheduler(object):
                         while (not self.killEvent.is_set()):                            # While the killEvent is NOT set
                             try:                                                        # Try to put information into the queue with a timeout; this is done so that we don't wait forevery if trying to kill the code
                                 self.fileQueues[queueIndex].put( 
-                                    (station[i], statKey.key, statKey.size, localFile,),
+                                    (self.station[i], key, size, localFile,),
                                     timeout = 1.0);                                     # Put information into queue for downloader process(s) because must be downloaded
                             except:                                                     # One exception
                                 pass;                                                   # Quietly fail
@@ -361,7 +359,7 @@ class nexrad_aws_scheduler(object):
                                 break;                                                  # Break while loop
                     if self.killEvent.is_set(): return;                                 # If the killEvent is set, then return from method; we don't want to put anything else into the queue
  
-                self.fileQueues[queueIndex].put( (station[i], None, None, None,) )      # Put some None objects into the queue to signal that downloads for given station and date are done
+                self.fileQueues[queueIndex].put( (self.station[i], None, None, None,) )      # Put some None objects into the queue to signal that downloads for given station and date are done
                 queueIndex = (queueIndex+1) % concurrency;                              # Update the queueIndex for which queue to put the next station's info in
 
             date += timedelta(days = 1);                                                # Increment date by one (1) day
@@ -382,7 +380,9 @@ class nexrad_aws_scheduler(object):
             # failed downloads, and total size of all downloaded files.
         """
 
-        self.stopEvent.set();                                                           # Set the event to kill the download processes once their queue empties
+        self.stopEvent.set();                                                           # Set the event to signal that all files are enqueued
+        for fileQueue in self.fileQueues:
+            fileQueue.put( _endOfQueue );                                               # Tell the download process to finish once it reaches the end of its queue
         nSuccess = 0
         nFail    = 0
         Size     = 0
@@ -398,7 +398,7 @@ class nexrad_aws_scheduler(object):
         self.logThread.join();                                                          # Join the thread to make sure it finishes 
         self.logQueue.close();                                                          # Close the log queue
 
-        elapsed = time.time() - self.t0;                                                # Compute elpased time
+        elapsed = self.t0.stop();                                                       # Compute elpased time
         self.log.info( 'NEXRAD_LEVEL2_AWS_DOWNLOAD - complete' )
         self.log.info( '   Downloaded       : {:10d} files'.format(  nSuccess) )
         self.log.info( '   Failed           : {:10d} files'.format(  nFail))
@@ -427,7 +427,8 @@ def nexrad_level2_aws_download(
         clobber     = False,
         maxAttempt  = 3,
         verbose     = False,
-        concurrency = 4):
+        concurrency = 4,
+        storage     = None):
     """
     Name:
         nexrad_aws_level2_download
@@ -458,6 +459,9 @@ def nexrad_level2_aws_download(
         maxAttempt : Maximum number of times to try to download
                         file. DEFAULT: 3
         concurrency: Number of concurrent downloads to allow
+        storage    : level2_storage instance to download from; e.g.,
+                        local_storage or memory_storage for running
+                        without network. Default is the AWS bucket
     Author and History:
         Kyle R. Wodzicki     Created 2019-07-06
     """
@@ -478,7 +482,8 @@ def nexrad_level2_aws_download(
         clobber     = clobber,
         maxAttempt  = maxAttempt,
         verbose     = verbose,
-        concurrency = concurrency)
+        concurrency = concurrency,
+        storage     = storage)
     
     filelist = glob.glob( os.path.join(outdir, '*') );                                  # Get list of all files that downloaded
     nfiles   = len(filelist)
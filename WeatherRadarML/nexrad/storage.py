@@ -0,0 +1,180 @@
+import os, shutil, secrets
+
+_tmpFMT = '{}.{}'                                                               # Partial download name; same as aws, so in-progress files are recognized
+
+###############################################################################
+class level2_storage( object ):
+    """
+    Name:
+        level2_storage
+    Purpose:
+        Base class for stores of NEXRAD Level 2 files laid out like the AWS
+        bucket; i.e., keys are YYYY/MM/DD/KXXX/<file name>. Backends
+        implement list, read, and put; get downloads a key to a local
+        file by writing to a temporary name and renaming, so partial
+        files are never mistaken for complete ones.
+    """
+    def list(self, prefix = ''):
+        """
+        Inputs:
+            None.
+        Keywords:
+            prefix : Only list keys starting with prefix
+        Outputs:
+            Generator of (key, size) tuples, sorted by key
+        """
+        raise NotImplementedError
+
+    def read(self, key):
+        """Return contents of key as bytes"""
+        raise NotImplementedError
+
+    def put(self, key, data):
+        """Store bytes under key"""
+        raise NotImplementedError
+
+    def get(self, key, localFile):
+        """
+        Inputs:
+            key       : Key to download
+            localFile : Path to write to
+        Keywords:
+            None.
+        Outputs:
+            None.
+        """
+        tmp = _tmpFMT.format( localFile, secrets.token_hex(4) )
+        try:
+            with open( tmp, 'wb' ) as fid:
+                fid.write( self.read( key ) )
+            os.replace( tmp, localFile )
+        finally:
+            if os.path.isfile( tmp ): os.remove( tmp )
+
+###############################################################################
+class s3_storage( level2_storage ):
+    def __init__(self, bucketName = 'noaa-nexrad-level2', resource = 's3'):
+        """
+        Name:
+            s3_storage
+        Purpose:
+            Level 2 files in an AWS bucket. The connection is made on first
+            use in each process, as boto3 resources can not be shared
+            between processes.
+        Inputs:
+            None.
+        Keywords:
+            bucketName : Name of the bucket
+            resource   : AWS resource to use
+        """
+        self.bucketName = bucketName
+        self.resource   = resource
+        self._bucket    = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_bucket'] = None                                                 # Each process makes own connection
+        return state
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            import boto3
+            self._bucket = boto3.resource( self.resource ).Bucket( self.bucketName )
+        return self._bucket
+
+    def list(self, prefix = ''):
+        for obj in self.bucket.objects.filter( Prefix = prefix ):
+            yield obj.key, obj.size
+
+    def read(self, key):
+        return self.bucket.Object( key ).get()['Body'].read()
+
+    def put(self, key, data):
+        self.bucket.Object( key ).put( Body = data )
+
+    def get(self, key, localFile):
+        self.bucket.Object( key ).download_file( localFile )                    # boto3 handles temporary file and multipart download
+
+###############################################################################
+class local_storage( level2_storage ):
+    def __init__(self, root):
+        """
+        Name:
+            local_storage
+        Purpose:
+            Level 2 files in a local directory with the bucket layout; e.g.,
+            a copy of part of the bucket or files from
+            syntheticData.write_bucket
+        Inputs:
+            root : Directory to use as bucket; created if it does not exist
+        Keywords:
+            None.
+        """
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join( self.root, *key.split('/') )
+
+    def list(self, prefix = ''):
+        head, _, base = prefix.rpartition('/')                                  # Only walk the directory the prefix is in
+        top = self._path( head ) if head else self.root
+        if not os.path.isdir( top ): return
+        for dirpath, dirnames, filenames in os.walk( top ):
+            dirnames.sort()
+            rel = os.path.relpath( dirpath, self.root ).replace( os.sep, '/' )
+            for fName in sorted( filenames ):
+                key = fName if (rel == '.') else '{}/{}'.format(rel, fName)
+                if key.startswith( prefix ):
+                    yield key, os.path.getsize( os.path.join( dirpath, fName ) )
+
+    def read(self, key):
+        with open( self._path( key ), 'rb' ) as fid:
+            return fid.read()
+
+    def put(self, key, data):
+        path = self._path( key )
+        tmp  = _tmpFMT.format( path, secrets.token_hex(4) )                     # Unique, so concurrent writers of a key do not collide
+        os.makedirs( os.path.dirname( path ), exist_ok = True )
+        try:
+            with open( tmp, 'wb' ) as fid:
+                fid.write( data )
+            os.replace( tmp, path )
+        finally:
+            if os.path.isfile( tmp ): os.remove( tmp )
+
+    def get(self, key, localFile):
+        tmp = _tmpFMT.format( localFile, secrets.token_hex(4) )
+        try:
+            shutil.copyfile( self._path( key ), tmp )
+            os.replace( tmp, localFile )
+        finally:
+            if os.path.isfile( tmp ): os.remove( tmp )
+
+###############################################################################
+class memory_storage( level2_storage ):
+    def __init__(self, objects = None):
+        """
+        Name:
+            memory_storage
+        Purpose:
+            Level 2 files held in memory; for tests that should not touch
+            disk or network. Objects must be put before download processes
+            are started, as each process gets its own copy.
+        Inputs:
+            None.
+        Keywords:
+            objects : Dictionary of key to bytes to start with
+        """
+        self.objects = dict(objects) if objects else {}
+
+    def list(self, prefix = ''):
+        for key in sorted( self.objects ):
+            if key.startswith( prefix ):
+                yield key, len( self.objects[key] )
+
+    def read(self, key):
+        return self.objects[key]
+
+    def put(self, key, data):
+        self.objects[key] = bytes(data)
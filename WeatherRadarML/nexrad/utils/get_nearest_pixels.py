@@ -1,13 +1,20 @@
 import logging
+from datetime import timedelta
 
 import pyart
 import numpy as np
 from scipy.spatial import KDTree
 
 from .get_nearest_radar import get_nearest_radar
-from .nexrad_level2_directory import nexrad_level2_directory
+from .nexrad_level2_files import nexrad_level2_files
+from .nexrad_level2_reader import nexrad_level2_reader
+from .polar_gate_lookup import polar_gate_lookup
+from .height_gate_lookup import height_gate_table, valid_altitude
+from .regrid_weights import sweep_geometry, canonical_sweep
+from .radar_geometry import geographic_to_cartesian
+from ...profiling import timer
 
-def get_nearest_pixels(lon, lat, date, field, k = 9, max_dist = 1.0):
+def get_nearest_pixels(lon, lat, date, field, k = 9, max_dist = 1.0, sweeps = None, method = 'kdtree', root = '/data1/', **kwargs):
 	"""
 	Purpose:
 		Function to get all pixels of given field closest to 
@@ -24,6 +31,20 @@ def get_nearest_pixels(lon, lat, date, field, k = 9, max_dist = 1.0):
 		max_dist : Maximum distance (km) a radar pixel can
 					be from user specified point for it to be
 					considered
+		sweeps   : List of (zero based) sweep numbers to get pixels for.
+					Default is all sweeps. Only the parts of the
+					file containing these sweeps are decompressed,
+					so requesting the lowest sweeps is much faster
+		method   : Method used to find closest pixels;
+					'kdtree' : KD-tree of gate x/y values (default)
+					'polar'  : Index arithmetic on (azimuth, range)
+								of the sweep; no tree is built
+					'height' : Gates chosen by horizontal distance and
+								beam height above the point, skipping
+								blocked gates; see radar_nearest_pixels
+		root     : Top-level root directory of local Level 2 files;
+					see nexrad_level2_directory
+		All other keywords accepted by radar_nearest_pixels
 	Outputs:
 		Returns an [nsweep, k] array with the closest pixels to
 		user specified points at each sweep angle
@@ -32,29 +53,121 @@ def get_nearest_pixels(lon, lat, date, field, k = 9, max_dist = 1.0):
 	radars        = get_nearest_radar( lon, lat )
 	if (len(radars) == 0): return None
 
-	dataDir       = nexrad_level2_directory(date, station = radars[0][0])
-
-	# Must add code to find closest radar file based on time
-	nexradFile    = '/data1/NEXRAD/level2/2019/201901/20190101/KHGX/KHGX20190101_000344_V06'
-	radar         = pyart.io.read(nexradFile, delay_field_loading=True)			# Read in NEXRAD file; enable delayed field loading to save memory
-	nSweeps       = radar.sweep_number['data'].size								# Number of sweeps in the file
-	out           = np.empty( (nSweeps, k,), dtype = np.float32 )				# Initialize numpy array to hold data
-
-	proj          = radar.projection											# Get radar projection
-	proj['lon_0'] = radar.longitude['data']										# Set projection longitude
-	proj['lat_0'] = radar.latitude['data']										# Set projecion lattitude
-	xy            = pyart.core.geographic_to_cartesian(lon, lat, proj)			# Convert user point to cartesian coordinates
-	xy            = np.asarray( xy ).T											# Convert to numpy array and transpose
-
-	for sweep in range( nSweeps ):												# Iterate over all radar sweeps
-		x, y, z      = radar.get_gate_x_y_z( sweep )							# Get x, y, z values for the sweep
-		tree         = KDTree( np.dstack( [x.ravel(), y.ravel()] ).squeeze() )	# Create KDTree for finding nearest neighbor
-		dist, ids    = tree.query( xy, k = k )									# Get closets k points to user point
-		ids          = ids[ np.where( dist <= max_dist ) ]						# Limit closest points by max_dist
-		if (ids.size > 0):														# If any points left
-			nids = ids.size														# Number of points left
-			ids  = np.unravel_index( ids, x.shape )								# Unravel the 1d incides
-			out[sweep,slice(nids)] = radar.get_field(sweep, field)[ids]			# Store values in the output data array
+	times, files  = nexrad_level2_files(date - timedelta(days = 1), radars[0][0], root = root, days = 3)	# Volumes for day of date and days either side
+	if (len(files) == 0): return None
+	nexradFile    = files[ np.argmin( np.abs( times - np.datetime64(date, 's') ) ) ]	# Closest radar file based on time
+	try:
+		radar     = nexrad_level2_reader(nexradFile)							# Open NEXRAD file; records are only decompressed for requested sweeps
+	except ValueError:															# Not a compressed message 31 file
+		radar     = pyart.io.read(nexradFile, delay_field_loading=True)			# Read in NEXRAD file; enable delayed field loading to save memory
+
+	out           = radar_nearest_pixels( radar, lon, lat, field, k = k, max_dist = max_dist,
+				sweeps = sweeps, method = method, **kwargs )
+	if isinstance(out, tuple):													# Pixels and beam heights
+		return tuple( o[0] for o in out )
+	return out[0]																# Return out array for the single point
+
+def radar_nearest_pixels(radar, lon, lat, field, k = 9, max_dist = 1.0, sweeps = None, method = 'kdtree',
+		alt = None, max_height = None, vertical_scale = 1.0, terrain = None, cache_dir = None, return_height = False):
+	"""
+	Purpose:
+		Function to get all pixels of given field closest to 
+		user specified location(s) from an open radar volume
+	Inputs:
+		radar : A pyart.core.Radar or nexrad_level2_reader instance
+		lon   : Longitude(s) of point(s) to get radar data for
+		lat   : Latitude(s) of point(s) ot get radar data for
+		field : Radar data field to get
+	Keywords:
+		See get_nearest_pixels. For method 'height':
+		alt            : Elevation(s) (m above sea level) of point(s);
+							missing (NaN) or invalid values (below
+							height_gate_lookup.MIN_ALTITUDE) are
+							replaced by the radar's
+		max_height     : Maximum beam height (m) above a point; higher
+							gates are not used
+		vertical_scale : Weight of beam height relative to horizontal
+							distance when ranking gates
+		terrain        : Terrain height function for beam blockage; see
+							height_gate_lookup.blockage_mask
+		cache_dir      : Directory to store blockage masks in
+		return_height  : If set, also return the beam height (m) above
+							the point of each pixel
+		Gate choices are computed once per station, VCP, and set of points
+		(see height_gate_lookup.height_gate_table) and reused for every
+		volume.
+	Outputs:
+		Returns an [npoints, nsweep, k] array with the closest pixels to
+		user specified points at each sweep angle. Pixels that are
+		missing, masked, or farther than max_dist are NaN. If
+		return_height is set, also returns an [npoints, nsweep, k] array
+		of beam heights; NaN where no gate was used
+	"""
+	if method not in ('kdtree', 'polar', 'height'):
+		raise ValueError( 'Unknown method: {}'.format(method) )
+
+	if sweeps is None: sweeps = range( radar.nsweeps )							# Use all sweeps in the file
+	lon           = np.atleast_1d( lon )
+	lat           = np.atleast_1d( lat )
+	out           = np.full( (lon.size, len(sweeps), k,), np.nan, dtype = np.float32 )	# Initialize numpy array to hold data
+
+	if (method == 'height'):
+		out, height = _height_pixels( radar, lon, lat, field, out, sweeps, k, max_dist, alt,
+					max_height, vertical_scale, terrain, cache_dir )
+		return (out, height,) if return_height else out
+	elif return_height:
+		raise ValueError( 'return_height requires method height' )
+
+	xy            = geographic_to_cartesian(lon, lat,
+						radar.longitude['data'][0], radar.latitude['data'][0])	# Convert user point(s) to cartesian coordinates using cached site projection
+	xy            = np.column_stack( xy )										# Convert to [npoints, 2] array
+
+	for i, sweep in enumerate( sweeps ):										# Iterate over requested radar sweeps
+		if (method == 'polar'):
+			if hasattr(radar, 'get_range'):										# Range of gates may differ by sweep
+				ranges = radar.get_range( sweep )
+			else:
+				ranges = radar.range['data']
+			with timer('pixels.polar_lookup'):
+				dist, rays, gates = polar_gate_lookup( xy[:,0], xy[:,1], 
+							radar.get_azimuth( sweep ), radar.get_elevation( sweep ),
+							ranges, k = k )										# Get closest k gates using sweep geometry
+			ids          = (rays, gates,)
+		else:
+			x, y, z      = radar.get_gate_x_y_z( sweep )						# Get x, y, z values for the sweep
+			with timer('pixels.kdtree_build'):
+				tree     = KDTree( np.column_stack( [x.ravel(), y.ravel()] ) )	# Create KDTree for finding nearest neighbor
+			with timer('pixels.kdtree_query'):
+				dist, ids = tree.query( xy, k = k )								# Get closets k points to user point
+			dist         = dist.reshape( lon.size, k )							# Make sure dimensions are [npoints, k] when k is 1
+			ids          = np.unravel_index( ids.reshape( lon.size, k ), x.shape )	# Unravel the 1d incides
+		good         = dist <= max_dist * 1.0e3									# Limit closest points by max_dist; x/y are in meters
+		if good.any():															# If any points left
+			data     = radar.get_field(sweep, field)[ids]						# Values at closest points
+			out[:,i] = np.where( good, np.ma.filled(data.astype(np.float32), np.nan), np.nan )	# Store values in the output data array
 
 	return out																	# Return out array
 
+def _height_pixels(radar, lon, lat, field, out, sweeps, k, max_dist, alt, max_height, vertical_scale, terrain, cache_dir):
+	"""
+	Purpose:
+		Private function to fill out for method 'height' of
+		radar_nearest_pixels using cached gate tables on canonical sweeps
+	"""
+	geometry      = sweep_geometry( radar, sweeps )								# Same for all volumes of a station and VCP
+	lonKey        = tuple( np.round( lon.astype(np.float64), 5 ).tolist() )		# Hashable points for table cache
+	latKey        = tuple( np.round( lat.astype(np.float64), 5 ).tolist() )
+	altKey        = None
+	if alt is not None:
+		altKey    = tuple( valid_altitude( alt, geometry[4], lon.size ).tolist() )	# Valid values so NaN does not defeat the table cache
+	height        = np.full( out.shape, np.nan, dtype = np.float32 )			# Beam height above point of each pixel
+	for i, info in enumerate( geometry[-1] ):									# Iterate over requested radar sweeps
+		with timer('pixels.height_table'):
+			ids, hgt = height_gate_table( geometry, info[0], lonKey, latKey, alt = altKey,
+						k = k, max_dist = max_dist, max_height = max_height,
+						vertical_scale = vertical_scale, terrain = terrain, cache_dir = cache_dir )
+		if (ids >= 0).any():													# If any usable gates
+			data       = canonical_sweep( radar, info[0], field, info[2] ).ravel()	# Sweep on fixed azimuth bins so table indices apply to any volume
+			out[:,i]   = np.where( ids >= 0, data[ np.maximum(ids, 0) ], np.nan )
+			height[:,i]= hgt
+	return out, height
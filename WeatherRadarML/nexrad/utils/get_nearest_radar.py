@@ -2,12 +2,10 @@ import logging
 
 import numpy as np
 from geopy.distance import geodesic
-from shapely.geometry import Polygon, Point
-from pyart.core import antenna_to_cartesian, cartesian_to_geographic
+from shapely.geometry import Point
 
-from .nexrad_station_info import nexrad_station_info
-
-proj = {'proj' : 'pyart_aeqd', 'lon_0' : 0.0, 'lat_0' : 0.0}					# Base projection dictionary
+from .radar_geometry import station_table, radar_footprint, footprint_bounds
+from ...profiling import timer
 
 def get_nearest_radar(lon, lat, max_range = 300):
 	"""
@@ -28,17 +26,17 @@ def get_nearest_radar(lon, lat, max_range = 300):
 	"""
 	if (lon > 180.0): lon -= 360.0												# Convert longitude to -180 to 180 range
 	point      = Point( [lon, lat] )											# Define shapely point
-	xx, yy, zz = antenna_to_cartesian( max_range, np.arange(360), 0)			# Generate cartesian coordinates from radar site based on max_range; 360 gives circle
-	statInfo   = nexrad_station_info(convert_lon = False)						# Get station information; False flag keeps longitudes in -180 to 180 range
+	statInfo   = station_table()												# Get station information; longitudes in -180 to 180 range
+	bounds     = footprint_bounds( max_range )									# Bounding boxes of all station footprints
+	near       = np.flatnonzero( (bounds[:,0] <= lon) & (bounds[:,2] >= lon) &
+							 (bounds[:,1] <= lat) & (bounds[:,3] >= lat) )		# Stations whose footprint bounding box contains the point
 	match      = []																# Initialize match to empty list
-	for i in range( statInfo['statid'].size ):									# Iterate over all stations in the station information
-		proj['lon_0'] = statInfo['lon'][i]										# Set longitude for projection to station longitude
-		proj['lat_0'] = statInfo['lat'][i]										# Set latitude for projection to station latitude
-		lonLat        = np.asarray( cartesian_to_geographic(xx, yy, proj) ).T	# Convert cartesiain radar range limits to geographic coordinates
-		poly          = Polygon( lonLat )										# Generate polygon using lonLat
-		if poly.contains( point ):												# If the polygon contains user requested point
-			match.append( (statInfo['statid'][i], statInfo['lon'][i],
-                   statInfo['lat'][i],    statInfo['alt'][i],) )				# Append tuple of station information to match list
+	with timer('radar.footprint_contains'):
+		for i in near:															# Iterate over stations that may contain the point
+			poly      = radar_footprint( statInfo['statid'][i], max_range )		# Get cached polygon of radar coverage
+			if poly.contains( point ):											# If the polygon contains user requested point
+				match.append( (statInfo['statid'][i], statInfo['lon'][i],
+                       statInfo['lat'][i],    statInfo['alt'][i],) )			# Append tuple of station information to match list
 
 	if (len(match) > 1):														# If the match list has more than 1 point
 		origin = (lat, lon, )													# Define origin as user point
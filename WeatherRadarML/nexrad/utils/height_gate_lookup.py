@@ -0,0 +1,155 @@
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from .polar_gate_lookup import polar_gate_lookup, beam_ground_range, beam_height
+from .radar_geometry import geographic_to_cartesian, cartesian_to_geographic
+from .regrid_weights import _cache_path
+
+BEAM_WIDTH   = 0.95                                                             # NEXRAD half-power beam width (degrees)
+MIN_ALTITUDE = -500.0                                                           # Lowest valid point elevation (m); e.g., -99999 marks missing values
+
+###############################################################################
+def valid_altitude(alt, default, size):
+    """Return [size] float64 elevations with missing (NaN) or invalid values replaced by default"""
+    alt = np.broadcast_to( np.asarray( alt, dtype = np.float64 ), (size,) )
+    return np.where( np.isfinite( alt ) & (alt >= MIN_ALTITUDE), alt, default )
+
+###############################################################################
+def _sweep_info(geometry, sweep):
+    """Private function to get (angle, nazimuth, first_gate, gate_spacing, ngates) of a sweep in a canonical geometry"""
+    info = [s for s in geometry[-1] if s[0] == sweep]
+    if (len(info) == 0):
+        raise Exception( 'Sweep {} not in geometry'.format(sweep) )
+    return info[0][1:]
+
+###############################################################################
+@lru_cache(maxsize = 64)
+def blockage_mask(geometry, sweep, terrain, threshold = 0.5, beam_width = BEAM_WIDTH, cache_dir = None):
+    """
+    Name:
+        blockage_mask
+    Purpose:
+        Function to flag gates of a canonical sweep whose beam is blocked
+        by terrain. The fraction of the beam below the terrain is computed
+        at every gate, and the blockage of a gate is the largest fraction
+        between it and the radar. Masks are computed once per (station,
+        VCP, sweep, terrain) and kept in memory, and on disk if cache_dir
+        is set.
+    Inputs:
+        geometry   : Canonical geometry from regrid_weights.sweep_geometry
+        sweep      : Sweep number; must be in geometry
+        terrain    : Function taking longitude and latitude arrays and
+                      returning terrain height (m above sea level); e.g., a
+                      DEM sampler. Its __name__ is part of the disk cache key
+    Keywords:
+        threshold  : Gates with at least this fraction of the beam blocked
+                      are flagged
+        beam_width : Half-power beam width (degrees)
+        cache_dir  : Directory to store masks in
+    Outputs:
+        Returns [nazimuth, ngates] boolean array; True where blocked
+    """
+    angle, naz, r0, dr, ng = _sweep_info( geometry, sweep )
+    key = geometry[:5] + ('blockage', angle, naz, r0, dr, ng, getattr(terrain, '__name__', repr(terrain)), threshold, beam_width,)
+    if cache_dir is not None:
+        path = _cache_path( cache_dir, key ) + '.npy'
+        if os.path.isfile( path ):
+            return np.load( path )
+
+    lon_0, lat_0, alt = geometry[2:5]
+    ranges   = r0 + dr * np.arange(ng)
+    s        = beam_ground_range( ranges, angle )
+    az       = np.deg2rad( (np.arange(naz) + 0.5) * 360.0 / naz )               # Bin centers
+    lon, lat = cartesian_to_geographic( np.sin(az)[:,None] * s, np.cos(az)[:,None] * s, lon_0, lat_0 )
+    ground   = np.asarray( terrain( lon, lat ), dtype = np.float64 ).reshape( naz, ng )
+    center   = alt + beam_height( ranges, angle )
+    half     = ranges * np.tan( np.deg2rad( 0.5 * beam_width ) )                 # Half of the beam's vertical extent
+    frac     = np.clip( (ground - (center - half)) / np.maximum( 2.0 * half, 1.0 ), 0.0, 1.0 )
+    mask     = np.maximum.accumulate( frac, axis = 1 ) >= threshold             # Blocked gates shadow all gates behind them
+
+    if cache_dir is not None:
+        os.makedirs( os.path.dirname( path ), exist_ok = True )
+        tmp = '{}.{}.tmp.npy'.format(path[:-4], os.getpid())
+        np.save( tmp, mask )
+        os.replace( tmp, path )
+    return mask
+
+###############################################################################
+@lru_cache(maxsize = 256)
+def height_gate_table(geometry, sweep, lon, lat,
+        alt            = None,
+        k              = 9,
+        max_dist       = 1.0,
+        max_height     = None,
+        vertical_scale = 1.0,
+        candidates     = 4,
+        terrain        = None,
+        threshold      = 0.5,
+        cache_dir      = None):
+    """
+    Name:
+        height_gate_table
+    Purpose:
+        Function to choose the gates of a canonical sweep that best
+        represent conditions at ground level at points (e.g., ASOS
+        stations). The k*candidates gates nearest horizontally are found
+        with polar_gate_lookup, blocked gates are dropped, and the k gates
+        with the smallest combined distance
+            sqrt( horizontal**2 + (vertical_scale * height)**2 )
+        are kept, where height is the beam height above the point. Far from
+        the radar this prefers the lower, radar-side gates. The table
+        depends only on station, VCP, and the points, so it is computed
+        once and is a cheap lookup for every later volume.
+    Inputs:
+        geometry       : Canonical geometry from regrid_weights.sweep_geometry
+        sweep          : Sweep number; must be in geometry
+        lon            : Tuple of point longitudes
+        lat            : Tuple of point latitudes
+    Keywords:
+        alt            : Tuple of point elevations (m above sea level);
+                          missing or invalid values (see valid_altitude)
+                          are replaced by the radar's
+        k              : Number of gates per point
+        max_dist       : Maximum horizontal distance (km) of gates
+        max_height     : Maximum beam height (m) above the point; gates
+                          above are not used
+        vertical_scale : Weight of height relative to horizontal distance
+        candidates     : Number of horizontal neighbours considered per
+                          gate kept
+        terrain        : Terrain height function; if set, gates flagged by
+                          blockage_mask are not used
+        threshold      : Blocked fraction of beam; see blockage_mask
+        cache_dir      : Directory to store blockage masks in
+    Outputs:
+        Returns [npoints, k] flat gate indices into the [nazimuth, ngates]
+        canonical sweep (-1 where there is no usable gate), and the beam
+        height (m) above the point of each gate
+    """
+    angle, naz, r0, dr, ng = _sweep_info( geometry, sweep )
+    lon_0, lat_0, site_alt = geometry[2:5]
+    lon      = np.asarray( lon, dtype = np.float64 )
+    lat      = np.asarray( lat, dtype = np.float64 )
+    alt      = valid_altitude( site_alt if alt is None else alt, site_alt, lon.size )
+    x, y     = geographic_to_cartesian( lon, lat, lon_0, lat_0 )
+    ranges   = r0 + dr * np.arange(ng)
+    azimuth  = (np.arange(naz) + 0.5) * 360.0 / naz
+    dist, rays, gates = polar_gate_lookup( x, y, azimuth, np.full( naz, angle ), ranges, k = k * candidates )
+
+    height   = site_alt + beam_height( ranges[gates], angle ) - alt[:,None]     # Beam height above point
+    bad      = dist > max_dist * 1.0e3
+    if max_height is not None: bad |= height > max_height
+    if terrain is not None:    bad |= blockage_mask( geometry, sweep, terrain, threshold, cache_dir = cache_dir )[rays, gates]
+    score    = np.where( bad, np.inf, np.hypot( dist, vertical_scale * np.maximum( height, 0.0 ) ) )
+    kk       = min( k, score.shape[1] )
+    best     = np.argsort( score, axis = 1, kind = 'stable' )[:,:kk]
+    ids      = np.full( (lon.size, k), -1, dtype = np.int64 )
+    hgt      = np.full( (lon.size, k), np.nan, dtype = np.float32 )
+    ok       = np.isfinite( np.take_along_axis( score, best, axis = 1 ) )
+    flat     = np.take_along_axis( rays * ng + gates, best, axis = 1 )
+    ids[:,:kk] = np.where( ok, flat, -1 )
+    hgt[:,:kk] = np.where( ok, np.take_along_axis( height, best, axis = 1 ), np.nan )
+    logging.getLogger(__name__).debug( 'Height table for {} sweep {}: {} points'.format(geometry[0], sweep, lon.size) )
+    return ids, hgt
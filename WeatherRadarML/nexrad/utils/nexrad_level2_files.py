@@ -0,0 +1,43 @@
+import os, re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .nexrad_level2_directory import nexrad_level2_directory
+
+_dateFMT = '%Y%m%d_%H%M%S'                                                      # Time format in NEXRAD files
+_fileRE  = re.compile( r'^[A-Z0-9]{4}\d{8}_\d{6}(_V\d{2})?(\.gz)?$' )            # Complete Level 2 file names; aws puts .RANDOMHASH on file names while downloading
+
+def nexrad_level2_files(date, station, root = '/data1/', days = 1):
+    """
+    Name:
+        nexrad_level2_files
+    Purpose:
+        Function to list the local NEXRAD Level 2 files for a station and
+        the times of the volumes they contain
+    Inputs:
+        date    : Datetime of the first day to list files for
+        station : Station ID; e.g., KHGX
+    Keywords:
+        root    : Top-level root directory; see nexrad_level2_directory
+        days    : Number of days to list files for
+    Returns:
+        Returns a datetime64[s] array of volume times and a list of the
+        full paths to the files, both sorted by time. *_MDM, *.tar, and
+        partially downloaded files are skipped
+    """
+    times = []
+    paths = []
+    date  = datetime(date.year, date.month, date.day)
+    for i in range( days ):                                                     # Iterate over days
+        statDir = nexrad_level2_directory( date + timedelta(days = i), station = station, root = root )[0][0]
+        if not os.path.isdir( statDir ): continue                               # Skip days with no data
+        for fBase in os.listdir( statDir ):                                     # Iterate over all files in the directory
+            if not _fileRE.match( fBase ): continue                              # Skip MDM, tar, hidden, and partially downloaded files
+            fDate = datetime.strptime( fBase[4:19], _dateFMT )                  # Create datetime object for file using information in file name
+            times.append( fDate )
+            paths.append( os.path.join( statDir, fBase ) )
+
+    times = np.asarray( times, dtype = 'datetime64[s]' )
+    order = np.argsort( times, kind = 'stable' )
+    return times[order], [paths[i] for i in order]
@@ -0,0 +1,384 @@
+import logging
+import os, bz2, struct
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ...profiling import timer, count
+
+_volHeader   = struct.Struct('>9s3sII4s')                                       # Archive II volume header; tape, extension, date, time, ICAO
+_ctlWord     = struct.Struct('>i')                                              # LDM control word; (signed) size of compressed record
+_msgHeader   = struct.Struct('>HBBHHIHH')                                       # Message header; size, channels, type, seq_id, date, ms, segments, seg_num
+_msg31Header = struct.Struct('>4sIHHfBBHBBBBfBbH')                              # Message 31 data header up to, and including, the block count
+_momentBlock = struct.Struct('>c3sIHhhhhBBff')                                  # Generic moment data block header
+_volBlock    = struct.Struct('>c3sHBBffhH')                                     # Volume data constant block; up to, and including, feedhorn height
+_msg5Header  = struct.Struct('>HHHHHBB10s')                                     # Volume coverage pattern header (message 5)
+
+_ctmSize     = 12                                                               # Size of Channel Terminal Manager header preceeding each message
+_recordSize  = 2432                                                             # Size of fixed length messages
+_cutSize     = 46                                                               # Size of each elevation cut record in message 5
+
+# Mapping of Py-ART field names to Level 2 moment names
+FIELD_NAMES = {
+    'reflectivity'                 : 'REF',
+    'velocity'                     : 'VEL',
+    'spectrum_width'               : 'SW',
+    'differential_reflectivity'    : 'ZDR',
+    'differential_phase'           : 'PHI',
+    'cross_correlation_ratio'      : 'RHO',
+    'clutter_filter_power_removed' : 'CFP'
+}
+
+###############################################################################
+class _level2_record( object ):
+    """
+    Private class holding the radial table of one decompressed LDM record.
+    Moment data are NOT decoded here, only the byte offsets of each moment
+    within the decompressed buffer, so that gathering a field is a single
+    index operation on a numpy view of the buffer.
+    """
+    def __init__(self, buf):
+        self.buf       = buf
+        self.elevNum   = []                                                     # Elevation (sweep) number of each radial
+        self.azimuth   = []                                                     # Azimuth angle of each radial
+        self.elevation = []                                                     # Elevation angle of each radial
+        self.time      = []                                                     # Collection time of each radial; (modified julian date, ms)
+        self.moments   = {}                                                     # Moment offsets and decoding info, keyed by moment name
+        self.volume    = None                                                   # Volume data constant block from first radial
+        self.vcp       = None                                                   # Message 5 information, only found in the metadata record
+
+        pos   = _ctmSize                                                        # Skip over CTM header of first message
+        nbuf  = len(buf)
+        while (pos + _msgHeader.size) <= nbuf:                                  # While there is room for another message header
+            size, _, mtype = _msgHeader.unpack_from(buf, pos)[:3]               # Get size and type of message
+            if (mtype == 31):                                                   # If generic radial message
+                self._msg31( buf, pos + _msgHeader.size )
+                pos += size * 2 + _ctmSize                                      # Message size is in halfwords and includes the message header
+            else:
+                if (mtype == 5) and (self.vcp is None):                         # If volume coverage pattern message
+                    self._msg5( buf, pos + _msgHeader.size )
+                pos += _recordSize                                              # All other messages are fixed length
+
+        self.elevNum   = np.asarray( self.elevNum,   dtype = np.int32 )
+        self.azimuth   = np.asarray( self.azimuth,   dtype = np.float32 )
+        self.elevation = np.asarray( self.elevation, dtype = np.float32 )
+
+    ###########################################################################
+    def _msg31(self, buf, pos):
+        """Parse radial header and moment block pointers of a message 31"""
+        info    = _msg31Header.unpack_from(buf, pos)
+        nblock  = info[-1]
+        ptrs    = struct.unpack_from('>{}I'.format(nblock), buf, pos + _msg31Header.size)
+        iray    = len(self.elevNum)
+        self.elevNum.append(   info[10] )
+        self.azimuth.append(   info[4] )
+        self.elevation.append( info[12] )
+        self.time.append(    ( info[2], info[1] ) )
+        for ptr in ptrs:
+            if (ptr == 0): continue
+            name = buf[pos+ptr+1:pos+ptr+4].decode('ascii').strip()             # Name of the data block
+            if (name == 'VOL'):
+                if (self.volume is None):
+                    self.volume = _volBlock.unpack_from(buf, pos+ptr)
+            elif (name in FIELD_NAMES.values()):                                # If moment data block
+                blk = _momentBlock.unpack_from(buf, pos+ptr)
+                mom = self.moments.setdefault( name,
+                        {'ray' : [], 'offset' : [], 'ngates' : [], 'first_gate' : blk[4],
+                         'gate_spacing' : blk[5], 'word_size' : blk[9],
+                         'scale' : blk[10], 'offset_value' : blk[11]} )
+                mom['ray'].append(    iray )
+                mom['offset'].append( pos + ptr + _momentBlock.size )           # Offset of the first gate within the buffer
+                mom['ngates'].append( blk[3] )
+
+    ###########################################################################
+    def _msg5(self, buf, pos):
+        """Parse volume coverage pattern number and elevation angles from message 5"""
+        info  = _msg5Header.unpack_from(buf, pos)
+        ncut  = info[3]
+        pos  += _msg5Header.size
+        angle = [struct.unpack_from('>H', buf, pos + i*_cutSize)[0] * 360.0 / 65536.0 for i in range(ncut)]
+        self.vcp = {'pattern_number' : info[2], 'elevation_angles' : np.asarray(angle, dtype=np.float32)}
+
+    ###########################################################################
+    def elevRange(self):
+        """Return (min, max) elevation number in record; (-1, -1) if no radials"""
+        if (self.elevNum.size == 0): return (-1, -1)
+        return (int(self.elevNum.min()), int(self.elevNum.max()))
+
+###############################################################################
+@lru_cache(maxsize = 256)
+def _record_offsets(filename, mtime, size):
+    """
+    Name:
+        _record_offsets
+    Purpose:
+        Private function to index the compressed LDM records of an Archive II
+        file. Only the 4-byte control words are read, so this is cheap, and
+        the result is cached so it happens once per file.
+    Inputs:
+        filename : Path to the Archive II file
+        mtime    : Modification time of the file; part of the cache key
+        size     : Size of the file; part of the cache key
+    Outputs:
+        Returns the volume header tuple and an [nrecord, 2] array of the
+        (offset, size) of the bzip2 data in each record
+    """
+    offsets = []
+    with open(filename, 'rb') as fid:
+        header = _volHeader.unpack( fid.read(_volHeader.size) )                 # Read volume header
+        pos    = _volHeader.size
+        while (pos + _ctlWord.size) <= size:                                    # While there is room for a control word
+            fid.seek( pos )
+            nbytes = abs( _ctlWord.unpack( fid.read(_ctlWord.size) )[0] )       # Size of the record; sign only flags last record of volume
+            if (nbytes == 0): break
+            if (len(offsets) == 0) and (fid.read(2) != b'BZ'):                  # Check first record for bzip2 compression
+                raise ValueError('Not a bzip2 compressed Archive II file: {}'.format(filename))
+            offsets.append( (pos + _ctlWord.size, nbytes,) )
+            pos += _ctlWord.size + nbytes
+    return header, np.asarray( offsets, dtype = np.int64 ).reshape(-1, 2)
+
+###############################################################################
+class nexrad_level2_reader( object ):
+    """
+    Name:
+        nexrad_level2_reader
+    Purpose:
+        A lightweight, lazy reader for NEXRAD Level 2 (Archive II, message 31)
+        files that only decompresses the LDM records needed for the requested
+        sweeps. Records are located by a binary search over the (monotonically
+        increasing) elevation numbers, so reading the lowest sweeps of a volume
+        touches only a few of its records.
+        The methods mirror those of pyart.core.Radar that are used in this
+        package so that either object can be passed to the extraction code.
+    """
+    def __init__(self, filename):
+        """
+        Inputs:
+            filename : Path to Archive II file
+        Keywords:
+            None.
+        Note:
+            Raises ValueError if the file is not a bzip2 compressed Archive II
+            file; use pyart.io.read for those.
+        """
+        self.log       = logging.getLogger(__name__)
+        self.filename  = filename
+        info           = os.stat( filename )
+        header, self._offsets = _record_offsets( filename, info.st_mtime, info.st_size )
+        self.station   = header[4].decode('ascii')
+        self.time      = datetime(1969, 12, 31) + timedelta(days = header[2], milliseconds = header[3])
+
+        self._records    = {}                                                   # Decoded records; keyed by record index
+        self._nsweeps    = None
+        self._location   = None
+        self.bytes_read  = 0                                                    # Number of compressed bytes read from file
+        self.bytes_total = int( self._offsets[:,1].sum() )                      # Total number of compressed bytes in file
+
+    ###########################################################################
+    @property
+    def nrecords(self):
+        return self._offsets.shape[0]
+
+    @property
+    def nsweeps(self):
+        """Number of sweeps; the elevation number of the last radial in the file"""
+        if self._nsweeps is None:
+            for i in range(self.nrecords-1, 0, -1):                             # Iterate backwards over records, only last one needed unless it is empty
+                emax = self._record(i).elevRange()[1]
+                if (emax > 0):
+                    self._nsweeps = emax
+                    break
+            else:
+                self._nsweeps = 0
+        return self._nsweeps
+
+    @property
+    def vcp(self):
+        """Volume coverage pattern information from message 5 of the metadata record"""
+        return self._record(0).vcp
+
+    @property
+    def fixed_angle(self):
+        """Target elevation angle (degrees) of each sweep from the volume coverage pattern"""
+        vcp = self.vcp
+        if (vcp is not None) and (vcp['elevation_angles'].size >= self.nsweeps):
+            return {'data' : vcp['elevation_angles'][:self.nsweeps]}
+        return {'data' : np.asarray( [np.median(self.get_elevation(i)) for i in range(self.nsweeps)], dtype = np.float32 )}
+
+    @property
+    def projection(self):
+        return {'proj' : 'pyart_aeqd', '_include_lon_0_lat_0' : True}
+
+    @property
+    def latitude(self):
+        return {'data' : np.asarray( [self._site()[0]], dtype = np.float64 )}
+
+    @property
+    def longitude(self):
+        return {'data' : np.asarray( [self._site()[1]], dtype = np.float64 )}
+
+    @property
+    def altitude(self):
+        return {'data' : np.asarray( [self._site()[2]], dtype = np.float64 )}
+
+    ###########################################################################
+    def get_azimuth(self, sweep):
+        """Return azimuth angles (degrees) of all rays in sweep"""
+        return np.concatenate( [r.azimuth[r.elevNum == sweep+1] for r in self._sweep_records(sweep)] )
+
+    def get_elevation(self, sweep):
+        """Return elevation angles (degrees) of all rays in sweep"""
+        return np.concatenate( [r.elevation[r.elevNum == sweep+1] for r in self._sweep_records(sweep)] )
+
+    def get_times(self, sweep):
+        """Return collection times of all rays in sweep as datetime64[ms]"""
+        times = []
+        for r in self._sweep_records(sweep):
+            t = np.asarray( r.time, dtype = np.int64 ).reshape(-1, 2)[r.elevNum == sweep+1]
+            times.append( (t[:,0] - 1) * 86400000 + t[:,1] )                    # Modified julian date is days since 1969-12-31 (day 1 is 1970-01-01)
+        return np.concatenate( times ).astype('datetime64[ms]')
+
+    def get_range(self, sweep, field = None):
+        """
+        Return range (meters) to center of gates in sweep. If field is None,
+        range covers the moment with the most gates
+        """
+        info = self._moment_info( sweep, field )
+        return info['first_gate'] + info['gate_spacing'] * np.arange( info['ngates'], dtype = np.float32 )
+
+    ###########################################################################
+    def get_gate_x_y_z(self, sweep, field = None):
+        """
+        Return Cartesian coordinates (meters) of gates in sweep relative to
+        the radar using the 4/3 earth radius model
+        """
+        from pyart.core import antenna_vectors_to_cartesian
+        return antenna_vectors_to_cartesian(
+                    self.get_range(sweep, field), self.get_azimuth(sweep), self.get_elevation(sweep) )
+
+    ###########################################################################
+    def get_field(self, sweep, field, raw = False):
+        """
+        Name:
+            get_field
+        Purpose:
+            Method to get data for a single field in a single sweep. The raw
+            gate values of each record are gathered from a numpy view of the
+            decompressed buffer with one index operation.
+        Inputs:
+            sweep : Sweep number (zero based)
+            field : Py-ART field name (e.g., reflectivity) or Level 2 moment
+                     name (e.g., REF)
+        Keywords:
+            raw   : Set to return the raw (unscaled) values
+        Outputs:
+            Returns an [nrays, ngates] masked array of the field. Gates beyond
+            the end of the field are masked so that all fields in a sweep have
+            the same shape. Masked values are below threshold, range folded,
+            or missing.
+        """
+        moment  = FIELD_NAMES.get(field, field)
+        records = self._sweep_records(sweep)
+        ngates  = self._moment_info(sweep)['ngates']                            # Number of gates for the longest moment in sweep
+        nrays   = sum( int( (r.elevNum == sweep+1).sum() ) for r in records )
+        data    = np.zeros( (nrays, ngates), dtype = np.uint16 )
+        scale   = offset = None
+        ray0    = 0
+        for r in records:
+            inSweep = np.flatnonzero( r.elevNum == sweep+1 )
+            mom     = r.moments.get( moment, None )
+            if mom is not None:
+                rays  = np.asarray( mom['ray'] )
+                keep  = np.isin( rays, inSweep )
+                if keep.any():
+                    nbyte = mom['word_size'] // 8
+                    ng    = min( min(mom['ngates']), ngates )
+                    off   = np.asarray( mom['offset'] )[keep]
+                    view  = np.frombuffer( r.buf, dtype = np.uint8 )            # View of the decompressed buffer; no copy
+                    index = off[:,None] + np.arange( ng * nbyte )               # Index of every byte to gather
+                    vals  = view[ index ]
+                    if (nbyte == 2):
+                        vals = vals.view('>u2')
+                    data[ray0 + np.searchsorted(inSweep, rays[keep]), :ng] = vals
+                    scale, offset = mom['scale'], mom['offset_value']
+            ray0 += inSweep.size
+
+        if raw: return data
+        mask = data <= 1                                                        # Zero is below threshold, one is range folded
+        if scale is None:                                                       # Moment not in sweep
+            return np.ma.masked_array( np.zeros(data.shape, dtype = np.float32), mask = mask )
+        vals = (data.astype(np.float32) - np.float32(offset)) / np.float32(scale)
+        return np.ma.masked_array( vals, mask = mask )
+
+    ###########################################################################
+    def _site(self):
+        """Return (lat, lon, alt) of radar from volume data constant block"""
+        if self._location is None:
+            for i in range(1, self.nrecords):
+                vol = self._record(i).volume
+                if vol is not None:
+                    self._location = (vol[5], vol[6], float(vol[7] + vol[8]),)  # Latitude, longitude, and height of site plus feedhorn
+                    break
+            else:
+                raise ValueError('No volume data block found in file: {}'.format(self.filename))
+        return self._location
+
+    ###########################################################################
+    def _moment_info(self, sweep, field = None):
+        """Return gate information for given moment; longest moment if field is None"""
+        moment = None if field is None else FIELD_NAMES.get(field, field)
+        best   = None
+        for r in self._sweep_records(sweep):
+            for name, mom in r.moments.items():
+                if (moment is not None) and (name != moment): continue
+                ng = max( mom['ngates'] )
+                if (best is None) or (ng > best['ngates']):
+                    best = {'first_gate'   : mom['first_gate'],
+                            'gate_spacing' : mom['gate_spacing'],
+                            'ngates'       : ng}
+            if best is not None: break                                          # Gate layout is fixed within a sweep so first record is enough
+        if best is None:
+            raise ValueError('Sweep {} has no {} data'.format(sweep, moment or 'moment'))
+        return best
+
+    ###########################################################################
+    def _record(self, index):
+        """Return decoded record, decompressing it if not already done"""
+        if index not in self._records:
+            offset, nbytes = self._offsets[index]
+            with timer('read.level2_record'):
+                with open(self.filename, 'rb') as fid:
+                    fid.seek( offset )
+                    cbuf = fid.read( nbytes )
+                self._records[index] = _level2_record( bz2.decompress( cbuf ) )
+            self.bytes_read += nbytes
+            count( 'read.level2_bytes', nbytes )
+        return self._records[index]
+
+    ###########################################################################
+    def _sweep_records(self, sweep):
+        """
+        Return list of records containing radials for given (zero based)
+        sweep. Elevation numbers increase through the file, so the first
+        record is found with a binary search and records are then read
+        until the sweep ends.
+        """
+        elev = sweep + 1
+        lo   = 1                                                                # Record zero is metadata
+        hi   = self.nrecords
+        while lo < hi:                                                          # Find first record whose last radial is at/after sweep
+            mid = (lo + hi) // 2
+            if self._record(mid).elevRange()[1] < elev:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        records = []
+        for i in range(lo, self.nrecords):
+            emin, emax = self._record(i).elevRange()
+            if (emin > elev): break
+            if (emin <= elev <= emax): records.append( self._record(i) )
+        if (len(records) == 0):
+            raise ValueError('Sweep {} not found in file: {}'.format(sweep, self.filename))
+        return records
@@ -0,0 +1,179 @@
+import numpy as np
+
+EFFECTIVE_RADIUS = 6371.0 * 1000.0 * 4.0 / 3.0                                  # 4/3 earth radius (m); same as pyart.core.antenna_to_cartesian
+
+###############################################################################
+def beam_ground_range(ranges, elevation):
+    """
+    Name:
+        beam_ground_range
+    Purpose:
+        Function to compute the ground (arc) distance of gates from the radar
+        using the 4/3 earth radius beam model
+    Inputs:
+        ranges    : Slant range(s) to gate(s) in meters
+        elevation : Elevation angle(s) of the beam in degrees
+    Keywords:
+        None.
+    Outputs:
+        Returns ground distance(s) in meters; broadcast of inputs
+    """
+    z     = beam_height( ranges, elevation )
+    return EFFECTIVE_RADIUS * np.arcsin( ranges * np.cos( np.deg2rad(elevation) ) / (EFFECTIVE_RADIUS + z) )
+
+###############################################################################
+def beam_height(ranges, elevation):
+    """
+    Name:
+        beam_height
+    Purpose:
+        Function to compute the height of gates above the radar using the
+        4/3 earth radius beam model
+    Inputs:
+        ranges    : Slant range(s) to gate(s) in meters
+        elevation : Elevation angle(s) of the beam in degrees
+    Keywords:
+        None.
+    Outputs:
+        Returns height(s) in meters; broadcast of inputs
+    """
+    theta = np.deg2rad( elevation )
+    return np.sqrt( ranges**2 + EFFECTIVE_RADIUS**2 + 2.0 * ranges * EFFECTIVE_RADIUS * np.sin(theta) ) - EFFECTIVE_RADIUS
+
+###############################################################################
+def beam_slant_range(ground, elevation):
+    """
+    Name:
+        beam_slant_range
+    Purpose:
+        Function to compute the slant range at which a beam at a given
+        elevation angle is above a given ground distance from the radar
+        using the 4/3 earth radius beam model; the inverse of
+        beam_ground_range
+    Inputs:
+        ground    : Ground (arc) distance(s) from radar in meters
+        elevation : Elevation angle(s) of the beam in degrees
+    Keywords:
+        None.
+    Outputs:
+        Returns slant range(s) in meters; broadcast of inputs
+    """
+    phi = np.asarray( ground ) / EFFECTIVE_RADIUS                               # Angle at center of earth between radar and point
+    return EFFECTIVE_RADIUS * np.sin(phi) / np.cos( np.deg2rad(elevation) + phi )
+
+###############################################################################
+def polar_gate_lookup(x, y, azimuth, elevation, ranges, k = 9):
+    """
+    Name:
+        polar_gate_lookup
+    Purpose:
+        Function to find the k gates of a sweep closest (horizontally) to
+        points without building a tree. The target points are converted to
+        (azimuth, slant range) and candidate gates are found by index
+        arithmetic; a binary search on the sorted azimuths and division by
+        the gate spacing. Exact distances are computed only for a small
+        window of gates around each point, and the window is grown for any
+        point whose k-th distance is not guaranteed by the window edges, so
+        results match a KD-tree query on the gate x/y coordinates.
+    Inputs:
+        x         : Easting(s) of point(s) relative to the radar (meters)
+        y         : Northing(s) of point(s) relative to the radar (meters)
+        azimuth   : Azimuth angle of each ray in the sweep (degrees)
+        elevation : Elevation angle of each ray in the sweep (degrees)
+        ranges    : Slant range to each gate in the sweep (meters); must
+                     be regularly spaced
+    Keywords:
+        k         : Number of gates to find for each point
+    Outputs:
+        Returns distance (meters), ray index, and gate index arrays, each
+        with shape [npoints, k], sorted from nearest to farthest
+    """
+    x         = np.atleast_1d( np.asarray(x, dtype = np.float64) )
+    y         = np.atleast_1d( np.asarray(y, dtype = np.float64) )
+    azimuth   = np.asarray( azimuth,   dtype = np.float64 ) % 360.0
+    elevation = np.asarray( elevation, dtype = np.float64 )
+    ranges    = np.asarray( ranges,    dtype = np.float64 )
+    nrays     = azimuth.size
+    ngates    = ranges.size
+    k         = min( k, nrays * ngates )
+
+    order     = np.argsort( azimuth )                                           # Sort rays by azimuth; rays are not guaranteed to start at north
+    azSort    = azimuth[order]
+    elSort    = elevation[order]
+    dAz       = np.median( np.diff(azSort) ) if (nrays > 1) else 360.0          # Nominal ray spacing
+    r0        = ranges[0]
+    dr        = (ranges[-1] - r0) / max(ngates-1, 1)                            # Gate spacing
+
+    azPoint   = np.rad2deg( np.arctan2(x, y) ) % 360.0                          # Azimuth of point(s)
+    sPoint    = np.hypot( x, y )                                                # Ground distance of point(s)
+    rPoint    = beam_slant_range( sPoint, elSort.mean() )                       # Slant range of point(s)
+    rayCenter = np.searchsorted( azSort, azPoint )                              # Ray insertion index, O(log nrays)
+    gateCenter= np.rint( (rPoint - r0) / dr )                                   # Closest gate index
+    gateCenter= np.clip( np.nan_to_num(gateCenter, nan = ngates), 0, ngates-1 ).astype(np.int64)   # Points beyond the sweep are closest to its edge
+
+    # Initial window half-widths from size of gates near point
+    cellAz    = np.maximum( sPoint * np.deg2rad(dAz), 1.0 )
+    radius    = np.sqrt( k * dr * cellAz / np.pi ) + np.hypot( dr, cellAz )     # Radius of circle that should contain k gates
+    wRay      = np.ceil( np.log2( radius / cellAz + 1 ) ).astype(np.int64)      # Window half-widths stored as powers of two so that
+    wGate     = np.ceil( np.log2( radius / dr     + 1 ) ).astype(np.int64)      # points can be grouped by window size
+
+    dist      = np.full( (x.size, k), np.inf )
+    rays      = np.zeros( (x.size, k), dtype = np.int64 )
+    gates     = np.zeros( (x.size, k), dtype = np.int64 )
+    todo      = np.arange( x.size )
+    while todo.size > 0:
+        key   = wRay[todo] * 64 + wGate[todo]
+        left  = []
+        for kval in np.unique( key ):                                           # Iterate over groups of points with same window size
+            pts   = todo[key == kval]
+            wr    = min( 2**int(kval // 64), (nrays+1) // 2 )                   # Ray half-width; never more than all rays
+            wg    = min( 2**int(kval %  64), ngates )                           # Gate half-width
+            gOff  = np.arange( -wg, wg+1 )
+            if (2 * wr >= nrays):                                               # If window covers all rays
+                rIdx = np.broadcast_to( np.arange(nrays), (pts.size, nrays) )
+            else:
+                rIdx = (rayCenter[pts,None] + np.arange(-wr, wr)) % nrays       # [npts, nr] sorted ray indices
+            gIdx  = gateCenter[pts,None] + gOff                                 # [npts, ng] gate indices; may be out of bounds
+            gOK   = (gIdx >= 0) & (gIdx < ngates)
+            gIdx  = np.clip( gIdx, 0, ngates-1 )
+
+            el    = elSort[rIdx][:,:,None]
+            az    = np.deg2rad( azSort[rIdx] )[:,:,None]
+            s     = beam_ground_range( ranges[gIdx][:,None,:], el )             # Ground distance of candidate gates
+            d     = np.hypot( s * np.sin(az) - x[pts,None,None],
+                              s * np.cos(az) - y[pts,None,None] )
+            d     = np.where( gOK[:,None,:], d, np.inf ).reshape( pts.size, -1 )
+            kk    = min( k, d.shape[1] )
+            part  = np.argpartition( d, kk-1, axis = 1 )[:,:kk]
+            dk    = np.take_along_axis( d, part, axis = 1 )
+            srt   = np.argsort( dk, axis = 1 )
+            part  = np.take_along_axis( part, srt, axis = 1 )
+            dk    = np.take_along_axis( dk,   srt, axis = 1 )
+
+            # Minimum distance to any gate outside the window, used to verify result
+            if (2 * wr >= nrays):
+                mRay = np.full( pts.size, np.inf )
+            else:
+                lo   = (azPoint[pts] - azSort[(rayCenter[pts] - wr - 1) % nrays]) % 360.0
+                hi   = (azSort[(rayCenter[pts] + wr) % nrays] - azPoint[pts]) % 360.0
+                mRay = sPoint[pts] * np.sin( np.deg2rad( np.minimum( np.minimum(lo, hi), 90.0 ) ) )
+            gLo   = gateCenter[pts] - wg - 1
+            gHi   = gateCenter[pts] + wg + 1
+            sLo   = np.where( gLo >= 0,     beam_ground_range( ranges[np.clip(gLo, 0, ngates-1)], elevation.min() ), -np.inf )
+            sHi   = np.where( gHi < ngates, beam_ground_range( ranges[np.clip(gHi, 0, ngates-1)], elevation.max() ),  np.inf )
+            mGate = np.minimum( sPoint[pts] - sLo, sHi - sPoint[pts] )
+            growR = dk[:,-1] > mRay
+            growG = dk[:,-1] > mGate
+            done  = ~(growR | growG) | ((2 * wr >= nrays) & (wg >= ngates))
+
+            idx            = pts[done]
+            sel            = np.arange( idx.size )[:,None]
+            dist[idx,:kk]  = dk[done]
+            rays[idx,:kk]  = order[ rIdx[done][sel, part[done] // gOff.size] ]
+            gates[idx,:kk] = gIdx[done][sel, part[done] % gOff.size]
+            wRay[ pts[~done & growR] ] += 1                                     # Double window in ray direction for unresolved points
+            wGate[ pts[~done & growG] ] += 1                                    # Double window in gate direction for unresolved points
+            left.append( pts[~done] )
+        todo = np.concatenate( left )
+
+    return dist, rays, gates
@@ -0,0 +1,203 @@
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from WeatherRadarML import dataDir
+from .radar_geometry import station_table, geographic_to_cartesian
+from .polar_gate_lookup import beam_ground_range, beam_slant_range, beam_height
+
+COVERAGE_FILE = os.path.join( dataDir, 'asos-nexrad-coverage.npz' )             # Default location of precomputed coverage table
+_ftToM        = 0.3048                                                          # ASOS station elevations are in feet
+_missingElev  = -9999.0                                                         # ASOS list uses -99999 for unknown elevation
+
+###############################################################################
+class radar_coverage( object ):
+    def __init__(self, data):
+        """
+        Name:
+            radar_coverage
+        Purpose:
+            Table of the NEXRAD sites covering each ASOS station, with the
+            distance, azimuth, and height of the lowest tilt's beam above
+            the station. Sites of a station are stored back to back (sorted
+            by distance) with offsets, so the table is a few compact arrays
+            and looking up a station is a dictionary access and a slice.
+            Use build_coverage to make a table and load_coverage to read
+            one.
+        Inputs:
+            data : Dictionary of arrays; see build_coverage
+        Keywords:
+            None.
+        """
+        self.data   = data
+        self._index = {s : i for i, s in enumerate( data['station'].tolist() )}  # Row of each station
+
+    def __contains__(self, station):
+        return station in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def radars(self, station):
+        """
+        Inputs:
+            station : ASOS station call sign; e.g., IAH
+        Keywords:
+            None.
+        Outputs:
+            Returns list of (radar id, lon, lat, altitude (km), distance (km),
+            azimuth (deg), beam height above station (m)) tuples, sorted from
+            nearest to farthest; the first four match get_nearest_radar.
+            Empty if the station is covered by no radar or is not in the
+            table.
+        """
+        i = self._index.get( station, None )
+        if i is None: return []
+        d     = self.data
+        sl    = slice( d['offsets'][i], d['offsets'][i+1] )
+        radar = d['radar'][sl]
+        return [(str(d['radar_id'][r]), float(d['radar_lon'][r]), float(d['radar_lat'][r]), float(d['radar_alt'][r]),
+                 float(dist), float(az), float(hgt))
+                for r, dist, az, hgt in zip( radar, d['distance'][sl], d['azimuth'][sl], d['height'][sl] )]
+
+    def nearest(self, station):
+        """Return ID of nearest covering radar of station; '' if none"""
+        i = self._index.get( station, None )
+        if (i is None) or (self.data['offsets'][i] == self.data['offsets'][i+1]): return ''
+        return str( self.data['radar_id'][ self.data['radar'][ self.data['offsets'][i] ] ] )
+
+    def elevation(self, station):
+        """Return elevation (m) of station; NaN if unknown or not in the table"""
+        i = self._index.get( station, None )
+        return np.nan if i is None else float( self.data['elev'][i] )
+
+    def save(self, path):
+        """Write table to an .npz file atomically"""
+        tmp = '{}.{}.tmp.npz'.format(os.path.splitext(path)[0], os.getpid())
+        np.savez( tmp, **self.data )
+        os.replace( tmp, path )
+
+###############################################################################
+def build_coverage(asos_file = None, max_range = 300.0, elevation = 0.5, outfile = None):
+    """
+    Name:
+        build_coverage
+    Purpose:
+        Function to compute which NEXRAD sites cover each ASOS station.
+        A site covers a station if the station is within the ground range
+        of the site's footprint (see radar_geometry.radar_footprint).
+    Inputs:
+        None.
+    Keywords:
+        asos_file : ASOS station list; default is data/asos-stations.txt
+        max_range : Maximum (slant) range of the radars in kilometers
+        elevation : Elevation angle (deg) of the lowest tilt, used for the
+                     beam height above each station
+        outfile   : If set, write the table to this .npz file
+    Outputs:
+        Returns radar_coverage instance. Its data dictionary has:
+            station, lon, lat, elev  : ASOS call sign, location, and
+                                        elevation (m); NaN if unknown
+            offsets                  : [nstation+1] start of each station's
+                                        sites in the arrays below
+            radar                    : Index of site in radar_* arrays
+            distance, azimuth, height: Ground distance (km) and azimuth (deg)
+                                        from site to station, and beam height
+                                        (m) above the station (above sea
+                                        level if elevation is unknown)
+            radar_id, radar_lon,
+            radar_lat, radar_alt     : NEXRAD site information
+            max_range, elevation     : Settings the table was built with
+    """
+    from WeatherRadarML.ASOSInfo import ASOSInfo
+    log   = logging.getLogger(__name__)
+    info  = ASOSInfo() if asos_file is None else ASOSInfo( asos_file )
+    rows  = {}
+    for item in info.data:                                                      # Last entry of a call sign wins; skip stations without one
+        if item['CALL'] == '': continue
+        elev = float(item['ELEV']) if item['ELEV'] != '' else np.nan
+        rows[item['CALL']] = (float(item['LON']), float(item['LAT']),
+                              elev * _ftToM if elev > _missingElev else np.nan)    # NaN compares False, so stays NaN
+    station = np.asarray( sorted( rows ) )
+    lon, lat, elev = np.asarray( [rows[s] for s in station.tolist()], dtype = np.float64 ).reshape( -1, 3 ).T
+
+    sites  = station_table()
+    ground = beam_ground_range( max_range * 1.0e3, 0.0 )                        # Same limit as the footprint polygons
+    pairs  = []
+    for r in range( sites['statid'].size ):                                     # Iterate over radars; all stations at once
+        x, y = geographic_to_cartesian( lon, lat, sites['lon'][r], sites['lat'][r] )
+        dist = np.hypot( x, y )
+        near = np.flatnonzero( dist <= ground )
+        if (near.size == 0): continue
+        slant = beam_slant_range( dist[near], elevation )
+        hgt   = beam_height( slant, elevation ) + sites['alt'][r] * 1.0e3 - np.nan_to_num( elev[near] )
+        az    = np.degrees( np.arctan2( x[near], y[near] ) ) % 360.0
+        pairs.append( (near, np.full( near.size, r ), dist[near], az, hgt,) )
+
+    near, radar, dist, az, hgt = [np.concatenate( p ) for p in zip( *pairs )] if pairs else [np.zeros(0)] * 5
+    order = np.lexsort( (dist, near) )                                          # By station, then distance
+    data  = {'station'   : station,
+             'lon'       : lon.astype( np.float32 ),
+             'lat'       : lat.astype( np.float32 ),
+             'elev'      : elev.astype( np.float32 ),
+             'offsets'   : np.concatenate( [[0], np.cumsum( np.bincount( near.astype(int), minlength = station.size ) )] ).astype( np.int32 ),
+             'radar'     : radar[order].astype( np.int16 ),
+             'distance'  : (dist[order] / 1.0e3).astype( np.float32 ),
+             'azimuth'   : az[order].astype( np.float32 ),
+             'height'    : hgt[order].astype( np.float32 ),
+             'radar_id'  : sites['statid'],
+             'radar_lon' : sites['lon'],
+             'radar_lat' : sites['lat'],
+             'radar_alt' : sites['alt'],
+             'max_range' : np.float32( max_range ),
+             'elevation' : np.float32( elevation )}
+    coverage = radar_coverage( data )
+    log.info( 'Coverage of {} ASOS stations by {} radars; {} pairs'.format(station.size, sites['statid'].size, order.size) )
+    if outfile is not None:
+        coverage.save( outfile )
+    return coverage
+
+###############################################################################
+@lru_cache(maxsize = 4)
+def load_coverage(path = COVERAGE_FILE, max_range = 300.0):
+    """
+    Name:
+        load_coverage
+    Purpose:
+        Function to read a coverage table. If the file is missing or was
+        built with another max_range, the table is built and written to
+        path (if possible). Tables are cached, so each is read only once
+        per process.
+    Inputs:
+        None.
+    Keywords:
+        path      : Path to .npz file written by build_coverage
+        max_range : Maximum (slant) range of the radars in kilometers
+    Outputs:
+        Returns radar_coverage instance
+    """
+    log = logging.getLogger(__name__)
+    if os.path.isfile( path ):
+        with np.load( path, allow_pickle = False ) as data:
+            data = {key : data[key] for key in data.files}
+        if np.isclose( data['max_range'], max_range ):
+            return radar_coverage( data )
+    coverage = build_coverage( max_range = max_range )
+    try:
+        coverage.save( path )
+    except OSError as err:                                                      # e.g., read-only install; table is still used in memory
+        log.warning( 'Could not write coverage table {}: {}'.format(path, err) )
+    return coverage
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser( description = 'Precompute which NEXRAD sites cover each ASOS station' )
+    parser.add_argument( '--outfile',   default = COVERAGE_FILE, help = 'Path of .npz table' )
+    parser.add_argument( '--asos-file', help = 'ASOS station list; default is data/asos-stations.txt' )
+    parser.add_argument( '--max-range', type = float, default = 300.0, help = 'Radar range (km)' )
+    parser.add_argument( '--elevation', type = float, default = 0.5, help = 'Elevation (deg) of lowest tilt' )
+    args = parser.parse_args()
+    logging.basicConfig( level = logging.INFO )
+    build_coverage( args.asos_file, max_range = args.max_range, elevation = args.elevation, outfile = args.outfile )
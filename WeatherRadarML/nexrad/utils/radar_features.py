@@ -0,0 +1,195 @@
+import logging
+import warnings
+
+import numpy as np
+
+from .polar_gate_lookup import polar_gate_lookup, beam_height
+from .radar_geometry import geographic_to_cartesian
+
+_stats = ('mean', 'std', 'min', 'max', 'count')                                # Statistics other than percentiles; pNN is the NN-th percentile
+
+class radar_features( object ):
+    """
+    Name:
+        radar_features
+    Purpose:
+        Class to compute a fixed set of features from radar data around
+        target points (e.g., ASOS stations). For each sweep, the gates
+        around all targets are found once (see polar_gate_lookup), every
+        field is gathered with one index operation into a
+        [ntarget, k] array, and statistics are NumPy reductions along the
+        gate axis. Column features use the gate nearest to each target in
+        every sweep of the volume.
+    Features:
+        <field>_s<sweep>_<stat>   : Statistic of a field over the k gates
+                                     closest to the target in a sweep
+        column_max_reflectivity   : Maximum reflectivity over all sweeps
+                                     above the target
+        column_max_height         : Height (m above sea level) of the
+                                     column maximum
+        zdr_column_depth          : Depth (m) of the column above the
+                                     freezing level where ZDR is at or
+                                     above zdr_threshold, starting at the
+                                     first sweep above the freezing level
+    """
+    def __init__(self,
+            fields         = ('reflectivity', 'differential_reflectivity'),
+            sweeps         = (0,),
+            stats          = ('mean', 'std', 'min', 'max', 'p10', 'p50', 'p90'),
+            k              = 9,
+            max_dist       = 1.0,
+            column         = True,
+            zdr_threshold  = 1.0,
+            freezing_level = 4000.0):
+        """
+        Keywords:
+            fields         : Fields to compute neighborhood statistics for
+            sweeps         : Sweeps to compute neighborhood statistics in
+            stats          : Statistics to compute; mean, std, min, max,
+                              count (number of valid gates), or pNN for
+                              the NN-th percentile
+            k              : Number of gates in the neighborhood
+            max_dist       : Maximum distance (km) of gates from target
+            column         : Set to compute column features
+            zdr_threshold  : ZDR (dB) threshold for ZDR column
+            freezing_level : Height (m above sea level) of the freezing
+                              level; scalar, or one per target may be
+                              passed to compute()
+        """
+        for stat in stats:
+            if (stat not in _stats) and not (stat.startswith('p') and stat[1:].replace('.', '', 1).isdigit()):
+                raise Exception( 'Unknown statistic: {}'.format(stat) )
+        self.log            = logging.getLogger(__name__)
+        self.fields         = tuple(fields)
+        self.sweeps         = tuple(sweeps)
+        self.stats          = tuple(stats)
+        self.k              = k
+        self.max_dist       = max_dist
+        self.column         = column
+        self.zdr_threshold  = zdr_threshold
+        self.freezing_level = freezing_level
+
+    ###########################################################################
+    @property
+    def feature_names(self):
+        """List of feature names in the order of the feature vector"""
+        names = ['{}_s{}_{}'.format(field, sweep, stat)
+                    for sweep in self.sweeps for field in self.fields for stat in self.stats]
+        if self.column:
+            names += ['column_max_reflectivity', 'column_max_height', 'zdr_column_depth']
+        return names
+
+    @property
+    def nfeatures(self):
+        return len( self.feature_names )
+
+    ###########################################################################
+    def compute(self, radar, lon, lat, freezing_level = None):
+        """
+        Name:
+            compute
+        Purpose:
+            Method to compute the feature vectors of all targets for one
+            volume
+        Inputs:
+            radar          : nexrad_level2_reader or pyart.core.Radar object
+            lon            : Longitude(s) of target(s)
+            lat            : Latitude(s) of target(s)
+        Keywords:
+            freezing_level : Height (m above sea level) of the freezing
+                              level; scalar or one per target. Default is
+                              the value given at initialization
+        Outputs:
+            Returns [ntarget, nfeatures] float32 array; NaN where a feature
+            cannot be computed (e.g., no valid gates, sweep or field
+            missing)
+        """
+        lon   = np.atleast_1d( np.asarray(lon, dtype = np.float64) )
+        lat   = np.atleast_1d( np.asarray(lat, dtype = np.float64) )
+        out   = np.full( (lon.size, self.nfeatures), np.nan, dtype = np.float32 )
+        x, y  = geographic_to_cartesian( lon, lat, radar.longitude['data'][0], radar.latitude['data'][0] )
+        alt   = float( radar.altitude['data'][0] )
+        col   = 0
+        nstat = len(self.fields) * len(self.stats)
+        for sweep in self.sweeps:                                               # Neighborhood statistics
+            try:
+                rays, gates, near = self._lookup( radar, sweep, x, y, self.k )
+            except (ValueError, IndexError) as err:
+                self.log.debug( 'Sweep {} skipped: {}'.format(sweep, err) )
+                col += nstat
+                continue
+            for field in self.fields:
+                vals = self._gather( radar, sweep, field, rays, gates )
+                vals[~near] = np.nan
+                out[:, col:col+len(self.stats)] = self._reduce( vals )
+                col += len(self.stats)
+
+        if self.column:
+            fl = self.freezing_level if freezing_level is None else freezing_level
+            out[:, col:] = self._column( radar, x, y, alt, np.broadcast_to( np.asarray(fl, dtype = np.float64), lon.shape ) )
+        return out
+
+    ###########################################################################
+    def _lookup(self, radar, sweep, x, y, k):
+        """Return ray and gate indices [ntarget, k] of gates closest to targets, and mask of gates within max_dist"""
+        ranges = radar.get_range( sweep ) if hasattr(radar, 'get_range') else radar.range['data']
+        dist, rays, gates = polar_gate_lookup( x, y, radar.get_azimuth( sweep ), radar.get_elevation( sweep ), ranges, k = k )
+        return rays, gates, dist <= self.max_dist * 1.0e3
+
+    def _gather(self, radar, sweep, field, rays, gates):
+        """Return field values at rays/gates as float32 with NaN for missing data"""
+        try:
+            data = radar.get_field( sweep, field )
+        except (KeyError, ValueError):
+            return np.full( rays.shape, np.nan, dtype = np.float32 )
+        return np.ma.filled( data[rays, gates].astype(np.float32), np.nan )
+
+    def _reduce(self, vals):
+        """Return [ntarget, nstats] statistics over the gate (last) axis of vals; NaN values are ignored"""
+        out = np.empty( (vals.shape[0], len(self.stats)), dtype = np.float32 )
+        with warnings.catch_warnings():                                         # All-NaN neighborhoods give NaN, which is what we want
+            warnings.simplefilter( 'ignore', category = RuntimeWarning )
+            pct  = [s for s in self.stats if s not in _stats]
+            if pct:
+                pval = np.nanpercentile( vals, [float(s[1:]) for s in pct], axis = 1 )  # All percentiles in one pass
+            for i, stat in enumerate( self.stats ):
+                if   (stat == 'mean') : out[:,i] = np.nanmean( vals, axis = 1 )
+                elif (stat == 'std')  : out[:,i] = np.nanstd(  vals, axis = 1 )
+                elif (stat == 'min')  : out[:,i] = np.nanmin(  vals, axis = 1 )
+                elif (stat == 'max')  : out[:,i] = np.nanmax(  vals, axis = 1 )
+                elif (stat == 'count'): out[:,i] = np.isfinite( vals ).sum( axis = 1 )
+                else                  : out[:,i] = pval[ pct.index(stat) ]
+        return out
+
+    def _column(self, radar, x, y, alt, freezing_level):
+        """Return [ntarget, 3] column features using gate nearest to each target in all sweeps"""
+        nsweep = radar.nsweeps
+        ref    = np.full( (x.size, nsweep), np.nan, dtype = np.float32 )
+        zdr    = np.full( (x.size, nsweep), np.nan, dtype = np.float32 )
+        hgt    = np.full( (x.size, nsweep), np.nan, dtype = np.float64 )
+        for sweep in range( nsweep ):
+            try:
+                rays, gates, near = self._lookup( radar, sweep, x, y, 1 )
+            except (ValueError, IndexError):
+                continue
+            rays, gates, near = rays[:,0], gates[:,0], near[:,0]
+            ranges       = radar.get_range( sweep ) if hasattr(radar, 'get_range') else radar.range['data']
+            hgt[:,sweep] = np.where( near, alt + beam_height( ranges[gates], radar.get_elevation( sweep )[rays] ), np.nan )
+            ref[:,sweep] = np.where( near, self._gather( radar, sweep, 'reflectivity', rays, gates ), np.nan )
+            zdr[:,sweep] = np.where( near, self._gather( radar, sweep, 'differential_reflectivity', rays, gates ), np.nan )
+
+        out   = np.full( (x.size, 3), np.nan, dtype = np.float32 )
+        valid = np.isfinite( ref ).any( axis = 1 )
+        imax  = np.argmax( np.where( np.isfinite(ref), ref, -np.inf ), axis = 1 )
+        out[valid,0] = ref[valid, imax[valid]]
+        out[valid,1] = hgt[valid, imax[valid]]
+
+        order = np.argsort( np.where( np.isfinite(hgt), hgt, np.inf ), axis = 1 )   # Sweeps from lowest to highest beam
+        hgt   = np.take_along_axis( hgt, order, axis = 1 )
+        zdr   = np.take_along_axis( zdr, order, axis = 1 )
+        above = hgt > freezing_level[:,None]
+        inCol = np.cumprod( (zdr >= self.zdr_threshold) | ~above, axis = 1 ).astype(bool) & above   # Contiguous from freezing level up
+        top   = np.where( inCol, hgt, -np.inf ).max( axis = 1 )
+        depth = np.where( np.isfinite(top), top - freezing_level, 0.0 )
+        out[:,2] = np.where( np.isfinite(hgt).any( axis = 1 ), depth, np.nan )
+        return out
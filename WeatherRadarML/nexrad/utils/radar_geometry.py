@@ -0,0 +1,181 @@
+import numpy as np
+from functools import lru_cache
+
+from pyproj import CRS, Transformer
+from shapely.geometry import Polygon
+
+from .nexrad_station_info import nexrad_station_info
+from .polar_gate_lookup import beam_ground_range
+
+EARTH_RADIUS = 6370997.0                                                        # Sphere radius (m) used by Py-ART's pyart_aeqd projection
+_geographic  = CRS( '+proj=longlat +R={} +no_defs'.format(EARTH_RADIUS) )       # Geographic coordinates on the same sphere so no datum shift is applied
+
+###############################################################################
+@lru_cache(maxsize = 512)
+def site_transformer(lon_0, lat_0):
+    """
+    Name:
+        site_transformer
+    Purpose:
+        Function to get a pyproj Transformer between geographic coordinates
+        and the azimuthal equidistant (x/y) plane of a radar site. The
+        projection matches Py-ART's pyart_aeqd projection. Transformers are
+        cached, so each site is only set up once per process.
+    Inputs:
+        lon_0 : Longitude of the radar site
+        lat_0 : Latitude of the radar site
+    Keywords:
+        None.
+    Outputs:
+        Returns a pyproj.Transformer; forward direction is lon/lat to x/y
+    """
+    aeqd = CRS( '+proj=aeqd +lon_0={} +lat_0={} +R={} +units=m +no_defs'.format(
+                    float(lon_0), float(lat_0), EARTH_RADIUS) )
+    return Transformer.from_crs( _geographic, aeqd, always_xy = True )
+
+###############################################################################
+def geographic_to_cartesian(lon, lat, lon_0, lat_0):
+    """
+    Name:
+        geographic_to_cartesian
+    Purpose:
+        Function to convert longitude/latitude to x/y (meters) relative to a
+        radar site. Inputs can be scalars or arrays of any shape.
+    Inputs:
+        lon   : Longitude(s) of point(s)
+        lat   : Latitude(s) of point(s)
+        lon_0 : Longitude of the radar site
+        lat_0 : Latitude of the radar site
+    Keywords:
+        None.
+    Outputs:
+        Returns x and y arrays with the same shape as lon/lat
+    """
+    x, y = site_transformer( float(lon_0), float(lat_0) ).transform(
+                np.asarray(lon, dtype = np.float64), np.asarray(lat, dtype = np.float64) )
+    return np.asarray(x), np.asarray(y)
+
+###############################################################################
+def cartesian_to_geographic(x, y, lon_0, lat_0):
+    """
+    Name:
+        cartesian_to_geographic
+    Purpose:
+        Function to convert x/y (meters) relative to a radar site to
+        longitude/latitude. Inputs can be scalars or arrays of any shape.
+    Inputs:
+        x     : Easting(s) of point(s) relative to the radar site
+        y     : Northing(s) of point(s) relative to the radar site
+        lon_0 : Longitude of the radar site
+        lat_0 : Latitude of the radar site
+    Keywords:
+        None.
+    Outputs:
+        Returns longitude and latitude arrays with the same shape as x/y
+    """
+    lon, lat = site_transformer( float(lon_0), float(lat_0) ).transform(
+                np.asarray(x, dtype = np.float64), np.asarray(y, dtype = np.float64),
+                direction = 'INVERSE' )
+    return np.asarray(lon), np.asarray(lat)
+
+###############################################################################
+def antenna_to_geographic(ranges, azimuths, elevations, lon_0, lat_0):
+    """
+    Name:
+        antenna_to_geographic
+    Purpose:
+        Function to convert antenna coordinates to longitude/latitude using
+        the 4/3 earth radius beam model. Inputs are broadcast against each
+        other.
+    Inputs:
+        ranges     : Slant range(s) in meters
+        azimuths   : Azimuth angle(s) in degrees
+        elevations : Elevation angle(s) in degrees
+        lon_0      : Longitude of the radar site
+        lat_0      : Latitude of the radar site
+    Keywords:
+        None.
+    Outputs:
+        Returns longitude and latitude arrays
+    """
+    s   = beam_ground_range( np.asarray(ranges, dtype = np.float64), elevations )
+    az  = np.deg2rad( azimuths )
+    return cartesian_to_geographic( s * np.sin(az), s * np.cos(az), lon_0, lat_0 )
+
+###############################################################################
+@lru_cache(maxsize = 1)
+def station_table():
+    """
+    Name:
+        station_table
+    Purpose:
+        Function to return the NEXRAD station information with longitudes in
+        the -180 to 180 range. The file is only parsed once per process.
+    Inputs:
+        None.
+    Keywords:
+        None.
+    Outputs:
+        Dictionary as returned by nexrad_station_info; do NOT modify
+    """
+    return nexrad_station_info( convert_lon = False )
+
+###############################################################################
+def station_location(station):
+    """
+    Name:
+        station_location
+    Purpose:
+        Function to get (lon, lat, alt) of a NEXRAD station
+    Inputs:
+        station : Station ID; e.g., KHGX
+    Keywords:
+        None.
+    Outputs:
+        Returns tuple of lon, lat, and altitude
+    """
+    info  = station_table()
+    index = np.flatnonzero( info['statid'] == station )
+    if (index.size == 0):
+        raise Exception( 'Station: {} NOT found in list of NEXRAD stations!'.format(station) )
+    index = index[0]
+    return float(info['lon'][index]), float(info['lat'][index]), float(info['alt'][index])
+
+###############################################################################
+@lru_cache(maxsize = 1024)
+def radar_footprint(station, max_range = 300.0):
+    """
+    Name:
+        radar_footprint
+    Purpose:
+        Function to get the polygon of a station's coverage out to a given
+        range on a 0 degree elevation beam. Polygons are cached, so each
+        one is computed only once per process.
+    Inputs:
+        station   : Station ID; e.g., KHGX
+    Keywords:
+        max_range : Maximum (slant) range of the radar in kilometers
+    Outputs:
+        Returns shapely Polygon in lon/lat coordinates
+    """
+    lon_0, lat_0, _ = station_location( station )
+    lon, lat = antenna_to_geographic( max_range * 1.0e3, np.arange(360), 0.0, lon_0, lat_0 )
+    return Polygon( np.column_stack( [lon, lat] ) )
+
+###############################################################################
+@lru_cache(maxsize = 16)
+def footprint_bounds(max_range = 300.0):
+    """
+    Name:
+        footprint_bounds
+    Purpose:
+        Function to get the bounding boxes of all station footprints as
+        arrays so that points can be prefiltered with numpy
+    Inputs:
+        None.
+    Keywords:
+        max_range : Maximum (slant) range of the radar in kilometers
+    Outputs:
+        Returns [nstation, 4] array of (lonMin, latMin, lonMax, latMax)
+    """
+    return np.asarray( [radar_footprint(s, max_range).bounds for s in station_table()['statid']] )
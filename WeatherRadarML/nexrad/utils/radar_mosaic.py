@@ -0,0 +1,147 @@
+import logging
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from .nexrad_level2_reader import nexrad_level2_reader
+from .regrid_weights import GRID_EXTENT, sweep_geometry, canonical_sweep, grid_coordinates, volume_weights, apply_weights
+
+GRID_HEIGHTS = tuple( range(0, 10001, 1000) )                                   # Default edges (m above sea level) of grid levels
+
+###############################################################################
+def open_volume(path):
+    """
+    Name:
+        open_volume
+    Purpose:
+        Function to open a Level 2 volume; uses nexrad_level2_reader when
+        possible and falls back to Py-ART for other files
+    Inputs:
+        path : Path to Level 2 file
+    Keywords:
+        None.
+    Outputs:
+        Returns nexrad_level2_reader or pyart.core.Radar object
+    """
+    try:
+        return nexrad_level2_reader( path )
+    except ValueError:
+        import pyart
+        return pyart.io.read( path, delay_field_loading = True )
+
+###############################################################################
+def volume_to_grid(path, field = 'reflectivity', sweeps = None,
+        extent     = GRID_EXTENT,
+        resolution = 0.02,
+        heights    = GRID_HEIGHTS,
+        method     = 'average',
+        **kwargs):
+    """
+    Name:
+        volume_to_grid
+    Purpose:
+        Function to map one volume onto the grid cells it covers. The data
+        and a mask of valid gates are put through the gate-to-grid matrix in
+        one sparse matrix product, so a new volume costs no geometry.
+    Inputs:
+        path       : Path to Level 2 file
+    Keywords:
+        field      : Field name
+        sweeps     : Sweeps to use; default is all sweeps
+        extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution : Grid spacing in degrees
+        heights    : Edges (m above sea level) of grid levels
+        method     : Weighting; see regrid_weights.sweep_weights
+        All other keywords accepted by regrid_weights.sweep_weights; e.g.,
+        radius, cache_dir
+    Outputs:
+        Returns flat grid cell indices, and sum of weighted values and sum
+        of weights of valid gates in each cell
+    """
+    radar    = open_volume( path )
+    geometry = sweep_geometry( radar, sweeps )
+    W, cells = volume_weights( geometry, extent = tuple(extent), resolution = resolution,
+                               heights = tuple(heights), method = method, **kwargs )
+    vals     = np.concatenate( [canonical_sweep( radar, s[0], field, s[2] ).ravel() for s in geometry[-1]] )
+    num, den = apply_weights( W, vals )
+    return cells, num, den
+
+###############################################################################
+def _volume_to_grid(args):
+    """Private wrapper of volume_to_grid for Pool.imap_unordered; errors are logged, not raised"""
+    path, kwargs = args
+    try:
+        return path, volume_to_grid( path, **kwargs )
+    except Exception as err:
+        logging.getLogger(__name__).error( 'Failed to grid {}: {}'.format(path, err) )
+        return path, None
+
+###############################################################################
+def radar_mosaic(paths, field = 'reflectivity',
+        sweeps      = None,
+        extent      = GRID_EXTENT,
+        resolution  = 0.02,
+        heights     = GRID_HEIGHTS,
+        method      = 'average',
+        radius      = 2000.0,
+        cache_dir   = None,
+        concurrency = 4,
+        pool        = None):
+    """
+    Name:
+        radar_mosaic
+    Purpose:
+        Function to composite volumes from several stations onto a common
+        lat/lon/height grid. Each volume is gridded in a worker process and
+        the value in each grid cell is the weighted mean of the valid gates
+        from all stations that contribute to it.
+    Inputs:
+        paths       : List of paths to Level 2 files; typically one per
+                       station, e.g., the volumes closest to a given time
+    Keywords:
+        field       : Field name
+        sweeps      : Sweeps to use; default is all sweeps
+        extent      : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution  : Grid spacing in degrees
+        heights     : Edges (m above sea level) of grid levels
+        method      : Weighting; see regrid_weights.sweep_weights. Default
+                       is the mean of all gates that fall in a cell
+        radius      : Radius of influence (m) for distance weighting
+        cache_dir   : Directory to store gate-to-grid weights in; all
+                       worker processes share them memory-mapped
+        concurrency : Number of processes to use if pool is not given
+        pool        : multiprocessing.Pool to use. Gate-to-grid weights are
+                       also cached in the worker processes, so reusing a
+                       pool across calls avoids loading them again
+    Outputs:
+        Returns [nlevel, nlat, nlon] float32 array (NaN where no data),
+        and longitude, latitude, and height of cell centers
+    """
+    log           = logging.getLogger(__name__)
+    t0            = time.time()
+    lon, lat, hgt = grid_coordinates( extent, resolution, heights )
+    num           = np.zeros( hgt.size * lat.size * lon.size, dtype = np.float32 )
+    den           = np.zeros( num.size, dtype = np.float32 )
+    kwargs        = {'field' : field, 'sweeps' : sweeps, 'extent' : tuple(extent),
+                     'resolution' : resolution, 'heights' : tuple(heights),
+                     'method' : method, 'radius' : radius, 'cache_dir' : cache_dir}
+    tasks         = [(path, kwargs,) for path in paths]
+
+    close = pool is None
+    if close: pool = Pool( concurrency )
+    try:
+        for path, res in pool.imap_unordered( _volume_to_grid, tasks ):
+            if res is None: continue
+            cells, n, d = res
+            num[cells] += n                                                     # Cells are unique within a volume
+            den[cells] += d
+    finally:
+        if close:
+            pool.close()
+            pool.join()
+
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        grid = np.where( den > 0, num / den, np.nan ).astype( np.float32 )
+    log.debug( 'Mosaic of {} volumes in {:0.1f} s'.format(len(paths), time.time()-t0) )
+    return grid.reshape( hgt.size, lat.size, lon.size ), lon, lat, hgt
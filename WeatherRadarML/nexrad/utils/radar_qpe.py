@@ -0,0 +1,394 @@
+import logging
+import time, warnings
+from multiprocessing import Pool
+
+import numpy as np
+
+from .polar_gate_lookup import polar_gate_lookup
+from .radar_geometry import geographic_to_cartesian
+from .radar_mosaic import open_volume
+from .regrid_weights import sweep_geometry, canonical_sweep, sweep_weights, apply_weights, grid_coordinates, GRID_EXTENT
+
+###############################################################################
+def rate_zr(reflectivity, a = 300.0, b = 1.4, min_dbz = 10.0, max_dbz = 53.0):
+    """
+    Name:
+        rate_zr
+    Purpose:
+        Function to compute rain rate from reflectivity; Z = a * R**b
+    Inputs:
+        reflectivity : Reflectivity (dBZ)
+    Keywords:
+        a, b         : Coefficients of the Z-R relation; default is the
+                        NEXRAD convective relation
+        min_dbz      : Rain rate is 0 below this reflectivity, so noise
+                        and clear air echoes do not add up to rain
+        max_dbz      : Reflectivity is capped at this value to limit the
+                        effect of hail
+    Outputs:
+        Returns rain rate (mm/h); NaN where reflectivity is missing
+    """
+    z = 10.0**( np.minimum(reflectivity, max_dbz) / 10.0 )
+    return np.where( reflectivity < min_dbz, 0.0, (z / a)**(1.0 / b) )
+
+###############################################################################
+def rate_z_zdr(reflectivity, differential_reflectivity, a = 0.0142, b = 0.770, c = -1.67, min_dbz = 10.0, max_dbz = 53.0):
+    """
+    Name:
+        rate_z_zdr
+    Purpose:
+        Function to compute rain rate from reflectivity and differential
+        reflectivity; R = a * Z**b * Zdr**c with Z and Zdr in linear units
+    Inputs:
+        reflectivity              : Reflectivity (dBZ)
+        differential_reflectivity : Differential reflectivity (dB)
+    Keywords:
+        a, b, c                   : Coefficients of the relation
+        min_dbz                   : Rain rate is 0 below this reflectivity
+        max_dbz                   : Reflectivity is capped at this value
+    Outputs:
+        Returns rain rate (mm/h); NaN where either field is missing
+    """
+    z   = 10.0**( np.minimum(reflectivity, max_dbz) / 10.0 )
+    zdr = 10.0**( differential_reflectivity / 10.0 )
+    return np.where( reflectivity < min_dbz, 0.0, a * z**b * zdr**c )
+
+###############################################################################
+def rate_kdp(kdp, a = 44.0, b = 0.822, min_kdp = 0.3):
+    """
+    Name:
+        rate_kdp
+    Purpose:
+        Function to compute rain rate from specific differential phase;
+        R = a * Kdp**b
+    Inputs:
+        kdp     : Specific differential phase (deg/km)
+    Keywords:
+        a, b    : Coefficients of the relation
+        min_kdp : Rain rate is 0 below this Kdp (deg/km). Kdp estimated
+                   from noisy differential phase scatters around 0 and is
+                   often negative in light rain, so small and negative
+                   values are not rain
+    Outputs:
+        Returns rain rate (mm/h); never negative, NaN where Kdp is missing
+    """
+    return np.where( kdp < min_kdp, 0.0, a * np.abs(kdp)**b )
+
+###############################################################################
+def kdp_from_phidp(phidp, gate_spacing, window = 9):
+    """
+    Name:
+        kdp_from_phidp
+    Purpose:
+        Function to estimate specific differential phase as half the range
+        derivative of differential phase. The derivative is the least
+        squares slope over a sliding window of gates, computed for all rays
+        and gates at once from cumulative sums; missing gates are skipped.
+    Inputs:
+        phidp        : [nrays, ngates] differential phase (deg); masked or
+                        NaN where missing
+        gate_spacing : Gate spacing (m)
+    Keywords:
+        window       : Number of gates in window; should be odd
+    Outputs:
+        Returns [nrays, ngates] Kdp (deg/km); NaN where fewer than half of
+        the gates in the window are valid
+    """
+    phi   = np.ma.filled( np.ma.asarray(phidp, dtype = np.float64), np.nan )
+    valid = np.isfinite( phi )
+    x     = np.arange( phi.shape[-1], dtype = np.float64 ) * gate_spacing / 1.0e3   # Range (km)
+    half  = window // 2
+
+    def wsum(a):                                                                # Sum over centered window; zero padded at ends of ray
+        c = np.cumsum( np.pad( a, [(0, 0), (half+1, half)] ), axis = 1 )
+        return c[:, window:] - c[:, :-window]
+
+    n     = wsum( valid.astype(np.float64) )
+    sx    = wsum( np.where(valid, x, 0.0) )
+    sy    = wsum( np.where(valid, phi, 0.0) )
+    sxx   = wsum( np.where(valid, x * x, 0.0) )
+    sxy   = wsum( np.where(valid, x * phi, 0.0) )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    return np.where( n >= max(window // 2, 2), 0.5 * slope, np.nan ).astype( np.float32 )
+
+###############################################################################
+RELATIONS = {
+    'zr'    : (rate_zr,    ('reflectivity',)),
+    'z_zdr' : (rate_z_zdr, ('reflectivity', 'differential_reflectivity',)),
+    'kdp'   : (rate_kdp,   ('kdp',)),
+}                                                                               # Rain rate relations; function and fields it takes, in order
+
+def model_relation(model, fields = ('reflectivity', 'differential_reflectivity',)):
+    """
+    Name:
+        model_relation
+    Purpose:
+        Function to use a fitted model (e.g., scikit-learn regressor) as a
+        rain rate relation. The model is given one row per gate with one
+        column per field and must return rain rate (mm/h).
+    Inputs:
+        model  : Object with a predict() method
+    Keywords:
+        fields : Fields passed to the model, in column order
+    Outputs:
+        Returns relation that can be passed to rain_rate
+    """
+    def relation(*values):
+        shape = np.shape( values[0] )
+        X     = np.column_stack( [np.ravel(v) for v in values] )
+        rate  = np.full( X.shape[0], np.nan, dtype = np.float32 )
+        ok    = np.isfinite( X ).all( axis = 1 )                                # Model only sees complete rows
+        if ok.any(): rate[ok] = model.predict( X[ok] )
+        return rate.reshape( shape )
+    return (relation, tuple(fields),)
+
+###############################################################################
+def _relation(relation):
+    """Return (function, fields) for a relation name or (function, fields) tuple"""
+    if isinstance(relation, str):
+        if relation not in RELATIONS:
+            raise Exception( 'Unknown relation: {}; must be one of {}'.format(relation, list(RELATIONS)) )
+        return RELATIONS[relation]
+    return relation
+
+###############################################################################
+def rain_rate(radar, sweep = 0, relation = 'zr', **kwargs):
+    """
+    Name:
+        rain_rate
+    Purpose:
+        Function to compute rain rate for every gate of a sweep
+    Inputs:
+        radar    : nexrad_level2_reader or pyart.core.Radar object
+    Keywords:
+        sweep    : Sweep number (zero based)
+        relation : Name of relation in RELATIONS, or (function, fields)
+                    tuple; e.g., from model_relation. The function is
+                    called with the field arrays in order
+        All other keywords are passed to the relation function
+    Outputs:
+        Returns [nrays, ngates] float32 rain rate (mm/h); NaN where missing
+    """
+    func, fields = _relation( relation )
+    values       = []
+    for field in fields:
+        if (field == 'kdp'):
+            ranges = radar.get_range( sweep ) if hasattr(radar, 'get_range') else radar.range['data']
+            values.append( kdp_from_phidp( radar.get_field( sweep, 'differential_phase' ), float(ranges[1] - ranges[0]) ) )
+        else:
+            values.append( np.ma.filled( radar.get_field( sweep, field ).astype(np.float32), np.nan ) )
+    with np.errstate( invalid = 'ignore', over = 'ignore' ):
+        return np.asarray( func( *values, **kwargs ), dtype = np.float32 )
+
+###############################################################################
+def cumulative_rain(times, rates, max_gap = np.timedelta64(20, 'm')):
+    """
+    Name:
+        cumulative_rain
+    Purpose:
+        Function to integrate rain rates over time with the trapezoidal rule
+        between consecutive volumes. If one end of an interval is missing,
+        the other is used for the whole interval.
+    Inputs:
+        times   : datetime64 time of each volume; must be sorted
+        rates   : [nvolume, ...] rain rates (mm/h)
+    Keywords:
+        max_gap : Intervals longer than this are assumed to have no data
+                   and add no rain
+    Outputs:
+        Returns [nvolume, ...] rain (mm) accumulated since the first volume
+    """
+    rates = np.asarray( rates, dtype = np.float64 )
+    if (rates.shape[0] < 2):
+        return np.zeros( rates.shape )
+    hours = _interval_hours( times, max_gap ).reshape( (-1,) + (1,) * (rates.ndim-1) )
+    cum   = np.cumsum( _trapezoid( rates[:-1], rates[1:], hours ), axis = 0 )
+    return np.concatenate( [np.zeros( (1,) + rates.shape[1:] ), cum], axis = 0 )
+
+def _interval_hours(times, max_gap):
+    """Length (hours) of intervals between times; zero for intervals longer than max_gap"""
+    dt = np.diff( np.asarray(times) )
+    return np.where( dt <= max_gap, dt / np.timedelta64(1, 's') / 3600.0, 0.0 )
+
+def _trapezoid(a, b, hours):
+    """Rain (mm) over interval(s) from rates a and b at the ends; a missing end is replaced by the other"""
+    mean = np.where( np.isfinite(a) & np.isfinite(b), 0.5 * (a + b),
+           np.where( np.isfinite(a), a, np.where( np.isfinite(b), b, 0.0 ) ) )
+    return mean * hours
+
+###############################################################################
+def window_rain(times, cumulative, start, end, column = None):
+    """
+    Name:
+        window_rain
+    Purpose:
+        Function to get rain accumulated between arbitrary times (e.g., the
+        hour before each ASOS report) from cumulative_rain output. The
+        cumulative rain is interpolated linearly in time at the window
+        ends, for all windows at once.
+    Inputs:
+        times      : datetime64 time of each volume
+        cumulative : [nvolume, npoint] output of cumulative_rain
+        start      : datetime64 start of each window
+        end        : datetime64 end of each window
+    Keywords:
+        column     : Point (column of cumulative) for each window; default
+                      is every point for every window
+    Outputs:
+        Returns rain (mm) in each window; [nwindow] if column is given, else
+        [nwindow, npoint]. NaN where a window is not inside the volume times
+    """
+    t   = (np.asarray(times) - times[0]) / np.timedelta64(1, 's')
+    cum = np.asarray( cumulative ).reshape( len(t), -1 )
+
+    def at(when):
+        s    = (np.asarray(when) - times[0]) / np.timedelta64(1, 's')
+        i    = np.clip( np.searchsorted( t, s, side = 'right' ) - 1, 0, max(len(t)-2, 0) )
+        j    = np.minimum( i + 1, len(t) - 1 )
+        with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+            w = np.where( t[j] > t[i], (s - t[i]) / (t[j] - t[i]), 0.0 )
+        ok   = (s >= t[0]) & (s <= t[-1])
+        if column is None:
+            val = cum[i] * (1.0 - w[:,None]) + cum[j] * w[:,None]
+            return np.where( ok[:,None], val, np.nan )
+        val = cum[i, column] * (1.0 - w) + cum[j, column] * w
+        return np.where( ok, val, np.nan )
+
+    return at( end ) - at( start )
+
+###############################################################################
+def _point_rates(args):
+    """Private worker; rain rate at points for one volume"""
+    path, lon, lat, sweep, relation, k, max_dist = args
+    try:
+        radar  = open_volume( path )
+        rate   = rain_rate( radar, sweep, relation )
+        x, y   = geographic_to_cartesian( lon, lat, radar.longitude['data'][0], radar.latitude['data'][0] )
+        ranges = radar.get_range( sweep ) if hasattr(radar, 'get_range') else radar.range['data']
+        dist, rays, gates = polar_gate_lookup( x, y, radar.get_azimuth(sweep), radar.get_elevation(sweep), ranges, k = k )
+        vals   = np.where( dist <= max_dist * 1.0e3, rate[rays, gates], np.nan )
+        with warnings.catch_warnings():                                         # Points with no valid gates are NaN
+            warnings.simplefilter( 'ignore', category = RuntimeWarning )
+            return path, np.nanmean( vals, axis = 1 )
+    except Exception as err:
+        logging.getLogger(__name__).error( 'Failed to compute rain rate for {}: {}'.format(path, err) )
+        return path, None
+
+def _grid_rates(args):
+    """Private worker; rain rate on grid cells covered by one volume"""
+    path, sweep, relation, kwargs = args
+    try:
+        radar    = open_volume( path )
+        geometry = sweep_geometry( radar, [sweep] )
+        W, cells = sweep_weights( geometry, sweep, **kwargs )
+        rate     = canonical_sweep( radar, sweep, rain_rate( radar, sweep, relation ), geometry[-1][0][2] )
+        return path, apply_weights( W, rate ) + (cells,)
+    except Exception as err:
+        logging.getLogger(__name__).error( 'Failed to compute rain rate for {}: {}'.format(path, err) )
+        return path, None
+
+###############################################################################
+def qpe_points(paths, times, lon, lat,
+        sweep       = 0,
+        relation    = 'zr',
+        k           = 1,
+        max_dist    = 1.0,
+        max_gap     = np.timedelta64(20, 'm'),
+        concurrency = 4):
+    """
+    Name:
+        qpe_points
+    Purpose:
+        Function to compute rain rate time series and cumulative rain at
+        points (e.g., ASOS stations) from a sequence of volumes of one
+        station. Volumes are processed in parallel and only the sweep used
+        is decoded from each file.
+    Inputs:
+        paths       : Paths to Level 2 files
+        times       : datetime64 time of each file; e.g., from
+                       nexrad_level2_files
+        lon         : Longitude(s) of point(s)
+        lat         : Latitude(s) of point(s)
+    Keywords:
+        sweep       : Sweep to use
+        relation    : Rain rate relation; see rain_rate
+        k           : Number of gates averaged at each point
+        max_dist    : Maximum distance (km) of gates from point
+        max_gap     : Intervals longer than this add no rain
+        concurrency : Number of processes
+    Outputs:
+        Returns sorted volume times, [nvolume, npoint] rain rate (mm/h), and
+        [nvolume, npoint] cumulative rain (mm); see window_rain
+    """
+    log   = logging.getLogger(__name__)
+    t0    = time.time()
+    lon   = np.atleast_1d( np.asarray(lon, dtype = np.float64) )
+    lat   = np.atleast_1d( np.asarray(lat, dtype = np.float64) )
+    order = np.argsort( times, kind = 'stable' )
+    times = np.asarray( times )[order]
+    paths = [paths[i] for i in order]
+    rates = np.full( (len(paths), lon.size), np.nan, dtype = np.float32 )
+    tasks = [(path, lon, lat, sweep, relation, k, max_dist,) for path in paths]
+    with Pool( concurrency ) as pool:
+        for i, (path, rate) in enumerate( pool.imap( _point_rates, tasks, chunksize = 4 ) ):
+            if rate is not None: rates[i] = rate
+    log.debug( 'Rain rates from {} volumes in {:0.1f} s'.format(len(paths), time.time()-t0) )
+    return times, rates, cumulative_rain( times, rates, max_gap )
+
+###############################################################################
+def qpe_grid(paths, times,
+        sweep       = 0,
+        relation    = 'zr',
+        extent      = GRID_EXTENT,
+        resolution  = 0.02,
+        max_gap     = np.timedelta64(20, 'm'),
+        concurrency = 4,
+        **kwargs):
+    """
+    Name:
+        qpe_grid
+    Purpose:
+        Function to accumulate rain on a lat/lon grid from a sequence of
+        volumes of one station. Rates are regridded with weights from
+        regrid_weights, so geometry is only computed once per VCP, and
+        volumes are integrated in time order as they arrive so only two
+        grids are held in memory.
+    Inputs:
+        paths       : Paths to Level 2 files
+        times       : datetime64 time of each file
+    Keywords:
+        sweep       : Sweep to use
+        relation    : Rain rate relation; see rain_rate
+        extent      : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution  : Grid spacing in degrees
+        max_gap     : Intervals longer than this add no rain
+        concurrency : Number of processes
+        All other keywords accepted by regrid_weights.sweep_weights
+    Outputs:
+        Returns [nlat, nlon] rain (mm) accumulated over all volumes; NaN
+        where no volume had data
+    """
+    order  = np.argsort( times, kind = 'stable' )
+    times  = np.asarray( times )[order]
+    paths  = [paths[i] for i in order]
+    kwargs = dict( kwargs, extent = tuple(extent), resolution = resolution )
+    lon, lat, _ = grid_coordinates( extent, resolution )
+    total  = np.zeros( lat.size * lon.size, dtype = np.float64 )
+    seen   = np.zeros( total.size, dtype = bool )                               # Cells with data in any volume
+    prev   = None
+    hours  = np.append( _interval_hours( times, max_gap ), 0.0 )                # Hours to next volume
+    tasks  = [(path, sweep, relation, kwargs,) for path in paths]
+    with Pool( concurrency ) as pool:
+        for i, (path, res) in enumerate( pool.imap( _grid_rates, tasks, chunksize = 4 ) ):   # In time order; only two grids in memory
+            rate = np.full( total.size, np.nan, dtype = np.float32 )
+            if res is not None:
+                num, den, cells = res
+                with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+                    rate[cells] = np.where( den > 0, num / den, np.nan )
+            if prev is not None:
+                total += _trapezoid( prev, rate, hours[i-1] )
+            seen |= np.isfinite( rate )
+            prev  = rate
+    total[~seen] = np.nan
+    return total.reshape( lat.size, lon.size ).astype( np.float32 )
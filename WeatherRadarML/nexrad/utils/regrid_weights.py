@@ -0,0 +1,362 @@
+import logging
+import os, json, hashlib, shutil
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from .polar_gate_lookup import beam_ground_range, beam_height
+from .radar_geometry import cartesian_to_geographic, geographic_to_cartesian
+
+GRID_EXTENT = (-130, -60, 25, 50)                                               # Default grid limits; (lonMin, lonMax, latMin, latMax)
+METHODS     = ('average', 'nearest', 'cressman', 'barnes')
+
+###############################################################################
+def _n_azimuth(azimuth):
+    """Number of canonical azimuth bins; 0.5 degree for super resolution sweeps"""
+    spacing = np.median( np.diff( np.sort(azimuth) ) ) if (azimuth.size > 1) else 1.0
+    return 720 if (spacing < 0.75) else 360
+
+###############################################################################
+def sweep_geometry(radar, sweeps = None):
+    """
+    Name:
+        sweep_geometry
+    Purpose:
+        Function to get the canonical gate geometry of a volume. Gates are
+        placed on a fixed azimuth grid at the target (fixed) elevation
+        angle of each sweep, so every volume with the same station and
+        volume coverage pattern (VCP) has the same geometry and gate-to-grid
+        weights can be reused for all of them.
+    Inputs:
+        radar  : nexrad_level2_reader or pyart.core.Radar object
+    Keywords:
+        sweeps : Sweeps to include; default is all sweeps
+    Outputs:
+        Returns tuple that can be used as a dictionary key:
+            (station, vcp, lon, lat, alt, ((sweep, angle, nazimuth, first_gate, gate_spacing, ngates), ...))
+    """
+    if hasattr(radar, 'station'):                                               # nexrad_level2_reader
+        station = radar.station
+        vcp     = radar.vcp['pattern_number'] if radar.vcp else None
+    else:                                                                       # pyart.core.Radar
+        station = radar.metadata.get('instrument_name', '')
+        vcp     = radar.metadata.get('vcp_pattern', None)
+    if sweeps is None: sweeps = range( radar.nsweeps )
+
+    angles = radar.fixed_angle['data']
+    info   = []
+    for sweep in sweeps:
+        ranges = radar.get_range( sweep ) if hasattr(radar, 'get_range') else radar.range['data']
+        dr     = float(ranges[1] - ranges[0]) if (ranges.size > 1) else 250.0
+        info.append( (int(sweep), round( float(angles[sweep]), 2 ), _n_azimuth( radar.get_azimuth(sweep) ),
+                      float(ranges[0]), dr, int(ranges.size),) )
+    return (station, vcp, round( float(radar.longitude['data'][0]), 4 ), round( float(radar.latitude['data'][0]), 4 ),
+            round( float(radar.altitude['data'][0]), 1 ), tuple(info),)
+
+###############################################################################
+def canonical_sweep(radar, sweep, field, nazimuth):
+    """
+    Name:
+        canonical_sweep
+    Purpose:
+        Function to put the rays of a sweep into fixed azimuth bins. If
+        several rays fall in one bin, the ray nearest the bin center is
+        used.
+    Inputs:
+        radar    : nexrad_level2_reader or pyart.core.Radar object
+        sweep    : Sweep number (zero based)
+        field    : Field name, or [nrays, ngates] array of values for the
+                    rays of the sweep (e.g., a derived field)
+        nazimuth : Number of azimuth bins
+    Keywords:
+        None.
+    Outputs:
+        Returns [nazimuth, ngates] float32 array; NaN where masked or where
+        no ray falls in a bin
+    """
+    vals = radar.get_field( sweep, field ) if isinstance(field, str) else field
+    vals = np.ma.filled( vals.astype(np.float32), np.nan )
+    out  = np.full( (nazimuth, vals.shape[1]), np.nan, dtype = np.float32 )
+    pos  = (radar.get_azimuth( sweep ) % 360.0) * nazimuth / 360.0              # Azimuth in units of bins
+    bins = np.floor( pos ).astype(np.int64) % nazimuth
+    rays = np.lexsort( (np.abs( pos - np.floor(pos) - 0.5 ), bins) )            # Rays by bin, then distance from bin center
+    bins, first = np.unique( bins[rays], return_index = True )                  # Nearest ray in each bin
+    out[bins] = vals[ rays[first] ]
+    return out
+
+###############################################################################
+def grid_coordinates(extent = GRID_EXTENT, resolution = 0.02, heights = None):
+    """
+    Name:
+        grid_coordinates
+    Purpose:
+        Function to get the cell centers of a grid
+    Inputs:
+        None.
+    Keywords:
+        extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution : Grid spacing in degrees
+        heights    : Edges (m above sea level) of grid levels; None for a
+                      2D (lat/lon) grid
+    Outputs:
+        Returns longitude, latitude, and height cell centers (None if
+        heights is None)
+    """
+    nx  = int( round( (extent[1] - extent[0]) / resolution ) )
+    ny  = int( round( (extent[3] - extent[2]) / resolution ) )
+    lon = extent[0] + (np.arange(nx) + 0.5) * resolution
+    lat = extent[2] + (np.arange(ny) + 0.5) * resolution
+    hgt = None if heights is None else 0.5 * (np.asarray(heights[1:]) + np.asarray(heights[:-1]))
+    return lon, lat, hgt
+
+###############################################################################
+def _pairs(site, sweep, extent, resolution, method, radius, kappa):
+    """
+    Name:
+        _pairs
+    Purpose:
+        Private function to compute (grid cell, gate, weight) triplets for
+        one canonical sweep on a lat/lon grid
+    Inputs:
+        site       : (lon, lat, alt) of radar
+        sweep      : (angle, nazimuth, first_gate, gate_spacing, ngates)
+        extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution : Grid spacing in degrees
+        method     : One of METHODS
+        radius     : Radius of influence (m)
+        kappa      : Barnes smoothing parameter (m**2)
+    Keywords:
+        None.
+    Outputs:
+        Returns flat lat/lon cell index, gate index, and weight arrays
+    """
+    lon_0, lat_0, _ = site
+    angle, naz, r0, dr, ng = sweep
+    nx       = int( round( (extent[1] - extent[0]) / resolution ) )
+    ny       = int( round( (extent[3] - extent[2]) / resolution ) )
+    s        = beam_ground_range( r0 + dr * np.arange(ng), angle )              # Ground distance of gates
+    az       = np.deg2rad( (np.arange(naz) + 0.5) * 360.0 / naz )               # Bin centers
+    gx       = (np.sin(az)[:,None] * s).ravel()
+    gy       = (np.cos(az)[:,None] * s).ravel()
+    lon, lat = cartesian_to_geographic( gx, gy, lon_0, lat_0 )
+    ix       = np.floor( (lon - extent[0]) / resolution ).astype(np.int64)
+    iy       = np.floor( (lat - extent[2]) / resolution ).astype(np.int64)
+
+    if (method == 'average'):                                                   # Each gate goes to the cell it is in
+        ok = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        return (iy * nx + ix)[ok], np.flatnonzero(ok), np.ones( ok.sum(), dtype = np.float32 )
+
+    coslat   = max( np.cos( np.deg2rad( np.abs(lat).max() ) ), 0.1 )
+    pad      = int( np.ceil( radius / (111195.0 * coslat * resolution) ) ) + 1  # Cells within radius of the outermost gates
+    x0, x1   = max( ix.min() - pad, 0 ), min( ix.max() + pad + 1, nx )          # Only cells near the sweep
+    y0, y1   = max( iy.min() - pad, 0 ), min( iy.max() + pad + 1, ny )
+    if (x1 <= x0) or (y1 <= y0):
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.float32)
+    cx, cy   = np.meshgrid( np.arange(x0, x1), np.arange(y0, y1) )
+    cellLon  = extent[0] + (cx.ravel() + 0.5) * resolution
+    cellLat  = extent[2] + (cy.ravel() + 0.5) * resolution
+    cellX, cellY = geographic_to_cartesian( cellLon, cellLat, lon_0, lat_0 )
+    near     = np.hypot( cellX, cellY ) <= s[-1] + radius                       # Cells within range of sweep
+    cells    = (cy.ravel() * nx + cx.ravel())[near]
+    cellXY   = np.column_stack( [cellX[near], cellY[near]] )
+    gates    = cKDTree( np.column_stack( [gx, gy] ) )
+
+    if (method == 'nearest'):
+        dist, idx = gates.query( cellXY, distance_upper_bound = radius )
+        ok        = np.isfinite( dist )
+        return cells[ok], idx[ok], np.ones( ok.sum(), dtype = np.float32 )
+
+    pairs = cKDTree( cellXY ).sparse_distance_matrix( gates, radius, output_type = 'coo_matrix' )
+    d2    = pairs.data**2
+    if (method == 'cressman'):
+        w = (radius**2 - d2) / (radius**2 + d2)
+    else:                                                                       # Barnes
+        w = np.exp( -d2 / kappa )
+    return cells[pairs.row], pairs.col.astype(np.int64), w.astype(np.float32)
+
+###############################################################################
+def _cache_path(cache_dir, key):
+    """Private function to get directory that weights for key are stored in"""
+    return os.path.join( cache_dir, str(key[0]), hashlib.sha1( repr(key).encode() ).hexdigest() )
+
+###############################################################################
+@lru_cache(maxsize = 64)
+def sweep_weights(geometry, sweep,
+        extent     = GRID_EXTENT,
+        resolution = 0.02,
+        heights    = None,
+        method     = 'nearest',
+        radius     = 2000.0,
+        kappa      = None,
+        cache_dir  = None):
+    """
+    Name:
+        sweep_weights
+    Purpose:
+        Function to get the sparse matrix that regrids one canonical sweep
+        onto a lat/lon (or lat/lon/height) grid. Matrices are computed once
+        per (station, VCP, sweep, grid, method) and kept in memory. If
+        cache_dir is set, they are also written there as .npy files and
+        later loaded memory-mapped, so all worker processes share one
+        read-only copy through the page cache.
+    Inputs:
+        geometry   : Canonical geometry from sweep_geometry
+        sweep      : Sweep number; must be in geometry
+    Keywords:
+        extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution : Grid spacing in degrees
+        heights    : Edges (m above sea level) of grid levels; None for a
+                      2D (lat/lon) grid. Gates go to the level their beam
+                      height is in
+        method     : Weighting:
+                        average  : Mean of all gates in a cell
+                        nearest  : Gate nearest to cell center
+                        cressman : (R**2 - d**2) / (R**2 + d**2)
+                        barnes   : exp(-d**2 / kappa)
+                      Only gates within radius of the cell center are
+                      used by nearest, cressman, and barnes
+        radius     : Radius of influence (m)
+        kappa      : Barnes smoothing parameter (m**2); default is
+                      (radius/2)**2
+        cache_dir  : Directory to store weights in
+    Outputs:
+        Returns scipy.sparse.csr_matrix [ncells, ngates] of (unnormalized)
+        weights, and the flat index of each row in the [nlat, nlon] or
+        [nlevel, nlat, nlon] grid. See apply_weights
+    """
+    if method not in METHODS:
+        raise Exception( 'method must be one of {}'.format(METHODS) )
+    info = [s for s in geometry[-1] if s[0] == sweep]
+    if (len(info) == 0):
+        raise Exception( 'Sweep {} not in geometry'.format(sweep) )
+    if kappa is None: kappa = (radius / 2.0)**2
+    key  = geometry[:5] + (info[0][1:], tuple(extent), resolution, heights, method, radius, kappa,)   # Sweep number does not change the weights
+
+    if cache_dir is not None:
+        path = _cache_path( cache_dir, key )
+        if os.path.isdir( path ):
+            with open( os.path.join(path, 'shape.json'), 'r' ) as fid:
+                shape = tuple( json.load( fid ) )
+            arrays = [np.load( os.path.join(path, name + '.npy'), mmap_mode = 'r' )
+                        for name in ('data', 'indices', 'indptr', 'cells')]
+            return sparse.csr_matrix( tuple(arrays[:3]), shape = shape, copy = False ), arrays[3]
+
+    site = geometry[2], geometry[3], geometry[4]
+    cell, gate, w = _pairs( site, info[0][1:], extent, resolution, method, radius, kappa )
+    if heights is not None:                                                     # Add level of gate to cell index
+        angle, naz, r0, dr, ng = info[0][1:]
+        nxy   = int( round( (extent[1] - extent[0]) / resolution ) ) * int( round( (extent[3] - extent[2]) / resolution ) )
+        hgt   = site[2] + beam_height( r0 + dr * (gate % ng), angle )
+        iz    = np.searchsorted( np.asarray(heights, dtype = np.float64), hgt, side = 'right' ) - 1
+        ok    = (iz >= 0) & (iz < len(heights)-1)
+        cell, gate, w = iz[ok] * nxy + cell[ok], gate[ok], w[ok]
+
+    cells, rows = np.unique( cell, return_inverse = True )
+    weights     = sparse.csr_matrix( (w, (rows.ravel(), gate)), shape = (cells.size, info[0][2] * info[0][5]) )
+    weights.sort_indices()
+
+    if cache_dir is not None:                                                   # Write to temporary directory then rename so readers never see partial weights
+        tmp = path + '.tmp{}'.format( os.getpid() )
+        os.makedirs( tmp, exist_ok = True )
+        for name, arr in (('data', weights.data), ('indices', weights.indices),
+                          ('indptr', weights.indptr), ('cells', cells)):
+            np.save( os.path.join(tmp, name + '.npy'), arr )
+        with open( os.path.join(tmp, 'shape.json'), 'w' ) as fid:
+            json.dump( list(weights.shape), fid )
+        try:
+            os.rename( tmp, path )
+        except OSError:                                                         # Another process got there first
+            shutil.rmtree( tmp, ignore_errors = True )
+        logging.getLogger(__name__).debug( 'Saved regrid weights: {}'.format(path) )
+    return weights, cells
+
+###############################################################################
+@lru_cache(maxsize = 16)
+def volume_weights(geometry, **kwargs):
+    """
+    Name:
+        volume_weights
+    Purpose:
+        Function to combine the sweep_weights of all sweeps in a geometry
+        into one matrix, so a whole volume is regridded in one sparse
+        matrix product. Combined matrices are cached per process.
+    Inputs:
+        geometry : Canonical geometry from sweep_geometry
+    Keywords:
+        All keywords accepted by sweep_weights
+    Outputs:
+        Returns scipy.sparse.csr_matrix [ncells, ngates] where columns are
+        the gates of all canonical sweeps in order, and flat cell indices
+    """
+    mats, cells = [], []
+    for info in geometry[-1]:
+        W, c = sweep_weights( geometry, info[0], **kwargs )
+        mats.append( W.tocoo() )
+        cells.append( np.asarray(c) )
+    union   = np.unique( np.concatenate( cells ) )
+    rows, cols, data = [], [], []
+    offset  = 0
+    for W, c in zip( mats, cells ):
+        rows.append( np.searchsorted( union, c )[W.row] )                       # Remap rows to combined cells
+        cols.append( W.col + offset )
+        data.append( W.data )
+        offset += W.shape[1]
+    weights = sparse.csr_matrix( (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape = (union.size, offset) )
+    return weights, union
+
+###############################################################################
+def apply_weights(weights, values):
+    """
+    Name:
+        apply_weights
+    Purpose:
+        Function to apply regrid weights to gate values. Missing (NaN)
+        values are skipped and the weights of the remaining gates are
+        renormalized, all in one sparse matrix product.
+    Inputs:
+        weights : Sparse matrix from sweep_weights or volume_weights
+        values  : Gate values; flattened to weights.shape[1] values per
+                   field. Use [ngates, nfields] to regrid several fields
+                   at once
+    Keywords:
+        None.
+    Outputs:
+        Returns sum of weighted values and sum of weights for each cell;
+        the regridded field is their ratio. Returned separately so results
+        from several stations can be summed before dividing
+    """
+    values = np.asarray( values, dtype = np.float32 ).reshape( weights.shape[1], -1 )
+    valid  = np.isfinite( values )
+    both   = weights @ np.concatenate( [np.where(valid, values, 0.0), valid], axis = 1 ).astype(np.float32)
+    n      = values.shape[1]
+    return both[:,:n].squeeze(), both[:,n:].squeeze()
+
+###############################################################################
+def regrid_sweep(radar, sweep, field, extent = GRID_EXTENT, resolution = 0.02, **kwargs):
+    """
+    Name:
+        regrid_sweep
+    Purpose:
+        Function to regrid one sweep of a field onto a lat/lon grid
+    Inputs:
+        radar      : nexrad_level2_reader or pyart.core.Radar object
+        sweep      : Sweep number (zero based)
+        field      : Field name
+    Keywords:
+        extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+        resolution : Grid spacing in degrees
+        All other keywords accepted by sweep_weights
+    Outputs:
+        Returns [nlat, nlon] float32 array; NaN where there is no data
+    """
+    geometry    = sweep_geometry( radar, [sweep] )
+    W, cells    = sweep_weights( geometry, sweep, tuple(extent), resolution, **kwargs )
+    num, den    = apply_weights( W, canonical_sweep( radar, sweep, field, geometry[-1][0][2] ) )
+    lon, lat, _ = grid_coordinates( extent, resolution )
+    grid        = np.full( lat.size * lon.size, np.nan, dtype = np.float32 )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        grid[cells] = np.where( den > 0, num / den, np.nan )
+    return grid.reshape( lat.size, lon.size )
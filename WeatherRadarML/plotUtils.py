@@ -2,10 +2,16 @@ import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import numpy as np
+from matplotlib.colors import to_rgba
+from matplotlib.collections import PolyCollection
+
+from WeatherRadarML import vtec
+
 def baseMap( linewidth  = 0.5, 
              resolution = '50m', 
              extent     = (-130, -60, 25, 50),
-             projection = 'PlateCarree' ):
+             projection = 'PlateCarree',
+             figsize    = (20, 20) ):
     '''
     Purpose:
         Function to set up base map using cartopy for plotting data
@@ -16,10 +22,11 @@ def baseMap( linewidth  = 0.5,
         resolution : Sets resolution for coastlines, state boarders, etc.
         extent     : Sets map limit; (lonMin, lonMax, latMin, latMax)
         projection : Name of projection to use
+        figsize    : Size of figure (inches)
     Outputs:
         Returns a matplotlib axes object
     '''
-    plt.figure(figsize=(20, 20))
+    plt.figure(figsize=figsize)
     ax = plt.axes( projection= getattr(ccrs, projection)() )
     ax.set_extent( extent )
     ax.stock_img()
@@ -43,11 +50,140 @@ def plotStation( ax, name, coords, color = 'g' ):
     ax.scatter( *coords, color = color, zorder = 2 )
     ax.annotate( name, coords, zorder = 3 )
 
-def plotWarning( ax, record ):
+def plotWarning( ax, record, color = None ):
+    '''
+    Purpose:
+        Function to plot one warning record
+    Inputs:
+        ax     : Axis object to plot warning on
+        record : Record with GeoJSON-like Polygon geometry and IEM properties
+    Keywords:
+        color  : Color of warning; default is color of phenomenon
+    Outputs:
+        None.
+    '''
+    if color is None:
+        color = warningColors( [record['properties']['PHENOM']] )[0][0]
     xy = np.asarray( record['geometry']['coordinates'] ).squeeze()
     ax.plot( xy[:,0], xy[:,1], '-', color = color )
     ax.fill( xy[:,0], xy[:,1], color = color )
 
+def warningColors( phenom, alpha = 0.1 ):
+    '''
+    Purpose:
+        Function to get colors of warnings from vtec.PHENOM; purple if the
+        phenomenon has no color, as wwaVTEC.plot
+    Inputs:
+        phenom : 2 character VTEC phenomenon code of each warning
+    Keywords:
+        alpha  : Alpha of face colors
+    Outputs:
+        Returns [n, 4] RGBA arrays of edge and face colors
+    '''
+    phenom = np.asarray( phenom )
+    codes, inv = np.unique( phenom, return_inverse = True )
+    table = np.asarray( [to_rgba( vtec.PHENOM.get( code, {} ).get( 'color', None ) or 'purple' )
+                         for code in codes.tolist()] ).reshape( -1, 4 )
+    edge = table[ inv.ravel() ]
+    face = edge.copy()
+    face[:,-1] = alpha
+    return edge, face
+
+def _viewport( ax ):
+    '''Private function to get (lonMin, lonMax, latMin, latMax) shown by axes'''
+    if hasattr(ax, 'projection'):
+        return ax.get_extent( ccrs.PlateCarree() )
+    return (*ax.get_xlim(), *ax.get_ylim())
+
+def plotWarnings( ax, warnings, linewidth = 2, cull = True, **kwargs ):
+    '''
+    Purpose:
+        Function to plot many warnings as one PolyCollection, so drawing
+        costs one draw call rather than one per polygon. Identical
+        geometries are drawn once per color.
+    Inputs:
+        ax       : Axis object to plot warnings on
+        warnings : warningStore instance, or list of wwaVTEC objects or
+                    records (converted with warningStore.from_records)
+    Keywords:
+        linewidth : Width of warning outlines
+        cull      : Set to skip warnings entirely outside the axes limits
+                    when plotted
+        All other keywords are passed to PolyCollection; e.g.,
+        edgecolors, facecolors, zorder
+    Outputs:
+        Returns matplotlib.collections.PolyCollection
+    '''
+    from WeatherRadarML.warningStore import warningStore
+    store = warnings if isinstance(warnings, warningStore) else warningStore.from_records( warnings )
+
+    gid  = store['GEOM_ID']
+    keep = np.ones( gid.size, dtype = bool )
+    if cull and (gid.size > 0):
+        x0, x1, y0, y1 = _viewport( ax )
+        box  = store.bbox[gid]
+        keep = (box[:,0] <= x1) & (box[:,2] >= x0) & (box[:,1] <= y1) & (box[:,3] >= y0)
+    phen  = np.unique( store['PHENOM'], return_inverse = True )[1].ravel()
+    index = np.flatnonzero( keep )
+    _, first = np.unique( np.column_stack( [gid[index], phen[index]] ), axis = 0, return_index = True )
+    index = index[ np.sort( first ) ]                                           # One polygon per geometry and phenomenon
+
+    verts = []
+    owner = []                                                                  # Warning of each polygon
+    for i in index.tolist():
+        geom = store.geometry( gid[i] )
+        for poly in (geom.geoms if hasattr(geom, 'geoms') else [geom]):
+            verts.append( np.asarray( poly.exterior.coords ) )
+            owner.append( i )
+    edge, face = warningColors( store['PHENOM'][owner] )
+    kwargs.setdefault( 'edgecolors', edge )
+    kwargs.setdefault( 'facecolors', face )
+    if hasattr(ax, 'projection'):
+        kwargs.setdefault( 'transform', ccrs.PlateCarree() )
+    coll = PolyCollection( verts, linewidths = linewidth, **kwargs )
+    ax.add_collection( coll )
+    return coll
+
+def plotStations( ax, names, coords, color = 'g', labels = True, max_labels = 200 ):
+    '''
+    Purpose:
+        Function to plot many ASOS stations as one scatter. Labels are
+        only made for stations inside the axes limits, and are updated
+        when the limits change (e.g., zooming), so drawing time scales
+        with what is shown rather than the number of stations.
+    Inputs:
+        ax         : Axis object to plot stations on
+        names      : Names of the stations
+        coords     : [N, 2] coordinates of the stations
+    Keywords:
+        color      : Color(s) to use for station dots
+        labels     : Set to label stations with their names
+        max_labels : Maximum number of labels; if more stations are in view,
+                      none are labeled until zoomed in
+    Outputs:
+        Returns matplotlib.collections.PathCollection
+    '''
+    coords = np.asarray( coords, dtype = np.float64 ).reshape( -1, 2 )
+    kwargs = {'transform' : ccrs.PlateCarree()} if hasattr(ax, 'projection') else {}
+    dots   = ax.scatter( coords[:,0], coords[:,1], color = color, zorder = 2, **kwargs )
+    if not labels:
+        return dots
+
+    texts = []
+    def label( ax ):
+        for text in texts: text.remove()
+        texts.clear()
+        x0, x1, y0, y1 = _viewport( ax )
+        view = np.flatnonzero( (coords[:,0] >= x0) & (coords[:,0] <= x1) & (coords[:,1] >= y0) & (coords[:,1] <= y1) )
+        if (view.size > max_labels): return
+        for i in view.tolist():
+            texts.append( ax.annotate( names[i], coords[i], zorder = 3,
+                            xycoords = kwargs['transform']._as_mpl_transform( ax ) if kwargs else 'data' ) )
+    label( ax )
+    ax.callbacks.connect( 'xlim_changed', label )
+    ax.callbacks.connect( 'ylim_changed', label )
+    return dots
+
 if __name__ == "__main__":
     ax = baseMap()
     plt.show()
@@ -1,8 +1,7 @@
-from WeatherRadarML.nexrad.utils.nexrad_station_info import nexrad_station_info
+from WeatherRadarML.nexrad.utils.radar_geometry import station_location, radar_footprint
 from WeatherRadarML import plotUtils as utils
 import numpy as np
 import matplotlib.pyplot as plt
-from pyart.core import antenna_to_cartesian, cartesian_to_geographic
 
 def radar_range(station, kmrange=300.0):
     '''
@@ -16,23 +15,10 @@ def radar_range(station, kmrange=300.0):
     Outputs:
         Displays the plot to the user
     '''
-    # Get stations
-    nexradInfo = nexrad_station_info()
+    lon, lat, _ = station_location( station )                                   # Get station location; raises exception if NOT found
 
-    # Get specific station
-    lon = lat = None
-    for index in range(nexradInfo['statid'].size):
-        if nexradInfo['statid'][index] == station:
-            lon = nexradInfo['lon'][index]
-            lat = nexradInfo['lat'][index]
-
-    if not lon:                                                                 # If longitude is None
-        raise Exception('Station: {} NOT found in list of NEXRAD stations!'.format(station) )# Raise exception
-
-    # Create a circle
-    xx, yy, zz = antenna_to_cartesian(kmrange, np.arange(360), 0)
-    proj = {'proj' : 'pyart_aeqd', 'lon_0' : lon, 'lat_0' : lat}
-    xx, yy = cartesian_to_geographic(xx, yy, proj)
+    # Get cached polygon of radar range
+    xx, yy = radar_footprint( station, kmrange ).exterior.xy
 
     # Create the map
     ax = utils.baseMap()
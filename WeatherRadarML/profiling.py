@@ -0,0 +1,397 @@
+import logging
+from logging.handlers import QueueHandler
+import os, io, json, time, atexit, functools, threading, tracemalloc
+import cProfile, pstats
+
+PROFILE = logging.CRITICAL + 5                                                  # Log level of records carrying profile data; above CRITICAL so they are never filtered out
+logging.addLevelName( PROFILE, 'PROFILE' )
+
+_envVar   = 'WEATHERRADARML_PROFILE'                                            # Environment variable used to enable profiling in spawned processes
+_timers   = {}                                                                  # Timer statistics of this process; keyed by name
+_counters = {}                                                                  # Counter values of this process; keyed by name
+_open     = {}                                                                  # [start, peak] memory of open timers of all threads; see _sync_peak
+_lock     = threading.RLock()                                                   # Timers are used from threads (e.g., ThreadPool downloads); guards the above
+_state    = {'t0' : time.perf_counter(), 'profiler' : None, 'memory' : False, 'stats' : None}
+
+###############################################################################
+class timer( object ):
+    """
+    Name:
+        timer
+    Purpose:
+        Class to time a block of code, as a context manager or decorator.
+        Calls, total, min, and max wall time are kept under the timer's
+        name. If memory profiling is enabled, the peak traced memory above
+        the start of the block is kept as well. Timers may be used from
+        several threads at once; traced memory is per process, so the peak
+        of a block includes allocations of other threads running meanwhile.
+        May also be started and stopped explicitly when the block spans
+        methods.
+    Example:
+        with timer('read.level2') as t:
+            radar = pyart.io.read( path )
+        print( t.elapsed )
+
+        @timer('kdtree.build')
+        def build(x, y): ...
+    """
+    def __init__(self, name):
+        """
+        Inputs:
+            name : Name of the timer; e.g., stage.operation
+        """
+        self.name    = name
+        self.elapsed = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def start(self):
+        """Start timing; returns self"""
+        self._mem = None
+        if _state['memory'] and tracemalloc.is_tracing():
+            with _lock:
+                current   = _sync_peak()
+                self._mem = _open[id(self)] = [current, current]                # Start memory, and peak of block so far
+        self._t0 = time.perf_counter()
+        return self
+
+    def stop(self):
+        """Stop timing and add to statistics; returns elapsed time in seconds"""
+        self.elapsed = time.perf_counter() - self._t0
+        with _lock:
+            stat = _timers.get( self.name, None )
+            if stat is None:
+                stat = _timers[self.name] = {'calls' : 0, 'total' : 0.0, 'min' : float('inf'), 'max' : 0.0, 'peak' : 0}
+            stat['calls'] += 1
+            stat['total'] += self.elapsed
+            stat['min']    = min( stat['min'], self.elapsed )
+            stat['max']    = max( stat['max'], self.elapsed )
+            if getattr(self, '_mem', None) is not None:
+                if tracemalloc.is_tracing(): _sync_peak()
+                start, peak  = _open.pop( id(self), self._mem )
+                stat['peak'] = max( stat['peak'], peak - start )
+                self._mem    = None
+        return self.elapsed
+
+    def __call__(self, func):
+        @functools.wraps( func )
+        def wrapper(*args, **kwargs):
+            with timer( self.name ):
+                return func( *args, **kwargs )
+        return wrapper
+
+def _sync_peak():
+    """Private function to add the traced peak since the last reset to all open timers and reset it; call with _lock held. Returns current traced memory"""
+    current, peak = tracemalloc.get_traced_memory()
+    for mem in _open.values():
+        mem[1] = max( mem[1], peak )
+    tracemalloc.reset_peak()
+    return current
+
+###############################################################################
+def count(name, n = 1):
+    """
+    Name:
+        count
+    Purpose:
+        Function to increment a counter; e.g., number of bytes read
+    Inputs:
+        name : Name of counter
+    Keywords:
+        n    : Amount to increment by
+    Outputs:
+        None.
+    """
+    with _lock:
+        _counters[name] = _counters.get( name, 0 ) + n
+
+###############################################################################
+def enable(cprofile = False, memory = False, outfile = None):
+    """
+    Name:
+        enable
+    Purpose:
+        Function to turn on optional profiling in this process and in
+        processes started from it. Timers and counters are always on;
+        this adds cProfile and/or tracemalloc capture, and can write a
+        report when the program exits.
+    Inputs:
+        None.
+    Keywords:
+        cprofile : Set to run cProfile; function statistics are added to
+                    the report
+        memory   : Set to trace memory allocations with tracemalloc; peak
+                    memory of each timer is added to the report
+        outfile  : Path to write report to at exit; JSON if the path ends
+                    in .json, else text
+    Outputs:
+        None.
+    """
+    os.environ[_envVar] = ','.join( [k for k, v in (('cprofile', cprofile), ('memory', memory)) if v] ) or 'on'
+    if cprofile and (_state['profiler'] is None):
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+    if memory:
+        _state['memory'] = True
+        if not tracemalloc.is_tracing(): tracemalloc.start()
+    if outfile is not None:
+        atexit.register( write_report, outfile )
+
+def disable():
+    """Turn off cProfile and tracemalloc capture; statistics are kept"""
+    os.environ.pop( _envVar, None )
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+        _add_stats( _profile_stats() )
+        _state['profiler'] = None
+    if _state['memory']:
+        _state['memory'] = False
+        tracemalloc.stop()
+
+def reset():
+    """Clear all timers, counters, and function statistics of this process"""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+    _state['stats'] = None
+    _state['t0']    = time.perf_counter()
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+
+###############################################################################
+def _profile_stats():
+    """Private function to get raw cProfile statistics (picklable dict) of the running profiler"""
+    prof = _state['profiler']
+    if prof is None: return None
+    prof.disable()
+    prof.create_stats()
+    stats = dict( prof.stats )
+    prof.enable()
+    return stats
+
+class _rawStats( object ):
+    """Private shim so pstats.Stats can load a raw statistics dict"""
+    def __init__(self, stats):
+        self.stats = stats
+    def create_stats(self):
+        pass
+
+def _add_stats(stats):
+    """Private function to add raw cProfile statistics to those of this process"""
+    if not stats: return
+    if _state['stats'] is None:
+        _state['stats'] = pstats.Stats( _rawStats( stats ) )
+    else:
+        _state['stats'].add( _rawStats( stats ) )
+
+###############################################################################
+def snapshot():
+    """
+    Name:
+        snapshot
+    Purpose:
+        Function to get the timers, counters, and cProfile statistics of
+        this process as a picklable dictionary
+    Inputs:
+        None.
+    Keywords:
+        None.
+    Outputs:
+        Returns dictionary with timers, counters, stats, and pid keys
+    """
+    with _lock:
+        timers   = {k : dict(v) for k, v in _timers.items()}
+        counters = dict(_counters)
+    return {'timers'   : timers,
+            'counters' : counters,
+            'stats'    : _profile_stats(),
+            'pid'      : os.getpid()}
+
+def merge(snap):
+    """
+    Name:
+        merge
+    Purpose:
+        Function to add a snapshot from another process to the statistics
+        of this process
+    Inputs:
+        snap : Output of snapshot
+    Keywords:
+        None.
+    Outputs:
+        None.
+    """
+    with _lock:                                                                 # Called from the log handler thread
+        for name, other in snap['timers'].items():
+            stat = _timers.get( name, None )
+            if stat is None:
+                _timers[name] = dict(other)
+                continue
+            stat['calls'] += other['calls']
+            stat['total'] += other['total']
+            stat['min']    = min( stat['min'],  other['min'] )
+            stat['max']    = max( stat['max'],  other['max'] )
+            stat['peak']   = max( stat['peak'], other['peak'] )
+        for name, n in snap['counters'].items():
+            count( name, n )
+    _add_stats( snap.get('stats', None) )
+
+def publish(log):
+    """
+    Name:
+        publish
+    Purpose:
+        Function to send the statistics of this (worker) process to the
+        main process through the QueueHandler(s) of a logger, then clear
+        them so they are not sent twice. mpLogHandler merges them into the
+        statistics of the main process. The record only goes to queue
+        handlers, so nothing is printed by other handlers, and nothing is
+        done if the logger has no queue handler (i.e., in the main process).
+    Inputs:
+        log : logging.Logger with QueueHandler to main process
+    Keywords:
+        None.
+    Outputs:
+        None.
+    """
+    handlers = []
+    while log is not None:
+        handlers += [h for h in log.handlers if isinstance(h, QueueHandler)]
+        log       = log.parent if log.propagate else None
+    if not handlers: return
+    if not _timers and not _counters and (_state['profiler'] is None): return
+    record = logging.makeLogRecord( {'name' : __name__, 'levelno' : PROFILE, 'levelname' : 'PROFILE',
+                                     'msg' : 'profile', 'profile' : snapshot()} )
+    handlers[0].handle( record )
+    reset()
+
+###############################################################################
+def mpLogHandler( queue ):
+    """
+    Name:
+        mpLogHandler
+    Purpose:
+        Function (run in a thread of the main process) that consumes log
+        records sent by worker processes through a QueueHandler and hands
+        them to the logger they were emitted from. Records carrying
+        profile data (see publish) are merged instead of logged.
+    Inputs:
+        queue : multiprocessing.Queue; put None in it to stop
+    Keywords:
+        None.
+    Outputs:
+        None.
+    """
+    while True:
+        record = queue.get()
+        if record is None:
+            break
+        if hasattr(record, 'profile'):
+            merge( record.profile )
+            continue
+        logger = logging.getLogger( record.name )
+        if logger.isEnabledFor( record.levelno ):
+            logger.handle( record )
+
+###############################################################################
+def report(top = 20):
+    """
+    Name:
+        report
+    Purpose:
+        Function to summarize where wall time and memory went; timers
+        sorted by total time, counters, and the top functions by
+        cumulative time if cProfile is enabled
+    Inputs:
+        None.
+    Keywords:
+        top : Number of functions to list from cProfile
+    Outputs:
+        Returns dictionary with wall, timers, counters, and functions keys
+    """
+    functions = None
+    stats     = [s for s in (_state['stats'], _profile_stats(),) if s]          # Merged statistics of workers and running profiler of this process
+    if stats:
+        buf   = io.StringIO()
+        stats = [s if isinstance(s, pstats.Stats) else _rawStats(s) for s in stats]
+        pstats.Stats( stream = buf ).add( *stats ).sort_stats( 'cumulative' ).print_stats( top )
+        functions = buf.getvalue()
+    with _lock:
+        timers   = sorted( ((k, dict(v)) for k, v in _timers.items()), key = lambda x: x[1]['total'], reverse = True )
+        counters = dict(_counters)
+    return {'wall'      : time.perf_counter() - _state['t0'],
+            'timers'    : [dict(v, name = k, mean = v['total'] / v['calls']) for k, v in timers],
+            'counters'  : counters,
+            'functions' : functions}
+
+def format_report(rep = None):
+    """
+    Name:
+        format_report
+    Purpose:
+        Function to format a report as text
+    Inputs:
+        None.
+    Keywords:
+        rep : Output of report; default is a new report
+    Outputs:
+        Returns string
+    """
+    rep   = report() if rep is None else rep
+    lines = ['Wall time: {:0.2f} s'.format(rep['wall']),
+             '{:40}{:>8}{:>12}{:>10}{:>10}{:>8}{:>10}'.format('Timer', 'Calls', 'Total (s)', 'Mean (s)', 'Max (s)', '% wall', 'Peak MB')]
+    for t in rep['timers']:
+        lines.append( '{:40}{:8d}{:12.3f}{:10.4f}{:10.4f}{:8.1f}{:10.1f}'.format(
+            t['name'], t['calls'], t['total'], t['mean'], t['max'],
+            100.0 * t['total'] / rep['wall'] if rep['wall'] > 0 else 0.0, t['peak'] / 1.0e6) )
+    if rep['counters']:
+        lines.append( '{:40}{:>20}'.format('Counter', 'Value') )
+        for name, n in sorted( rep['counters'].items() ):
+            lines.append( '{:40}{:>20}'.format(name, n) )
+    if rep['functions']:
+        lines += ['', rep['functions']]
+    return '\n'.join( lines )
+
+def write_report(outfile):
+    """
+    Name:
+        write_report
+    Purpose:
+        Function to write a report to file; JSON if the path ends in .json,
+        else text
+    Inputs:
+        outfile : Path to write report to
+    Keywords:
+        None.
+    Outputs:
+        None.
+    """
+    rep     = report()
+    dirname = os.path.dirname( outfile )
+    if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+    with open( outfile, 'w' ) as fid:
+        if outfile.endswith('.json'):
+            json.dump( rep, fid, indent = 2 )
+        else:
+            fid.write( format_report( rep ) + '\n' )
+
+def _after_fork():
+    """Private function; forked processes start with empty statistics so those of the parent are not published twice"""
+    global _lock
+    _lock = threading.RLock()                                                   # May have been held by another thread of the parent
+    _open.clear()
+    reset()
+
+os.register_at_fork( after_in_child = _after_fork )
+
+###############################################################################
+_flags = os.environ.get( _envVar, None )                                        # Enable profiling in processes started by a profiled process
+if _flags:
+    enable( cprofile = 'cprofile' in _flags, memory = 'memory' in _flags )
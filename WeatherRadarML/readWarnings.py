@@ -1,51 +1,240 @@
+import logging
+import os
 from fiona.io import ZipMemoryFile
 from zipfile import ZipFile
 from WeatherRadarML.wwaVTEC import wwaVTEC
 from datetime import datetime
 import pickle
 
-def read_warnings(zipfile, start_date = None, end_date = None):
-    if zipfile.endswith('.pic'):
-        with open(zipfile, 'rb') as f:
-            records = pickle.load(f)
-        records = [wwaVTEC(r) for r in records]
-        return records
+from shapely.geometry import shape, mapping, MultiPolygon
+from shapely.validation import make_valid
+
+_cacheVersion = 1                                                               # Increment when the format of cleaned records changes
+
+###############################################################################
+def _polygons(geometry):
+    """Private function to get the polygons of a geometry; make_valid may return lines/points along with polygons"""
+    if geometry.is_empty:
+        return []
+    if (geometry.geom_type == 'Polygon'):
+        return [geometry]
+    if geometry.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        return [poly for geom in geometry.geoms for poly in _polygons( geom )]
+    return []
+
+def _nverts(geometry):
+    """Private function to count vertices of a GeoJSON-like (Multi)Polygon geometry"""
+    coords = geometry['coordinates']
+    if (geometry['type'] == 'Polygon'): coords = [coords]
+    return sum( len(ring) for poly in coords for ring in poly )
+
+def clean_geometry(geometry, repair = True, tolerance = None):
+    """
+    Name:
+        clean_geometry
+    Purpose:
+        Function to validate, repair, and optionally simplify a warning
+        geometry
+    Inputs:
+        geometry  : GeoJSON-like geometry (e.g., record['geometry']) or
+                     shapely geometry
+    Keywords:
+        repair    : Set to repair invalid geometries with make_valid;
+                     only the polygonal parts are kept
+        tolerance : If set, simplify the geometry, keeping it valid, so that
+                     no point moves more than tolerance (degrees)
+    Outputs:
+        Returns shapely MultiPolygon, or None if nothing is left
+    """
+    try:
+        geom = geometry if hasattr(geometry, 'geom_type') else shape( geometry )
+    except Exception:                                                           # Too few points, etc.
+        return None
+    if repair and not geom.is_valid:
+        geom = make_valid( geom )
+    if tolerance:
+        geom = geom.simplify( tolerance, preserve_topology = True )
+    polys = _polygons( geom )
+    return MultiPolygon( polys ) if polys else None
+
+def clean_record(record, repair = True, tolerance = None):
+    """
+    Name:
+        clean_record
+    Purpose:
+        Function to run the ingest stage on a record from an IEM shapefile.
+        The geometry is cleaned once (see clean_geometry), so later
+        predicates run on smaller, valid shapes, and the number of
+        vertices before and after cleaning are added to the properties as
+        NVERTS_RAW and NVERTS.
+    Inputs:
+        record    : Record from an IEM shapefile
+    Keywords:
+        repair    : See clean_geometry
+        tolerance : See clean_geometry
+    Outputs:
+        Returns new record as plain dictionaries, or None if the geometry
+        is empty or can not be repaired
+    """
+    geom = clean_geometry( record['geometry'], repair = repair, tolerance = tolerance )
+    if geom is None:
+        return None
+    geometry   = mapping( geom )
+    properties = dict( record['properties'] )
+    properties['NVERTS_RAW'] = _nverts( record['geometry'] )
+    properties['NVERTS']     = _nverts( geometry )
+    return {'type' : 'Feature', 'id' : record.get('id', None), 'properties' : properties, 'geometry' : geometry}
 
+###############################################################################
+def _shapefile(zipfile):
+    """Private function to read a zipped shapefile into memory; returns contents and name of the .shp file in it"""
     with open(zipfile, 'rb') as fid:
         file = ZipFile(fid).namelist()
         fid.seek(0)
         data = fid.read()
-    
-    # 
+
+    #
     for item in file:
         if item.endswith('.shp'):
             shapefile = item
-    
-    # 
+    return data, shapefile
+
+def _count_shapefile(zipfile):
+    """Private function to get number of records in a zipped shapefile"""
+    data, shapefile = _shapefile( zipfile )
+    with ZipMemoryFile(data) as zip:
+        with zip.open(shapefile) as collection:
+            return len(collection)
+
+def _read_shapefile(zipfile, start = None, stop = None):
+    """Private function to read records start to stop (default all) from a zipped shapefile as plain dictionaries"""
+    data, shapefile = _shapefile( zipfile )
     with ZipMemoryFile(data) as zip:
         with zip.open(shapefile) as collection:
-            records = []
-            for record in collection:
-                try:
-                    wwa = wwaVTEC(record)
-                except:
-                    continue
-                if start_date is None and end_date is None:
-                    records.append(wwa)
-                elif start_date and end_date is None:
-                    if wwa.EXPIRED >= start_date:
-                        records.append(wwa)
-                elif start_date is None and end_date:
-                    if wwa.ISSUED <= end_date:
-                        records.append(wwa)
-                else:
-                    if (wwa.EXPIRED >= start_date and wwa.ISSUED <= end_date) or (wwa.ISSUED <= end_date and wwa.EXPIRED >= start_date):
-                        records.append(wwa)
-    
+            records = collection if (start is None) and (stop is None) else collection[start:stop]
+            return [{'type'       : 'Feature',
+                     'id'         : record['id'],
+                     'properties' : dict( record['properties'] ),
+                     'geometry'   : {'type'        : record['geometry']['type'],
+                                     'coordinates' : record['geometry']['coordinates']}}
+                    for record in records]
+
+def _read_cache(cache, zipfile, repair, tolerance):
+    """Private function to read cleaned records from cache; None if missing, stale, or made with other settings"""
+    if not os.path.isfile( cache ): return None
+    if os.path.isfile( zipfile ) and (os.stat( zipfile ).st_mtime > os.stat( cache ).st_mtime): return None
+    try:
+        with open(cache, 'rb') as f:
+            data = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(data, dict) or (data.get('version', None) != _cacheVersion): return None
+    if (data['repair'] != repair) or (data['tolerance'] != tolerance): return None
+    return data['records']
+
+def _write_cache(cache, records, repair, tolerance):
+    """Private function to write cleaned records to cache atomically"""
+    dirname = os.path.dirname( cache )
+    if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())                                # Unique name; several workers may write the same cache
+    with open(tmp, 'wb') as f:
+        pickle.dump( {'version' : _cacheVersion, 'repair' : repair, 'tolerance' : tolerance,
+                      'records' : records}, f, protocol = pickle.HIGHEST_PROTOCOL )
+    os.replace( tmp, cache )
+
+def ingest_warnings(zipfile, repair = True, tolerance = None, cache = None):
+    """
+    Name:
+        ingest_warnings
+    Purpose:
+        Function to read and clean all records of an IEM shapefile, using
+        a cache of cleaned records if one is available
+    Inputs:
+        zipfile   : Path to zipped IEM shapefile
+    Keywords:
+        repair    : See clean_geometry
+        tolerance : See clean_geometry
+        cache     : Path to pickle file of cleaned records. Read if it is
+                     newer than zipfile and was made with the same repair
+                     and tolerance; else written after cleaning
+    Outputs:
+        Returns list of cleaned records (plain dictionaries)
+    """
+    log = logging.getLogger(__name__)
+    if cache is not None:
+        records = _read_cache( cache, zipfile, repair, tolerance )
+        if records is not None: return records
+
+    records = []
+    nraw    = 0
+    nfail   = 0
+    for record in _read_shapefile( zipfile ):
+        nraw  += 1
+        record = clean_record( record, repair = repair, tolerance = tolerance )
+        if record is None:
+            nfail += 1
+        else:
+            records.append( record )
+    if nfail > 0:
+        log.debug( 'Dropped {} of {} records with empty or invalid geometry'.format(nfail, nraw) )
+
+    if cache is not None:
+        _write_cache( cache, records, repair, tolerance )
     return records
-    
+
+###############################################################################
+def read_warnings(zipfile, start_date = None, end_date = None, repair = True, tolerance = None, cache = None):
+    """
+    Name:
+        read_warnings
+    Purpose:
+        Function to read warnings from a zipped IEM shapefile, or a pickle
+        file of records
+    Inputs:
+        zipfile    : Path to zipped shapefile or pickle (.pic) file
+    Keywords:
+        start_date : Only return warnings that expire at or after this time
+        end_date   : Only return warnings issued at or before this time
+        repair     : See clean_geometry
+        tolerance  : See clean_geometry
+        cache      : See ingest_warnings
+    Outputs:
+        Returns list of wwaVTEC objects
+    """
+    if zipfile.endswith('.pic'):
+        records = _read_cache( zipfile, zipfile, repair, tolerance )
+        if records is None:
+            with open(zipfile, 'rb') as f:
+                records = pickle.load(f)
+            if isinstance(records, dict):                                       # Cache made with other settings; clean again from the records in it
+                records = records['records']
+            records = [clean_record( r, repair = repair, tolerance = tolerance ) for r in records]
+            records = [r for r in records if r is not None]
+    else:
+        records = ingest_warnings( zipfile, repair = repair, tolerance = tolerance, cache = cache )
+
+    if start_date is not None or end_date is not None:
+        start = start_date.strftime('%Y%m%d%H%M') if start_date else None
+        end   = end_date.strftime('%Y%m%d%H%M')   if end_date   else None
+        records = [r for r in records
+                    if ((start is None) or (r['properties']['EXPIRED'] >= start)) and
+                       ((end   is None) or (r['properties']['ISSUED']  <= end))]
+
+    log     = logging.getLogger(__name__)
+    out     = []
+    dropped = 0
+    for record in records:
+        try:
+            out.append( wwaVTEC(record) )
+        except (ValueError, KeyError, TypeError, IndexError) as err:           # Bad geometry, unknown VTEC code, or missing time
+            dropped += 1
+            log.debug( 'Dropped warning {}: {}'.format(record.get('id', '?'), err) )
+    if dropped:
+        log.warning( 'Dropped {} of {} warnings from {} that could not be converted'.format(dropped, len(records), zipfile) )
+    return out
+
 if __name__ == "__main__":
     # print('Clamped: ' + str(len(read_warnings('/home/allen/Downloads/1986_all.zip', start_date=datetime(1986, 1, 1), end_date=datetime(1986, 3, 1)))))
     # print('Full: ' + str(len(read_warnings('/home/allen/Downloads/1986_all.zip'))))
     # print('Clamped: ' + str(len(read_warnings('/home/allen/Downloads/2017_all.zip', start_date=datetime(2017, 8, 25), end_date=datetime(2017, 8, 29)))))
-    read_warnings('WeatherRadarML/data/pickle.pic')
\ No newline at end of file
+    read_warnings('WeatherRadarML/data/pickle.pic')
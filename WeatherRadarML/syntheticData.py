@@ -0,0 +1,389 @@
+import os, bz2, struct, zipfile, tempfile, shutil
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from WeatherRadarML.nexrad.utils.radar_geometry import station_location
+
+_volHeader   = struct.Struct('>9s3sII4s')                                       # Archive II volume header; tape, extension, date, time, ICAO
+_ctlWord     = struct.Struct('>i')                                              # LDM control word
+_msgHeader   = struct.Struct('>HBBHHIHH')                                       # Message header; size, channels, type, seq_id, date, ms, segments, seg_num
+_msg31Header = struct.Struct('>4sIHHfBBHBBBBfBbH')                              # Message 31 data header up to, and including, the block count
+_volBlock    = struct.Struct('>c3sHBBffhHfffffH2s')                             # Volume data constant block
+_elvBlock    = struct.Struct('>c3sHhf')                                         # Elevation data constant block
+_radBlock    = struct.Struct('>c3sHhffh2s')                                     # Radial data constant block
+_momentBlock = struct.Struct('>c3sIHhhhhBBff')                                  # Generic moment data block header
+_msg5Header  = struct.Struct('>HHHHHBB10s')                                     # Volume coverage pattern header
+_ctmSize     = 12                                                               # Size of Channel Terminal Manager header preceeding each message
+_recordSize  = 2432                                                             # Size of fixed length messages, including CTM header
+_cutSize     = 46                                                               # Size of each elevation cut record in message 5
+_nPointers   = 10                                                               # Number of block pointers in message 31 header
+_epoch       = datetime(1969, 12, 31)                                           # Day 1 of NEXRAD modified julian dates
+
+VCP_ANGLES = (0.5, 0.9, 1.3, 1.8, 2.4, 3.1, 4.0, 5.1, 6.4, 8.0, 10.0, 12.5, 15.6, 19.5)   # VCP 12 elevation angles, without split cuts
+
+# Moment name, number of gates, word size, scale, offset, and physical range of synthetic values
+MOMENTS = (
+    ('REF', 1832,  8,   2.0,    66.0, ( -30.0,  75.0)),
+    ('VEL', 1192,  8,   2.0,   129.0, ( -60.0,  60.0)),
+    ('SW',  1192,  8,   2.0,   129.0, (   0.0,  20.0)),
+    ('ZDR', 1192,  8,  16.0,   128.0, (  -2.0,   6.0)),
+    ('PHI', 1192, 16,   2.8361,  2.0, (   0.0, 360.0)),
+    ('RHO', 1192,  8, 300.0,   -60.5, (   0.2,   1.05)),
+)
+
+###############################################################################
+def _storm_cells(rng, ncells, max_range):
+    """Private function to draw random storm cells; (x, y, radius, peak dBZ)"""
+    r   = rng.uniform( 20.0e3, max_range, ncells )
+    az  = rng.uniform( 0.0, 2.0*np.pi, ncells )
+    return np.column_stack( [r * np.sin(az), r * np.cos(az),
+                             rng.uniform( 5.0e3, 30.0e3, ncells ),
+                             rng.uniform( 35.0, 65.0, ncells )] )
+
+def _sweep_fields(rng, cells, azimuth, elevation, first_gate, gate_spacing):
+    """Private function to compute synthetic moments for all rays of a sweep; returns dict of raw (encoded) arrays"""
+    ngate = max( m[1] for m in MOMENTS )
+    r     = first_gate + gate_spacing * np.arange( ngate, dtype = np.float32 )
+    az    = np.deg2rad( azimuth )[:,None]
+    x     = r * np.sin(az) * np.cos( np.deg2rad(elevation) )
+    y     = r * np.cos(az) * np.cos( np.deg2rad(elevation) )
+    ref   = np.full( x.shape, -20.0, dtype = np.float32 )
+    for cx, cy, rad, peak in cells:
+        ref = np.maximum( ref, peak - 50.0 * ((x - cx)**2 + (y - cy)**2) / rad**2 )
+    ref  += rng.normal( 0.0, 1.5, ref.shape ).astype(np.float32)
+    out   = {}
+    for name, ngates, word, scale, offset, (vmin, vmax) in MOMENTS:
+        z = ref[:,:ngates]
+        if   (name == 'REF'): vals = z
+        elif (name == 'VEL'): vals = 25.0 * np.sin( az + r[:ngates] / 40.0e3 ) + rng.normal( 0.0, 1.0, z.shape )
+        elif (name == 'SW') : vals = np.abs( rng.normal( 2.0, 1.0, z.shape ) )
+        elif (name == 'ZDR'): vals = np.clip( (z - 20.0) / 12.0, -0.5, 4.0 ) + rng.normal( 0.0, 0.2, z.shape )
+        elif (name == 'PHI'): vals = 30.0 + np.cumsum( np.clip( (z - 35.0) / 30.0, 0.0, None ), axis = 1 ) * gate_spacing / 1.0e3
+        else                : vals = 0.98 + rng.normal( 0.0, 0.01, z.shape )
+        raw = np.round( np.clip( vals, vmin, vmax ) * scale + offset )
+        raw = np.where( z > 0.0, np.clip( raw, 2, 2**word - 1 ), 0 )            # Zero (below threshold) outside echo
+        out[name] = raw.astype( '>u2' if (word == 16) else np.uint8 )
+    return out
+
+def _msg31(station, mjd, ms, iaz, azimuth, elev_num, elevation, status, location, vcp, fields, iray):
+    """Private function to pack one message 31 (with CTM and message headers)"""
+    lon, lat, alt = location                                                    # Altitude in km
+    blocks = [ _volBlock.pack( b'R', b'VOL', _volBlock.size, 1, 0, lat, lon, int(round(alt * 1.0e3)) - 20, 20,
+                                0.0, 0.0, 0.0, 0.0, 0.0, vcp, b'\x00\x00' ),
+               _elvBlock.pack( b'R', b'ELV', _elvBlock.size, 0, 0.0 ),
+               _radBlock.pack( b'R', b'RAD', _radBlock.size, 4660, 0.0, 0.0, 2700, b'\x00\x00' ) ]
+    for name, ngates, word, scale, offset, _ in MOMENTS:
+        data = fields[name][iray].tobytes()
+        blocks.append( _momentBlock.pack( b'D', name.ljust(3).encode('ascii'), 0, ngates,
+                                          2125, 250, 0, 0, 0, word, scale, offset ) + data )
+    hsize = _msg31Header.size + 4 * _nPointers
+    ptrs  = []
+    pos   = hsize
+    for blk in blocks:
+        ptrs.append( pos )
+        pos += len(blk)
+    ptrs += [0] * (_nPointers - len(ptrs))
+    body  = _msg31Header.pack( station.encode('ascii'), ms, mjd, iaz + 1, azimuth, 0, 0, pos,
+                               1 if (fields['REF'].shape[0] > 360) else 2, status, elev_num, 0,
+                               elevation, 0, 0, len(blocks) ) + \
+            struct.pack( '>{}I'.format(_nPointers), *ptrs ) + b''.join( blocks )
+    if len(body) % 2: body += b'\x00'                                          # Message size is in halfwords
+    header = _msgHeader.pack( (len(body) + _msgHeader.size) // 2, 8, 31, 0, mjd, ms, 1, 1 )
+    return bytes(_ctmSize) + header + body
+
+def _msg5(mjd, ms, vcp, angles):
+    """Private function to pack a message 5 (volume coverage pattern) padded to a fixed length record"""
+    cuts = b''.join( struct.pack( '>H', int(round(a * 65536.0 / 360.0)) ) + bytes(_cutSize - 2) for a in angles )
+    body = _msg5Header.pack( (_msg5Header.size + len(cuts)) // 2, 2, vcp, len(angles), 1, 2, 2, bytes(10) ) + cuts
+    msg  = _msgHeader.pack( (_recordSize - _ctmSize) // 2, 8, 5, 0, mjd, ms, 1, 1 ) + body
+    return bytes(_ctmSize) + msg.ljust( _recordSize - _ctmSize, b'\x00' )
+
+###############################################################################
+def level2_bytes(station = 'KTLX', time = datetime(2017, 8, 28, 0, 0),
+        angles          = VCP_ANGLES,
+        superres        = 3,
+        rays_per_record = 120,
+        ncells          = 8,
+        seed            = 0):
+    """
+    Name:
+        level2_bytes
+    Purpose:
+        Function to build a synthetic NEXRAD Level 2 (Archive II, message
+        31) volume. Moments are smooth storm cells plus noise, encoded the
+        same way as real data, and LDM records are bzip2 compressed, so the
+        file can be read with nexrad_level2_reader and Py-ART and decoding
+        costs are close to those of a real volume.
+    Inputs:
+        None.
+    Keywords:
+        station         : Station ID; site location is taken from the
+                           station table
+        time            : Datetime of start of volume
+        angles          : Elevation angle of each sweep
+        superres        : Number of lowest sweeps with 720 (0.5 degree)
+                           rays; other sweeps have 360 rays
+        rays_per_record : Number of radials in each LDM record
+        ncells          : Number of storm cells
+        seed            : Seed for random number generator
+    Outputs:
+        Returns contents of the file as bytes
+    """
+    rng      = np.random.default_rng( seed )
+    location = station_location( station )
+    cells    = _storm_cells( rng, ncells, 200.0e3 )
+    days     = (time - _epoch).days
+    ms0      = int( (time - _epoch - timedelta(days = days)).total_seconds() * 1000 )
+    vcp      = 12
+
+    records  = [ _msg5( days, ms0, vcp, angles ) ]                               # Metadata record; only the VCP message is needed
+    msgs     = []
+    ms       = ms0
+    for i, angle in enumerate( angles ):                                        # Iterate over sweeps
+        nrays  = 720 if (i < superres) else 360
+        az     = ((np.arange( nrays ) + 0.5) * 360.0 / nrays).astype(np.float32)
+        fields = _sweep_fields( rng, cells, az, angle, 2125.0, 250.0 )
+        for j in range( nrays ):
+            status = 0 if (j == 0) else (2 if (j == nrays-1) else 1)            # Start, intermediate, end of elevation
+            if (j == 0) and (i == 0): status = 3                                # Start of volume
+            if (j == nrays-1) and (i == len(angles)-1): status = 4              # End of volume
+            msgs.append( _msg31( station, days, ms, j, float(az[j]), i+1, float(angle),
+                                 status, location, vcp, fields, j ) )
+            ms += 25
+    for i in range( 0, len(msgs), rays_per_record ):
+        records.append( b''.join( msgs[i:i+rays_per_record] ) )
+
+    out = [ _volHeader.pack( b'AR2V0006.', b'001', days, ms0, station.encode('ascii') ) ]
+    for i, rec in enumerate( records ):
+        cbuf = bz2.compress( rec )
+        out.append( _ctlWord.pack( -len(cbuf) if (i == len(records)-1) else len(cbuf) ) )   # Negative size flags last record
+        out.append( cbuf )
+    return b''.join( out )
+
+def write_level2(path, station = 'KTLX', time = datetime(2017, 8, 28, 0, 0), **kwargs):
+    """
+    Name:
+        write_level2
+    Purpose:
+        Function to write a synthetic NEXRAD Level 2 volume to file; see
+        level2_bytes
+    Inputs:
+        path    : Path to write file to
+    Keywords:
+        station : Station ID
+        time    : Datetime of start of volume
+        All other keywords are passed to level2_bytes
+    Outputs:
+        Returns path
+    """
+    data    = level2_bytes( station, time, **kwargs )
+    dirname = os.path.dirname( path )
+    if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+    with open( path + '.tmp', 'wb' ) as fid:
+        fid.write( data )
+    os.replace( path + '.tmp', path )
+    return path
+
+###############################################################################
+def level2_key(station, time):
+    """Return key of a volume in the AWS bucket layout; YYYY/MM/DD/KXXX/KXXXYYYYMMDD_HHMMSS_V06"""
+    return '{}/{}/{}{}_V06'.format( time.strftime('%Y/%m/%d'), station, station, time.strftime('%Y%m%d_%H%M%S') )
+
+def write_bucket(storage, stations = ('KTLX',),
+        start = datetime(2017, 8, 28),
+        end   = datetime(2017, 8, 28, 1),
+        dt    = timedelta(minutes = 5),
+        mdm   = True,
+        seed  = 0,
+        **kwargs):
+    """
+    Name:
+        write_bucket
+    Purpose:
+        Function to fill a storage backend with synthetic Level 2 volumes
+        laid out like the AWS bucket, so the download, conversion, and
+        extraction pipelines can be run without network. Volumes of each
+        station are offset by a few seconds, as in real data.
+    Inputs:
+        storage  : nexrad.storage.level2_storage instance; e.g.,
+                    local_storage or memory_storage
+    Keywords:
+        stations : Station IDs
+        start    : Datetime of first volume
+        end      : Datetime of last volume (exclusive)
+        dt       : timedelta between volumes
+        mdm      : Set to add a small *_MDM file per station and day, which
+                    the downloader skips by default
+        seed     : Seed for random number generator; each volume uses a
+                    different seed derived from it
+        All other keywords are passed to level2_bytes; e.g., use a
+        few angles to make small volumes quickly
+    Outputs:
+        Returns list of keys of the volumes
+    """
+    keys = []
+    for i, station in enumerate( stations ):
+        time = start + timedelta(seconds = 7 * i)
+        day  = None
+        while (time < end):
+            if mdm and (time.date() != day):
+                day = time.date()
+                storage.put( level2_key( station, time ).replace('_V06', '_MDM'), b'\x00' * 64 )
+            key = level2_key( station, time )
+            storage.put( key, level2_bytes( station, time, seed = seed + len(keys), **kwargs ) )
+            keys.append( key )
+            time += dt
+    return keys
+
+###############################################################################
+def write_vtec_zip(path, nwarnings = 1000,
+        start  = datetime(2017, 8, 25),
+        end    = datetime(2017, 8, 30),
+        extent = (-105.0, -80.0, 25.0, 45.0),
+        phenom = ('FF', 'SV', 'TO', 'FA'),
+        nverts = 12,
+        seed   = 0):
+    """
+    Name:
+        write_vtec_zip
+    Purpose:
+        Function to write a synthetic IEM NWS watch/warning/advisory (VTEC)
+        shapefile zip like those downloaded with getWWAZips. Warnings are
+        random convex polygons of realistic size; about one in ten is a
+        MultiPolygon.
+    Inputs:
+        path      : Path to write zip file to
+    Keywords:
+        nwarnings : Number of warnings
+        start     : Datetime of first issue time
+        end       : Datetime of last issue time
+        extent    : Area warnings are placed in; (lonMin, lonMax, latMin, latMax)
+        phenom    : VTEC phenomena codes to draw from
+        nverts    : Number of vertices per polygon
+        seed      : Seed for random number generator
+    Outputs:
+        Returns path
+    """
+    import fiona
+
+    rng    = np.random.default_rng( seed )
+    schema = {'geometry'   : 'MultiPolygon',
+              'properties' : {'WFO'    : 'str:3',  'ISSUED'  : 'str:12', 'EXPIRED' : 'str:12',
+                              'INIT_ISS' : 'str:12', 'INIT_EXP' : 'str:12', 'PHENOM' : 'str:2',
+                              'GTYPE'  : 'str:1',  'SIG'     : 'str:1',  'ETN'     : 'str:4',
+                              'STATUS' : 'str:3',  'NWS_UGC' : 'str:6',  'AREA_KM2' : 'float'}}
+    span   = (end - start).total_seconds()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        shp = os.path.join( tmpdir, os.path.splitext( os.path.basename(path) )[0] + '.shp' )
+        with fiona.open( shp, 'w', driver = 'ESRI Shapefile', schema = schema, crs = 'EPSG:4326' ) as dst:
+            for i in range( nwarnings ):
+                polys = []
+                for j in range( 2 if (rng.random() < 0.1) else 1 ):
+                    lon0  = rng.uniform( extent[0], extent[1] )
+                    lat0  = rng.uniform( extent[2], extent[3] )
+                    theta = np.sort( rng.uniform( 0.0, 2.0*np.pi, nverts ) )
+                    rad   = rng.uniform( 0.1, 0.5 ) * rng.uniform( 0.7, 1.0, nverts )
+                    ring  = list( zip( lon0 + rad * np.cos(theta), lat0 + rad * np.sin(theta) ) )
+                    polys.append( [ring + ring[:1]] )
+                issued  = start + timedelta( seconds = int( rng.uniform( 0.0, span ) ) )
+                expired = issued + timedelta( minutes = int( rng.integers( 30, 180 ) ) )
+                dst.write( {'geometry'   : {'type' : 'MultiPolygon', 'coordinates' : polys},
+                            'properties' : {'WFO'      : 'HGX',
+                                            'ISSUED'   : issued.strftime('%Y%m%d%H%M'),
+                                            'EXPIRED'  : expired.strftime('%Y%m%d%H%M'),
+                                            'INIT_ISS' : issued.strftime('%Y%m%d%H%M'),
+                                            'INIT_EXP' : expired.strftime('%Y%m%d%H%M'),
+                                            'PHENOM'   : phenom[ rng.integers( len(phenom) ) ],
+                                            'GTYPE'    : 'P',
+                                            'SIG'      : 'W',
+                                            'ETN'      : str( i % 10000 ),
+                                            'STATUS'   : 'NEW',
+                                            'NWS_UGC'  : 'TXC201',
+                                            'AREA_KM2' : 1000.0}} )
+
+        dirname = os.path.dirname( path )
+        if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+        with zipfile.ZipFile( path + '.tmp', 'w', zipfile.ZIP_DEFLATED ) as zf:
+            for f in sorted( os.listdir( tmpdir ) ):
+                zf.write( os.path.join( tmpdir, f ), f )
+        os.replace( path + '.tmp', path )
+    finally:
+        shutil.rmtree( tmpdir, ignore_errors = True )
+    return path
+
+###############################################################################
+def asos_stations(nstations = None, extent = (-125.0, -66.0, 24.0, 50.0), seed = 0):
+    """
+    Name:
+        asos_stations
+    Purpose:
+        Function to get ASOS station IDs and locations from the station
+        table bundled with the package
+    Inputs:
+        None.
+    Keywords:
+        nstations : Number of stations to draw at random; default is all
+                     stations in extent
+        extent    : Area to use stations from; (lonMin, lonMax, latMin, latMax)
+        seed      : Seed for random number generator
+    Outputs:
+        Returns array of station IDs and [nstation, 2] array of lon/lat
+    """
+    from WeatherRadarML.ASOSInfo import ASOSInfo
+
+    stations, locations = ASOSInfo().get_stations()
+    stations  = np.asarray( stations )
+    locations = np.asarray( locations, dtype = np.float64 )
+    keep      = (locations[:,0] >= extent[0]) & (locations[:,0] <= extent[1]) & \
+                (locations[:,1] >= extent[2]) & (locations[:,1] <= extent[3])
+    stations, locations = stations[keep], locations[keep]
+    if (nstations is not None) and (nstations < stations.size):
+        index = np.sort( np.random.default_rng( seed ).choice( stations.size, nstations, replace = False ) )
+        stations, locations = stations[index], locations[index]
+    return stations, locations
+
+###############################################################################
+def write_asos(path, stations, locations,
+        start = datetime(2017, 8, 28),
+        end   = datetime(2017, 8, 29),
+        dt    = timedelta(minutes = 5),
+        seed  = 0):
+    """
+    Name:
+        write_asos
+    Purpose:
+        Function to write synthetic ASOS observations in the format
+        downloaded with ASOSInfo.download_data (comma separated, with
+        lon/lat), one row per station per time step
+    Inputs:
+        path      : Path to write file to
+        stations  : Station IDs; e.g., from asos_stations
+        locations : [nstation, 2] array of lon/lat
+    Keywords:
+        start     : Datetime of first observation
+        end       : Datetime of last observation (exclusive)
+        dt        : timedelta between observations
+        seed      : Seed for random number generator
+    Outputs:
+        Returns path
+    """
+    rng   = np.random.default_rng( seed )
+    times = np.arange( np.datetime64(start, 'm'), np.datetime64(end, 'm'), np.timedelta64(dt) )
+    nstat = len(stations)
+    p01i  = np.where( rng.random( (times.size, nstat) ) < 0.2,
+                      np.round( rng.exponential( 0.05, (times.size, nstat) ), 2 ), 0.0 )
+    tmpc  = np.round( 25.0 + rng.normal( 0.0, 3.0, (times.size, nstat) ), 1 )
+    dirname = os.path.dirname( path )
+    if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+    with open( path + '.tmp', 'w' ) as fid:
+        fid.write( 'station,valid,lon,lat,p01i,tmpc\n' )
+        for i, t in enumerate( times ):
+            valid = str(t).replace('T', ' ')
+            for j in range( nstat ):
+                p = 'M' if (p01i[i,j] < 0) else ('T' if (0.0 < p01i[i,j] < 0.01) else '{:0.2f}'.format(p01i[i,j]))
+                fid.write( '{},{},{:0.4f},{:0.4f},{},{:0.1f}\n'.format(
+                    stations[j], valid, locations[j][0], locations[j][1], p, tmpc[i,j]) )
+    os.replace( path + '.tmp', path )
+    return path
@@ -0,0 +1,359 @@
+import logging
+import os, re, json, math
+import threading
+from datetime import datetime
+from multiprocessing import Pool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from WeatherRadarML.profiling import timer
+
+_timeFMT = '%Y%m%d%H%M'                                                         # Format of times in tile paths and URLs
+_tileFMT = '{layer}/{time}/{z}/{x}/{y}.png'                                     # Tile path in cache and URL
+_maxLat  = 85.0511287798                                                        # Latitude limit of web mercator tiles
+_radius  = 6378137.0                                                            # Radius (m) of web mercator sphere
+_urlRE   = re.compile( r'^/(?P<layer>[\w\-]+)/(?P<time>\d{12})/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$' )
+_worker  = {}                                                                   # Layers and settings of a worker process; see _init_worker
+
+###############################################################################
+def tile_bounds(z, x, y):
+    """
+    Name:
+        tile_bounds
+    Purpose:
+        Function to get the limits of an XYZ (slippy map) tile
+    Inputs:
+        z : Zoom level
+        x : Tile column, from west
+        y : Tile row, from north
+    Keywords:
+        None.
+    Outputs:
+        Returns (lonMin, lonMax, latMin, latMax)
+    """
+    n = 2.0**z
+    return (x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0,
+            math.degrees( math.atan( math.sinh( math.pi * (1 - 2 * (y + 1) / n) ) ) ),
+            math.degrees( math.atan( math.sinh( math.pi * (1 - 2 * y / n) ) ) ))
+
+def _mercator(lon, lat):
+    """Private function to project lon/lat (degrees) to web mercator (m)"""
+    lat = np.clip( lat, -_maxLat, _maxLat )
+    return _radius * np.radians( lon ), _radius * np.log( np.tan( np.pi / 4 + np.radians( lat ) / 2 ) )
+
+def _latitude(y):
+    """Private function to get latitude (degrees) of web mercator y (m)"""
+    return np.degrees( 2 * np.arctan( np.exp( y / _radius ) ) - np.pi / 2 )
+
+###############################################################################
+def warning_layer(store, phenom = None, sig = None):
+    """
+    Name:
+        warning_layer
+    Purpose:
+        Function to define a tile layer of the warnings active at the
+        requested time
+    Inputs:
+        store  : warningStore instance
+    Keywords:
+        phenom : See warningStore.select
+        sig    : See warningStore.select
+    Outputs:
+        Returns layer dictionary for tileServer
+    """
+    return {'type' : 'warnings', 'store' : store, 'phenom' : phenom, 'sig' : sig}
+
+def grid_layer(func, cmap = 'viridis', vmin = None, vmax = None):
+    """
+    Name:
+        grid_layer
+    Purpose:
+        Function to define a tile layer of a gridded field; e.g., the
+        lowest level of radar_mosaic.radar_mosaic for the volumes nearest
+        the requested time
+    Inputs:
+        func : Function taking a datetime and returning a [nlat, nlon]
+                array (NaN where no data) and the longitude and latitude of
+                its cell centers; must be a module level function if
+                workers are spawned rather than forked
+    Keywords:
+        cmap : Name of matplotlib colormap
+        vmin : Value at bottom of colormap; default is grid minimum
+        vmax : Value at top of colormap; default is grid maximum
+    Outputs:
+        Returns layer dictionary for tileServer
+    """
+    return {'type' : 'grid', 'func' : func, 'cmap' : cmap, 'vmin' : vmin, 'vmax' : vmax}
+
+###############################################################################
+class tileServer( object ):
+    def __init__(self, cache_dir, layers, tile_size = 256, concurrency = 4):
+        '''
+        Purpose:
+            Render XYZ (slippy map) PNG tiles of warnings and gridded radar
+            fields at a requested time, and serve them over HTTP. Tiles are
+            cached on disk by (layer, time, z, x, y) and rendered by a pool
+            of worker processes, so panning through an event only renders
+            tiles that have not been seen before.
+        Inputs:
+            cache_dir   : Directory to cache tiles in
+            layers      : Dictionary of layer name to layer; see
+                           warning_layer and grid_layer
+        Keywords:
+            tile_size   : Size of tiles in pixels
+            concurrency : Number of processes rendering tiles
+        '''
+        self.cache_dir   = cache_dir
+        self.layers      = layers
+        self.tile_size   = tile_size
+        self.concurrency = concurrency
+        self._pool       = None
+        self._lock       = threading.Lock()                                     # Handler threads may ask for the pool at the same time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    @property
+    def pool(self):
+        '''Pool of render processes; started on first use'''
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:                                          # Another thread may have started it while we waited
+                    self._pool = Pool( self.concurrency, initializer = _init_worker,
+                                       initargs = (self.layers, self.cache_dir, self.tile_size,) )
+        return self._pool
+
+    def close(self):
+        '''Stop render processes'''
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    ###########################################################################
+    def path(self, layer, time, z, x, y):
+        '''Return path of tile in cache'''
+        return os.path.join( self.cache_dir, *_tileFMT.format( layer = layer, time = time.strftime(_timeFMT),
+                                                                z = z, x = x, y = y ).split('/') )
+
+    def tile(self, layer, time, z, x, y):
+        '''
+        Purpose:
+            Get a tile, rendering it in the pool if it is not cached
+        Inputs:
+            layer : Name of layer
+            time  : Datetime of tile
+            z     : Zoom level
+            x     : Tile column
+            y     : Tile row
+        Outputs:
+            Returns path to PNG file
+        '''
+        if layer not in self.layers:
+            raise Exception( 'Unknown layer: {}; must be one of {}'.format(layer, list(self.layers)) )
+        path = self.path( layer, time, z, x, y )
+        if os.path.isfile( path ):
+            return path
+        return self.pool.apply( _render_tile, ((layer, time, z, x, y,),) )
+
+    def render(self, layer, time, extent, zooms):
+        '''
+        Purpose:
+            Render all tiles of a region ahead of time; e.g., an event
+        Inputs:
+            layer  : Name of layer
+            time   : Datetime, or list of datetimes, of tiles
+            extent : Region; (lonMin, lonMax, latMin, latMax)
+            zooms  : Zoom levels to render
+        Outputs:
+            Returns list of paths
+        '''
+        times = time if isinstance(time, (list, tuple)) else [time]
+        tasks = []
+        for t in times:
+            for z in zooms:
+                x0, y0 = _tile_index( z, extent[0], extent[3] )
+                x1, y1 = _tile_index( z, extent[1], extent[2] )
+                tasks += [(layer, t, z, x, y,) for x in range(x0, x1+1) for y in range(y0, y1+1)
+                            if not os.path.isfile( self.path( layer, t, z, x, y ) )]
+        with timer('tiles.prerender'):
+            self.pool.map( _render_tile, tasks, chunksize = max( len(tasks) // (4 * self.concurrency), 1 ) )
+        return [self.path( *task ) for task in tasks]
+
+    ###########################################################################
+    def serve(self, host = '127.0.0.1', port = 8000):
+        '''
+        Purpose:
+            Serve tiles at http://host:port/<layer>/<YYYYmmddHHMM>/<z>/<x>/<y>.png
+            until interrupted; e.g., as a Leaflet or OpenLayers XYZ
+            source. /layers returns the layer names as JSON.
+        Keywords:
+            host : Address to listen on
+            port : Port to listen on
+        '''
+        log    = logging.getLogger(__name__)
+        server = self
+        class handler( BaseHTTPRequestHandler ):
+            def do_GET(self):
+                if (self.path == '/layers'):
+                    return self._send( 200, 'application/json', json.dumps( list(server.layers) ).encode() )
+                match = _urlRE.match( self.path )
+                if (match is None) or (match['layer'] not in server.layers):
+                    return self._send( 404, 'text/plain', b'Not found' )
+                try:
+                    path = server.tile( match['layer'], datetime.strptime( match['time'], _timeFMT ),
+                                        int(match['z']), int(match['x']), int(match['y']) )
+                    with open( path, 'rb' ) as fid:
+                        data = fid.read()
+                except Exception as err:
+                    log.error( 'Failed to render {}: {}'.format(self.path, err) )
+                    return self._send( 500, 'text/plain', str(err).encode() )
+                self._send( 200, 'image/png', data )
+
+            def _send(self, status, ctype, data):
+                self.send_response( status )
+                self.send_header( 'Content-Type', ctype )
+                self.send_header( 'Content-Length', str(len(data)) )
+                self.send_header( 'Access-Control-Allow-Origin', '*' )          # Map pages are usually served from elsewhere
+                self.end_headers()
+                self.wfile.write( data )
+
+            def log_message(self, fmt, *args):
+                log.debug( fmt % args )
+
+        httpd = ThreadingHTTPServer( (host, port), handler )
+        log.info( 'Serving tiles of {} at http://{}:{}/'.format(list(self.layers), host, httpd.server_address[1]) )
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            self.close()
+
+###############################################################################
+def _tile_index(z, lon, lat):
+    """Private function to get column and row of tile containing lon/lat"""
+    n    = 2**z
+    x, y = _mercator( lon, lat )
+    col  = int( (x / _radius + np.pi) / (2 * np.pi) * n )
+    row  = int( (np.pi - y / _radius) / (2 * np.pi) * n )
+    return min(max(col, 0), n-1), min(max(row, 0), n-1)
+
+def _init_worker(layers, cache_dir, tile_size):
+    """Private function to keep layers in each worker so they are sent once, not per tile"""
+    _worker.update( layers = layers, cache_dir = cache_dir, tile_size = tile_size, grids = {} )
+
+def _render_tile(args):
+    """
+    Name:
+        _render_tile
+    Purpose:
+        Private worker function to render one tile to the cache
+    Inputs:
+        args : Tuple of (layer, time, z, x, y)
+    Keywords:
+        None.
+    Outputs:
+        Returns path to PNG file
+    """
+    name, time, z, x, y = args
+    layer = _worker['layers'][name]
+    path  = os.path.join( _worker['cache_dir'], *_tileFMT.format( layer = name, time = time.strftime(_timeFMT),
+                                                                  z = z, x = x, y = y ).split('/') )
+    os.makedirs( os.path.dirname( path ), exist_ok = True )
+    tmp   = '{}.{}.tmp.png'.format(path[:-4], os.getpid())
+    with timer('tiles.render_' + layer['type']):
+        if (layer['type'] == 'warnings'):
+            _warning_tile( tmp, layer, time, tile_bounds( z, x, y ) )
+        else:
+            _grid_tile( tmp, name, layer, time, tile_bounds( z, x, y ) )
+    os.replace( tmp, path )
+    return path
+
+def _warning_tile(path, layer, time, bounds):
+    """Private function to draw warnings active at time inside bounds as one PolyCollection"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PolyCollection
+    from WeatherRadarML.plotUtils import warningColors
+
+    store  = layer['store']
+    size   = _worker['tile_size']
+    fig    = Figure( figsize = (size / 100.0, size / 100.0), dpi = 100 )
+    canvas = FigureCanvasAgg( fig )
+    fig.patch.set_alpha( 0 )
+    ax     = fig.add_axes( [0, 0, 1, 1] )
+    ax.set_axis_off()
+    x0, y0 = _mercator( bounds[0], bounds[2] )
+    x1, y1 = _mercator( bounds[1], bounds[3] )
+    ax.set_xlim( x0, x1 )
+    ax.set_ylim( y0, y1 )
+
+    index = store.select( time, time, layer['phenom'], layer['sig'] )
+    box   = store.bbox[ store['GEOM_ID'][index] ]
+    index = index[ (box[:,0] <= bounds[1]) & (box[:,2] >= bounds[0]) & (box[:,1] <= bounds[3]) & (box[:,3] >= bounds[2]) ]
+    verts = []
+    owner = []
+    for i in index.tolist():
+        geom = store.geometry( store['GEOM_ID'][i] )
+        for poly in (geom.geoms if hasattr(geom, 'geoms') else [geom]):
+            lon, lat = np.asarray( poly.exterior.coords ).T
+            verts.append( np.column_stack( _mercator( lon, lat ) ) )
+            owner.append( i )
+    if verts:
+        edge, face = warningColors( store['PHENOM'][owner] )
+        ax.add_collection( PolyCollection( verts, edgecolors = edge, facecolors = face, linewidths = 2 ) )
+    canvas.print_png( path )
+
+def _grid_tile(path, name, layer, time, bounds):
+    """Private function to color grid cells at the center of each tile pixel; nearest cell, transparent where no data"""
+    from matplotlib import colormaps
+    from matplotlib.image import imsave
+
+    key  = (name, time)
+    grid = _worker['grids'].get( key, None )
+    if grid is None:
+        if len(_worker['grids']) > 4: _worker['grids'].clear()                  # Keep a few recent grids per worker
+        grid = _worker['grids'][key] = layer['func']( time )
+    data, lon, lat = grid
+
+    size   = _worker['tile_size']
+    x0, y0 = _mercator( bounds[0], bounds[2] )
+    x1, y1 = _mercator( bounds[1], bounds[3] )
+    step   = (x1 - x0) / size
+    plon   = np.degrees( (x0 + (np.arange(size) + 0.5) * step) / _radius )      # Pixel centers
+    plat   = _latitude( y1 - (np.arange(size) + 0.5) * (y1 - y0) / size )       # Rows from north
+    ix     = np.round( (plon - lon[0]) / (lon[1] - lon[0]) ).astype( np.int64 )
+    iy     = np.round( (plat - lat[0]) / (lat[1] - lat[0]) ).astype( np.int64 )
+    okx    = (ix >= 0) & (ix < lon.size)
+    oky    = (iy >= 0) & (iy < lat.size)
+    vals   = np.full( (size, size), np.nan, dtype = np.float32 )
+    vals[np.ix_( oky, okx )] = data[np.ix_( iy[oky], ix[okx] )]
+
+    vmin = np.nanmin( data ) if layer['vmin'] is None else layer['vmin']
+    vmax = np.nanmax( data ) if layer['vmax'] is None else layer['vmax']
+    with np.errstate( invalid = 'ignore' ):
+        rgba = colormaps[ layer['cmap'] ]( (vals - vmin) / max(vmax - vmin, 1.0e-12), bytes = True )
+    rgba[...,3] = np.where( np.isfinite( vals ), 255, 0 )
+    imsave( path, rgba, format = 'png' )
+
+if __name__ == "__main__":
+    import argparse
+    from WeatherRadarML.warningStore import warningStore
+    parser = argparse.ArgumentParser( description = 'Serve XYZ tiles of warnings active at the requested time' )
+    parser.add_argument( 'store',         help = 'Warning store (.npz); see warningStore.update_store' )
+    parser.add_argument( 'cache_dir',     help = 'Directory to cache tiles in' )
+    parser.add_argument( '--phenom',      nargs = '+', help = 'VTEC phenomenon codes to show; default is all' )
+    parser.add_argument( '--port',        type = int, default = 8000, help = 'Port to listen on' )
+    parser.add_argument( '--concurrency', type = int, default = 4, help = 'Number of processes rendering tiles' )
+    args = parser.parse_args()
+    logging.basicConfig( level = logging.INFO )
+    tileServer( args.cache_dir, {'warnings' : warning_layer( warningStore.load( args.store ), phenom = args.phenom )},
+                concurrency = args.concurrency ).serve( port = args.port )
@@ -0,0 +1,208 @@
+import numpy as np
+from datetime import timedelta
+
+_directions = ('backward', 'forward', 'nearest')
+_reducers   = ('sum', 'mean', 'count', 'max', 'min')
+
+###############################################################################
+def _as_int64(times, unit):
+    """
+    Name:
+        _as_int64
+    Purpose:
+        Private function to convert datetime64 array to integer ticks
+    Inputs:
+        times : Array-like of datetime64 values
+        unit  : numpy datetime64 dtype to convert to before taking ticks
+    Keywords:
+        None.
+    Outputs:
+        Returns int64 array
+    """
+    return np.asarray( times ).astype( unit ).astype( np.int64 )
+
+###############################################################################
+def _as_ticks(delta, unit):
+    """
+    Name:
+        _as_ticks
+    Purpose:
+        Private function to convert a time difference to integer ticks
+    Inputs:
+        delta : timedelta or numpy timedelta64
+        unit  : numpy datetime64 dtype whose ticks to return
+    Keywords:
+        None.
+    Outputs:
+        Returns integer
+    """
+    if isinstance(delta, timedelta): delta = np.timedelta64( delta )
+    return int( np.timedelta64( delta ).astype( 'timedelta64[{}]'.format(np.datetime_data(unit)[0]) ).astype(np.int64) )
+
+###############################################################################
+def _combined_keys(leftKey, leftTime, rightKey, rightTime, pad = 0):
+    """
+    Name:
+        _combined_keys
+    Purpose:
+        Private function to combine (key, time) pairs into single int64
+        values that sort by key and then by time, so that joins over all
+        keys can be done with one sort and one binary search.
+    Inputs:
+        leftKey   : Group key (e.g., station) of each left row or None
+        leftTime  : datetime64 time of each left row
+        rightKey  : Group key of each right row or None
+        rightTime : datetime64 time of each right row
+    Keywords:
+        pad       : Number of ticks to leave between groups, so that
+                     searches offset by up to pad do not cross groups
+    Outputs:
+        Returns left combined keys, right combined keys (sorted), order
+        that sorts the right rows, ticks per group, and the time dtype used.
+        The group of a combined key is combined // ticks per group
+    """
+    unit  = np.result_type( np.asarray(leftTime).dtype, np.asarray(rightTime).dtype )
+    lt    = _as_int64( leftTime,  unit )
+    rt    = _as_int64( rightTime, unit )
+    if (leftKey is None) != (rightKey is None):
+        raise Exception( 'Keys must be given for both or neither of left and right' )
+    if leftKey is None:
+        lc = np.zeros( lt.size, dtype = np.int64 )
+        rc = np.zeros( rt.size, dtype = np.int64 )
+    else:
+        codes = np.unique( np.concatenate( [np.asarray(leftKey), np.asarray(rightKey)] ), return_inverse = True )[1]
+        lc    = codes[:lt.size].astype( np.int64 )
+        rc    = codes[lt.size:].astype( np.int64 )
+
+    tMin  = min( lt.min(initial =  2**62), rt.min(initial =  2**62) )
+    tMax  = max( lt.max(initial = -2**62), rt.max(initial = -2**62) )
+    span  = max( tMax - tMin, 0 ) + pad + 1                                     # Ticks per key; groups never overlap
+    if (max( lc.max(initial = 0), rc.max(initial = 0) ) + 1) * float(span) >= 2**62:
+        raise Exception( 'Time range too large to combine with keys; use a coarser time unit' )
+
+    left  = lc * span + (lt - tMin)
+    right = rc * span + (rt - tMin)
+    order = np.argsort( right, kind = 'stable' )
+    return left, right[order], order, span, unit
+
+###############################################################################
+def asof_join(leftKey, leftTime, rightKey, rightTime, tolerance = None, direction = 'backward'):
+    """
+    Name:
+        asof_join
+    Purpose:
+        Function to match each left row (e.g., ASOS observation) to the
+        right row (e.g., radar volume) with the same key that is closest in
+        time. All keys are matched at once with one sort and one binary
+        search, so there are no Python loops over keys or rows.
+    Inputs:
+        leftKey   : Group key (e.g., station ID) of each left row; None to
+                     match on time only
+        leftTime  : datetime64 time of each left row; need NOT be sorted
+        rightKey  : Group key of each right row; None to match on time only
+        rightTime : datetime64 time of each right row; need NOT be sorted
+    Keywords:
+        tolerance : Maximum absolute time difference (timedelta or
+                     timedelta64) for a match. Default is no limit
+        direction : Which right rows can match:
+                        backward : at or before the left time
+                        forward  : at or after the left time
+                        nearest  : either; ties go to the earlier row
+    Outputs:
+        Returns index into the right rows of the match for each left row,
+        -1 where there is no match, and the time difference
+        (right - left; NaT if no match) as timedelta64
+    """
+    if direction not in _directions:
+        raise Exception( 'direction must be one of {}'.format(_directions) )
+    left, right, order, span, unit = _combined_keys( leftKey, leftTime, rightKey, rightTime )
+    n     = right.size
+    if (n == 0):
+        return np.full( left.size, -1, dtype = np.int64 ), np.full( left.size, np.timedelta64('NaT'), dtype = unit.str.replace('M8', 'm8') )
+
+    back  = np.searchsorted( right, left, side = 'right' ) - 1                  # Last right row at or before left row
+    fore  = np.searchsorted( right, left, side = 'left'  )                      # First right row at or after left row
+    rBack = right[np.clip(back, 0, n-1)]
+    rFore = right[np.clip(fore, 0, n-1)]
+    okBack= (back >= 0) & (rBack // span == left // span)                       # Match must be in same group as left row
+    okFore= (fore <  n) & (rFore // span == left // span)
+    dBack = left - rBack                                                        # Ticks from right row to left row
+    dFore = rFore - left                                                        # Ticks from left row to right row
+
+    if (direction == 'backward'):
+        idx, ok, dt = back, okBack, -dBack
+    elif (direction == 'forward'):
+        idx, ok, dt = fore, okFore,  dFore
+    else:
+        useFore = okFore & ( ~okBack | (dFore < dBack) )
+        idx     = np.where( useFore, fore,  back )
+        ok      = okBack | okFore
+        dt      = np.where( useFore, dFore, -dBack )
+
+    if tolerance is not None:
+        ok &= np.abs( dt ) <= _as_ticks( tolerance, unit )
+
+    idx   = np.where( ok, order[np.clip(idx, 0, n-1)], -1 )
+    delta = np.where( ok, dt, np.iinfo(np.int64).min ).astype( unit.str.replace('M8', 'm8') )    # int64 min is NaT
+    return idx, delta
+
+###############################################################################
+def window_aggregate(leftKey, leftTime, rightKey, rightTime, values,
+        window = timedelta(hours = 1),
+        how    = 'mean'):
+    """
+    Name:
+        window_aggregate
+    Purpose:
+        Function to aggregate right rows (e.g., radar features from each
+        volume) over a time window before each left row (e.g., ASOS
+        observation) with the same key. Windows are found with a binary
+        search on combined (key, time) values; sums, means and counts are
+        differences of cumulative sums and max/min use ufunc.reduceat, so
+        the cost does not depend on the window length.
+    Inputs:
+        leftKey   : Group key (e.g., station ID) of each left row; None to
+                     aggregate on time only
+        leftTime  : datetime64 time of each left row
+        rightKey  : Group key of each right row; None to aggregate on time
+                     only
+        rightTime : datetime64 time of each right row
+        values    : Array of values for right rows; first dimension must
+                     match rightTime. NaN values are ignored
+    Keywords:
+        window    : Length of window; right rows with
+                     leftTime - window < rightTime <= leftTime are used
+        how       : Aggregation; one of sum, mean, count, max, min
+    Outputs:
+        Returns float array with shape [nleft] + values.shape[1:]; NaN
+        where no right rows are in the window (0 for sum and count)
+    """
+    if how not in _reducers:
+        raise Exception( 'how must be one of {}'.format(_reducers) )
+    unit   = np.result_type( np.asarray(leftTime).dtype, np.asarray(rightTime).dtype )
+    width  = _as_ticks( window, unit )
+    left, right, order, _, unit = _combined_keys( leftKey, leftTime, rightKey, rightTime, pad = width )
+    values = np.asarray( values, dtype = np.float64 )[order]
+    hi     = np.searchsorted( right, left,         side = 'right' )             # End of window (exclusive)
+    lo     = np.searchsorted( right, left - width, side = 'right' )             # Start of window; padding between groups keeps it inside group
+    valid  = np.isfinite( values )
+    count  = np.concatenate( [np.zeros((1,) + values.shape[1:]), np.cumsum(valid, axis = 0)] )
+    count  = count[hi] - count[lo]
+    empty  = count == 0
+
+    if how == 'count':
+        return count
+    if how in ('sum', 'mean'):
+        total = np.concatenate( [np.zeros((1,) + values.shape[1:]), np.cumsum(np.where(valid, values, 0.0), axis = 0)] )
+        total = total[hi] - total[lo]
+        if how == 'sum': return total
+        with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+            return np.where( empty, np.nan, total / np.maximum(count, 1) )
+
+    ufunc  = np.fmax if how == 'max' else np.fmin                               # fmax/fmin ignore NaN
+    padded = np.concatenate( [values, np.full((1,) + values.shape[1:], np.nan)] )   # Sentinel so a window ending at the last row is a valid index
+    bounds = np.column_stack( [lo, hi] ).ravel()                                # reduceat over [lo, hi) pairs; every other result is wanted
+    if bounds.size == 0:
+        return np.full( (0,) + values.shape[1:], np.nan )
+    out    = ufunc.reduceat( padded, bounds, axis = 0 )[::2]
+    return np.where( empty, np.nan, out )
@@ -0,0 +1,283 @@
+import logging
+import os, shutil, hashlib, subprocess
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+
+from WeatherRadarML import plotUtils
+from WeatherRadarML.warningStore import warningStore
+from WeatherRadarML.profiling import timer
+
+_frameFMT = 'frame_{:05d}.png'                                                  # File name of frames
+_frame    = {}                                                                  # Background and polygons shared by frames of a worker; see _init_worker
+
+###############################################################################
+class warningAnimation( object ):
+    def __init__(self, store,
+            extent     = (-130, -60, 25, 50),
+            resolution = '50m',
+            projection = 'PlateCarree',
+            linewidth  = 0.5,
+            figsize    = (10, 10),
+            dpi        = 100,
+            cache_dir  = None):
+        '''
+        Purpose:
+            Render frames of the warnings active over time. The base map
+            (plotUtils.baseMap) is drawn once and kept as a raster, on
+            disk if cache_dir is set, and warning outlines are projected to
+            pixels of that raster once per unique geometry. Each frame is
+            then the background image plus one PolyCollection, drawn with
+            the Agg backend without cartopy, so frames render quickly and
+            in parallel.
+        Inputs:
+            store      : warningStore instance; lists of wwaVTEC objects or
+                          records are converted with warningStore.from_records
+        Keywords:
+            extent     : See plotUtils.baseMap
+            resolution : See plotUtils.baseMap
+            projection : See plotUtils.baseMap
+            linewidth  : See plotUtils.baseMap
+            figsize    : Size of frames (inches)
+            dpi        : Resolution of frames
+            cache_dir  : Directory to keep rendered backgrounds in
+        '''
+        self.store      = store if isinstance(store, warningStore) else warningStore.from_records( store )
+        self.extent     = tuple(extent)
+        self.resolution = resolution
+        self.projection = projection
+        self.linewidth  = linewidth
+        self.figsize    = tuple(figsize)
+        self.dpi        = dpi
+        self.cache_dir  = cache_dir
+        self._image     = None                                                  # RGBA raster of base map
+        self._clip      = None                                                  # Pixel bounds of the map within the raster
+        self._transform = None                                                  # Function to map lon/lat to raster pixels
+        self._verts     = {}                                                    # Pixel outlines of each geometry ID
+
+    ###########################################################################
+    def background(self):
+        '''
+        Purpose:
+            Get the base map as an RGBA raster, drawing it on first use
+        Inputs:
+            None.
+        Outputs:
+            Returns [height, width, 4] uint8 array
+        '''
+        if self._image is not None:
+            return self._image
+        import matplotlib.pyplot as plt
+        import cartopy.crs as ccrs
+
+        with timer('animation.background'):
+            cache = self._cache_file()
+            if cache and os.path.isfile( cache ):                               # Only need the projection and extent of the map
+                image = np.load( cache )
+                fig   = plt.figure( figsize = self.figsize, dpi = self.dpi )
+                ax    = plt.axes( projection = getattr(ccrs, self.projection)() )
+                ax.set_extent( self.extent )
+                ax.set_position( [0, 0, 1, 1] )
+                ax.apply_aspect()
+            else:
+                ax  = plotUtils.baseMap( linewidth = self.linewidth, resolution = self.resolution,
+                                         extent = self.extent, projection = self.projection, figsize = self.figsize )
+                fig = ax.figure
+                fig.set_dpi( self.dpi )
+                ax.set_position( [0, 0, 1, 1] )                                 # Map fills the frame
+                fig.canvas.draw()
+                image = np.asarray( fig.canvas.buffer_rgba() ).copy()
+                if cache:
+                    os.makedirs( self.cache_dir, exist_ok = True )
+                    np.save( cache + '.tmp.npy', image )
+                    os.replace( cache + '.tmp.npy', cache )
+
+            src    = ccrs.PlateCarree()
+            proj   = ax.projection
+            trans  = ax.transData
+            def transform(lon, lat):
+                xy = proj.transform_points( src, np.asarray(lon), np.asarray(lat) )[:,:2]
+                return trans.transform( xy )
+            self._transform = transform
+            self._clip      = tuple( ax.bbox.bounds )
+            plt.close( fig )
+        self._image = image
+        return image
+
+    def _cache_file(self):
+        '''Path to cached background; None if no cache_dir'''
+        if self.cache_dir is None: return None
+        key = repr( (self.extent, self.resolution, self.projection, self.linewidth, self.figsize, self.dpi) )
+        return os.path.join( self.cache_dir, 'background_{}.npy'.format(hashlib.sha1( key.encode() ).hexdigest()[:16]) )
+
+    def _outlines(self, gid):
+        '''Pixel outlines of the polygons of geometry; projected on first use'''
+        verts = self._verts.get( gid, None )
+        if verts is None:
+            geom  = self.store.geometry( gid )
+            polys = geom.geoms if hasattr(geom, 'geoms') else [geom]
+            verts = []
+            for poly in polys:
+                lon, lat = poly.exterior.xy
+                verts.append( self._transform( lon, lat ).astype( np.float32 ) )
+            self._verts[gid] = verts
+        return verts
+
+    ###########################################################################
+    def frames(self, start, end, step = timedelta(minutes = 10), phenom = None, sig = None):
+        '''
+        Purpose:
+            Get the warnings active in each frame
+        Inputs:
+            start  : Datetime of first frame
+            end    : Datetime of last frame
+        Keywords:
+            step   : Time between frames
+            phenom : See warningStore.select
+            sig    : See warningStore.select
+        Outputs:
+            Returns list of (time, record index array) tuples
+        '''
+        index   = self.store.select( start, end, phenom, sig )
+        issued  = self.store['ISSUED'][index]
+        expired = self.store['EXPIRED'][index]
+        out     = []
+        time    = start
+        while (time <= end):
+            t = np.datetime64(time, 'm')
+            out.append( (time, index[ (issued <= t) & (expired >= t) ]) )
+            time += step
+        return out
+
+    def render(self, outfile, start, end,
+            step        = timedelta(minutes = 10),
+            phenom      = None,
+            sig         = None,
+            fps         = 5,
+            concurrency = 4):
+        '''
+        Purpose:
+            Render frames to PNG files, and optionally join them into an MP4
+        Inputs:
+            outfile     : Directory to write PNG frames to, or path of .mp4
+                           file; frames are then written to a directory of
+                           the same name without extension. MP4 requires
+                           ffmpeg
+            start       : Datetime of first frame
+            end         : Datetime of last frame
+        Keywords:
+            step        : Time between frames
+            phenom      : See warningStore.select
+            sig         : See warningStore.select
+            fps         : Frames per second of MP4
+            concurrency : Number of processes rendering frames
+        Outputs:
+            Returns list of PNG paths, or path to MP4
+        '''
+        log    = logging.getLogger(__name__)
+        t0     = timer('animation.render').start()
+        movie  = outfile.endswith('.mp4')
+        outdir = os.path.splitext( outfile )[0] if movie else outfile
+        if movie and (shutil.which('ffmpeg') is None):
+            raise Exception( 'ffmpeg is required to write MP4 files' )
+        os.makedirs( outdir, exist_ok = True )
+
+        image  = self.background()
+        frames = self.frames( start, end, step, phenom, sig )
+        gids   = np.unique( np.concatenate( [self.store['GEOM_ID'][i] for _, i in frames] + [np.zeros(0, np.int32)] ) )
+        verts  = {gid : self._outlines( gid ) for gid in gids.tolist()}         # Only what is needed is sent to workers
+        tasks  = []
+        for i, (time, index) in enumerate( frames ):
+            tasks.append( (os.path.join( outdir, _frameFMT.format(i) ),
+                           self.store['GEOM_ID'][index], self.store['PHENOM'][index],
+                           time.strftime('%Y-%m-%d %H:%M UTC'),) )
+
+        shared = (image, verts, self._clip, self.figsize, self.dpi,)
+        if (concurrency > 1) and (len(tasks) > 1):
+            with Pool( min(concurrency, len(tasks)), initializer = _init_worker, initargs = shared ) as pool:
+                paths = pool.map( _render_frame, tasks, chunksize = max(len(tasks) // (4 * concurrency), 1) )
+        else:
+            _init_worker( *shared )
+            paths = [_render_frame( task ) for task in tasks]
+        log.info( 'Rendered {} frames in {:0.1f} s: {}'.format(len(paths), t0.stop(), outdir) )
+
+        if not movie:
+            return paths
+        with timer('animation.encode'):
+            subprocess.run( ['ffmpeg', '-y', '-loglevel', 'error', '-framerate', str(fps),
+                             '-i', os.path.join( outdir, 'frame_%05d.png' ),
+                             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', outfile], check = True )
+        return outfile
+
+###############################################################################
+def _init_worker(image, verts, clip, figsize, dpi):
+    """Private function to keep the background and outlines in each worker so they are sent once, not per frame"""
+    _frame.update( image = image, verts = verts, clip = clip, figsize = figsize, dpi = dpi )
+
+def _render_frame(args):
+    """
+    Name:
+        _render_frame
+    Purpose:
+        Private worker function to render one frame; background image plus
+        one PolyCollection of all active warnings
+    Inputs:
+        args : Tuple of (path, geometry IDs, phenomena, title)
+    Keywords:
+        None.
+    Outputs:
+        Returns path
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PolyCollection
+    from matplotlib.patches import Rectangle
+
+    path, gids, phenom, title = args
+    image         = _frame['image']
+    height, width = image.shape[:2]
+    with timer('animation.frame'):
+        fig    = Figure( figsize = _frame['figsize'], dpi = _frame['dpi'] )
+        canvas = FigureCanvasAgg( fig )
+        ax     = fig.add_axes( [0, 0, 1, 1] )
+        ax.set_axis_off()
+        ax.imshow( image, extent = (0, width, 0, height), interpolation = 'nearest' )
+        ax.set_xlim( 0, width )
+        ax.set_ylim( 0, height )
+
+        verts = []
+        index = []                                                              # Warning of each polygon
+        for i, gid in enumerate( gids.tolist() ):
+            polys  = _frame['verts'][gid]
+            verts += polys
+            index += [i] * len(polys)
+        if verts:
+            edge, face = plotUtils.warningColors( phenom )
+            coll = PolyCollection( verts, edgecolors = edge[index], facecolors = face[index], linewidths = 2 )
+            x, y, w, h = _frame['clip']
+            coll.set_clip_path( Rectangle( (x, y), w, h, transform = ax.transData ) )
+            ax.add_collection( coll )
+        ax.text( 0.01, 0.01, title, transform = ax.transAxes, fontsize = 14,
+                 bbox = {'facecolor' : 'white', 'alpha' : 0.8} )
+        canvas.print_png( path )
+    return path
+
+if __name__ == "__main__":
+    import argparse
+    from WeatherRadarML.readWarnings import read_warnings
+    parser = argparse.ArgumentParser( description = 'Render warnings active over time to PNG frames or MP4' )
+    parser.add_argument( 'warnings',      help = 'Warning store (.npz), zip file, or pickle (.pic) of records' )
+    parser.add_argument( 'outfile',       help = 'Directory for PNG frames, or .mp4 file' )
+    parser.add_argument( 'start',         help = 'First frame; YYYYmmddHHMM' )
+    parser.add_argument( 'end',           help = 'Last frame; YYYYmmddHHMM' )
+    parser.add_argument( '--step',        type = int, default = 10, help = 'Minutes between frames' )
+    parser.add_argument( '--extent',      type = float, nargs = 4, default = (-130, -60, 25, 50), help = 'lonMin lonMax latMin latMax' )
+    parser.add_argument( '--concurrency', type = int, default = 4, help = 'Number of processes rendering frames' )
+    parser.add_argument( '--cache-dir',   help = 'Directory to keep rendered base maps in' )
+    args = parser.parse_args()
+    logging.basicConfig( level = logging.INFO )
+    store = warningStore.load( args.warnings ) if args.warnings.endswith('.npz') else read_warnings( args.warnings )
+    warningAnimation( store, extent = args.extent, cache_dir = args.cache_dir ).render(
+        args.outfile, datetime.strptime(args.start, '%Y%m%d%H%M'), datetime.strptime(args.end, '%Y%m%d%H%M'),
+        step = timedelta(minutes = args.step), concurrency = args.concurrency )
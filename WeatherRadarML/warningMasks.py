@@ -0,0 +1,481 @@
+import logging
+import os, json
+from datetime import datetime, timedelta
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+_dateFMT = '%Y-%m-%dT%H:%M:%S'                                                  # Format of dates in cache metadata
+
+###############################################################################
+def rasterize(geometry, resolution = 0.01, extent = (-130, -60, 25, 50)):
+    """
+    Name:
+        rasterize
+    Purpose:
+        Function to burn a (Multi)Polygon into a regular lon/lat grid using
+        a scanline algorithm. For every grid row crossed by the polygon, the
+        longitudes where polygon edges cross the row center are found for
+        all edges and rows at once, and consecutive crossings of the shell
+        and holes of each polygon are paired (even-odd rule) into runs of
+        grid columns, so holes are left out. A grid cell is inside the
+        polygon if its center is.
+    Inputs:
+        geometry   : shapely Polygon or MultiPolygon (e.g., wwaVTEC object)
+                      in lon/lat coordinates
+    Keywords:
+        resolution : Grid spacing in degrees
+        extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+    Outputs:
+        Returns row, first column, and end column (exclusive) arrays of the
+        runs of grid cells inside the polygon
+    """
+    nx, ny = _grid_shape( resolution, extent )
+    rows, c0, c1 = [], [], []
+    for poly in getattr(geometry, 'geoms', [geometry]):                         # Iterate over polygons
+        prow, pxc = [], []
+        for ring in [poly.exterior] + list(poly.interiors):                     # Crossings of shell and holes together, so holes are left out by even-odd rule
+            xy  = np.asarray( ring.coords )
+            x   = (xy[:,0] - extent[0]) / resolution - 0.5                      # Ring in grid units relative to cell centers
+            y   = (xy[:,1] - extent[2]) / resolution - 0.5
+            r   = np.arange( max( int(np.ceil(y.min())), 0 ), min( int(np.floor(y.max())), ny-1 ) + 1 )
+            if (r.size == 0): continue
+            x1, y1, x2, y2 = x[:-1,None], y[:-1,None], x[1:,None], y[1:,None]   # [nedge, 1] edge end points
+            cross = (y1 <= r) != (y2 <= r)                                      # [nedge, nrow] edge crosses row center; half-open so vertices count once
+            e, i  = np.nonzero( cross )
+            prow.append( r[i] )
+            pxc.append( x1[e,0] + (r[i] - y1[e,0]) * (x2[e,0] - x1[e,0]) / (y2[e,0] - y1[e,0]) )
+        if (len(prow) == 0): continue
+        prow, pxc = np.concatenate( prow ), np.concatenate( pxc )
+        order     = np.lexsort( (pxc, prow) )                                   # Sort crossings by row, then longitude
+        prow, pxc = prow[order], pxc[order]
+        rows.append( prow[0::2] )                                               # Crossings pair up within each row
+        c0.append( np.ceil( pxc[0::2] ).astype(np.int64) )
+        c1.append( np.ceil( pxc[1::2] ).astype(np.int64) )
+
+    if (len(rows) == 0):
+        return (np.zeros(0, dtype = np.int64),)*3
+    rows = np.concatenate( rows )
+    c0   = np.clip( np.concatenate( c0 ), 0, nx )
+    c1   = np.clip( np.concatenate( c1 ), 0, nx )
+    keep = c1 > c0
+    return rows[keep], c0[keep], c1[keep]
+
+###############################################################################
+def _grid_shape(resolution, extent):
+    """
+    Name:
+        _grid_shape
+    Purpose:
+        Private function to get number of columns and rows in grid
+    """
+    nx = int( round( (extent[1] - extent[0]) / resolution ) )
+    ny = int( round( (extent[3] - extent[2]) / resolution ) )
+    return nx, ny
+
+###############################################################################
+def _burn(runs, nx, ny):
+    """
+    Name:
+        _burn
+    Purpose:
+        Private function to combine runs of grid cells into a packed
+        bitmask. Overlapping runs are unioned with a difference array, so
+        only rows that are touched are accumulated.
+    Inputs:
+        runs : List of (row, c0, c1) tuples as returned by rasterize
+        nx   : Number of grid columns
+        ny   : Number of grid rows
+    Keywords:
+        None.
+    Outputs:
+        Returns [ny, ceil(nx/8)] uint8 array of packed bits
+    """
+    out = np.zeros( (ny, (nx + 7) // 8), dtype = np.uint8 )
+    if (len(runs) == 0): return out
+    rows = np.concatenate( [r[0] for r in runs] )
+    if (rows.size == 0): return out
+    c0   = np.concatenate( [r[1] for r in runs] )
+    c1   = np.concatenate( [r[2] for r in runs] )
+    used, rIdx = np.unique( rows, return_inverse = True )
+    diff = np.zeros( (used.size, nx+1), dtype = np.int32 )
+    np.add.at( diff, (rIdx, c0),  1 )
+    np.add.at( diff, (rIdx, c1), -1 )
+    out[used] = np.packbits( np.cumsum( diff, axis = 1 )[:,:nx] > 0, axis = 1 )
+    return out
+
+
+###############################################################################
+def _phenom(record):
+    """Private function to get the 2 character VTEC phenomenon code of a wwaVTEC object or record"""
+    props = getattr( record, '_record', record )['properties']
+    return props.get('PHENOM', None) or props.get('TYPE', None)
+
+def _merge_runs(keys, ends, nx):
+    """
+    Name:
+        _merge_runs
+    Purpose:
+        Private function to sort runs of grid cells and union the runs of a
+        warning that overlap (e.g., parts of a MultiPolygon), so at most one
+        run of a warning contains any cell
+    Inputs:
+        keys : List of arrays of (warning * nlat + row) * (nlon+1) + first
+                column of runs
+        ends : List of arrays of (warning * nlat + row) * (nlon+1) + end
+                column of runs
+        nx   : Number of grid columns
+    Keywords:
+        None.
+    Outputs:
+        Returns sorted key array and end column (exclusive) array of runs
+    """
+    keys = np.concatenate( keys ) if keys else np.zeros( 0, dtype = np.int64 )
+    ends = np.concatenate( ends ) if ends else np.zeros( 0, dtype = np.int64 )
+    if (keys.size == 0):
+        return keys, np.zeros( 0, dtype = np.int32 )
+    order = np.argsort( keys, kind = 'stable' )
+    keys  = keys[order]
+    reach = np.maximum.accumulate( ends[order] )                                # End of union of runs so far; never reaches the next row or warning
+    new   = np.ones( keys.size, dtype = bool )
+    new[1:] = keys[1:] > reach[:-1]                                             # Run starts after the union of previous runs ends
+    first = np.flatnonzero( new )
+    last  = np.append( first[1:], keys.size ) - 1
+    return keys[first], (reach[last] - (keys[first] - keys[first] % (nx + 1))).astype( np.int32 )
+
+def _ranges(first, count):
+    """Private function to concatenate ranges first[i]:first[i]+count[i]"""
+    return np.arange( count.sum() ) - np.repeat( np.cumsum( count ) - count, count ) + np.repeat( first, count )
+
+def _chunks(items, count, size = None):
+    """Private generator of consecutive pieces of items whose counts sum to about size; bounds memory of expanded pairs"""
+    size  = size or _chunk
+    total = np.cumsum( count )
+    cuts  = np.searchsorted( total, np.arange( size, total[-1] if total.size else 0, size ), side = 'right' )
+    for a, b in zip( np.concatenate( [[0], cuts] ), np.concatenate( [cuts, [len(items)]] ) ):
+        if (b > a): yield items[a:b]
+
+def _save(path, arr):
+    """Private function to write an array atomically"""
+    np.save( path + '.tmp.npy', arr )
+    os.replace( path + '.tmp.npy', path )
+
+_keys     = '.keys.npy'                                                         # Suffixes of files of a mask; see warningMask
+_ends     = '.ends.npy'
+_segments = '.segments.npy'
+_active   = '.active.npy'
+_frames   = '.frames.npy'
+_chunk    = 1 << 18                                                             # Points looked up at a time; bounds memory of (point, warning) pairs
+
+###############################################################################
+class warningMask( object ):
+    def __init__(self, path):
+        '''
+        Purpose:
+            To open a warning mask written by warningMask.build. The runs
+            of grid cells of each warning and the warnings active in each
+            segment of time steps are memory-mapped, so only the parts
+            that are looked up are read from disk.
+        Inputs:
+            path : Path given to warningMask.build; the mask is read from
+                    the files with the same base name
+        Attributes:
+            start      : Datetime of first time step
+            dt         : timedelta of time steps
+            nsteps     : Number of time steps
+            resolution : Grid spacing in degrees
+            extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+            shape      : Grid shape; (nlat, nlon)
+            phenom     : Phenomenon codes kept; None if all were kept
+            nwarnings  : Number of warnings in the mask
+            keys       : Runs of grid cells inside each warning, as
+                          (warning * nlat + row) * (nlon+1) + first column;
+                          sorted
+            ends       : End column (exclusive) of each run
+            steps      : First time step of each segment of steps with the
+                          same active warnings
+            first      : Offset of the active warnings of each segment in
+                          active; one more than the number of segments
+            active     : Warnings active in each segment
+            frames     : [nframe, nlat, ceil(nlon/8)] memory-mapped packed
+                          bits of the segments cached by cache; None if
+                          there is no cache
+            frameStart : Segment of the first frame
+        '''
+        base = os.path.splitext( path )[0]
+        with open( base + '.json', 'r' ) as fid:
+            info = json.load( fid )
+        self.start      = datetime.strptime( info['start'], _dateFMT )
+        self.dt         = timedelta( seconds = info['dt'] )
+        self.nsteps     = info['nsteps']
+        self.resolution = info['resolution']
+        self.extent     = tuple( info['extent'] )
+        self.shape      = tuple( info['shape'] )
+        self.phenom     = info['phenom']
+        self.nwarnings  = info['nwarnings']
+        self.keys       = np.load( base + _keys,   mmap_mode = 'r' )
+        self.ends       = np.load( base + _ends,   mmap_mode = 'r' )
+        self.active     = np.load( base + _active, mmap_mode = 'r' )
+        segments        = np.load( base + _segments )                           # Small; one row per issue/expire time
+        self.steps      = np.ascontiguousarray( segments[:-1,0] )
+        self.first      = np.ascontiguousarray( segments[:,1] )
+        self._base      = base
+        self._rows      = self._row_range( info['nwarnings'] )                  # Lookups only test points in these rows
+        self.frames     = None
+        self.frameStart = 0
+        if os.path.isfile( base + _frames ) and ('frameStart' in info):
+            self.frames     = np.load( base + _frames, mmap_mode = 'r' )
+            self.frameStart = info['frameStart']
+
+    ###########################################################################
+    @classmethod
+    def build(cls, path, records, start, end,
+            dt         = timedelta(minutes = 5),
+            resolution = 0.01,
+            extent     = (-130, -60, 25, 50),
+            phenom     = None):
+        '''
+        Purpose:
+            Rasterize warnings and write them to disk as a sparse mask. Each
+            warning is rasterized once and its runs of grid cells are stored
+            once, so the size of the mask grows with the number and size of
+            the warnings, not with the number of time steps. The warnings
+            active in each segment of time steps are found in one sweep over
+            the sorted issue and expire times.
+        Inputs:
+            path       : Path of the mask; arrays are written to .npy files
+                          and metadata to a .json file with the same base
+                          name
+            records    : List of wwaVTEC objects; e.g., from read_warnings
+                          or warningStore.warnings
+            start      : Datetime of first time step
+            end        : Datetime of last time step
+        Keywords:
+            dt         : timedelta of time steps. A warning is set in every
+                          step it is active at any time during
+            resolution : Grid spacing in degrees
+            extent     : Grid limits; (lonMin, lonMax, latMin, latMax)
+            phenom     : 2 character VTEC phenomenon code(s) to keep, as in
+                          warningStore.select; default keeps all warnings
+        Outputs:
+            Returns warningMask instance
+        '''
+        log    = logging.getLogger(__name__)
+        nx, ny = _grid_shape( resolution, extent )
+        nsteps = int( (end - start) // dt ) + 1
+        if phenom is not None:
+            phenom  = sorted( set( np.atleast_1d( phenom ).tolist() ) )
+            records = [r for r in records if _phenom( r ) in phenom]
+        s0     = np.asarray( [(r.ISSUED  - start) // dt for r in records], dtype = np.int64 )  # First step warning is active in
+        s1     = np.asarray( [(r.EXPIRED - start) // dt for r in records], dtype = np.int64 )  # Last step warning is active in
+        keep   = (s1 >= 0) & (s0 < nsteps) & (s1 >= s0)
+        records, s0, s1 = [r for r, k in zip(records, keep) if k], s0[keep], s1[keep]
+
+        keys, ends = [], []
+        for j, record in enumerate( records ):                                  # Rasterize each warning once
+            row, c0, c1 = rasterize( record, resolution, extent )
+            base        = (j * ny + row) * (nx + 1)
+            keys.append( base + c0 )
+            ends.append( base + c1 )
+        keys, ends = _merge_runs( keys, ends, nx )
+
+        n      = len(records)
+        event  = np.concatenate( [np.maximum( s0, 0 ), np.minimum( s1 + 1, nsteps )] )  # Issue events are 0..n-1, expire events n..2n-1
+        order  = np.argsort( event, kind = 'stable' )
+        change, split = np.unique( event[order], return_index = True )
+        steps, first, active = [0], [0], []
+        current = set()
+        for step, group in zip( change, np.split( order, split[1:] ) ):         # One sweep over events in time order
+            if (step >= nsteps): break
+            for e in group:
+                if (e < n):
+                    current.add( e )
+                else:
+                    current.discard( e - n )
+            if (step > steps[-1]):                                              # New segment
+                steps.append( step )
+                first.append( len(active) )
+            else:                                                               # Events at step 0 change the first segment
+                del active[first[-1]:]
+            active.extend( sorted( current ) )
+        first.append( len(active) )
+
+        dirname = os.path.dirname( path )
+        if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )   # If output directory does NOT exist, create it
+        base = os.path.splitext( path )[0]
+        _save( base + _keys,     keys )
+        _save( base + _ends,     ends )
+        _save( base + _segments, np.column_stack( [steps + [nsteps], first] ).astype( np.int64 ) )
+        _save( base + _active,   np.asarray( active, dtype = np.int32 ) )
+        if os.path.isfile( base + _frames ): os.remove( base + _frames )        # Cache is of the old mask
+
+        info = {'start'      : start.strftime( _dateFMT ),
+                'dt'         : dt.total_seconds(),
+                'nsteps'     : nsteps,
+                'resolution' : resolution,
+                'extent'     : list(extent),
+                'shape'      : [ny, nx],
+                'phenom'     : phenom,
+                'nwarnings'  : n}
+        with open( base + '.json.tmp', 'w' ) as fid:                            # Written last, so a mask is complete once its .json exists
+            json.dump( info, fid )
+        os.replace( base + '.json.tmp', base + '.json' )
+        log.info( 'Rasterized {} warnings into {} runs over {} segments of {} steps'.format(
+                   n, keys.size, len(steps), nsteps) )
+        return cls( base + '.json' )
+
+    ###########################################################################
+    def cache(self, start, end):
+        '''
+        Purpose:
+            Write dense frames of packed bits for the segments between start
+            and end to a memory-mapped file next to the mask, so a lookup in
+            that window is a single array index. Each frame is
+            nlat * ceil(nlon/8) bytes (about 2 MB for CONUS at 0.01
+            degree), so only cache short windows; e.g., an event that is
+            animated or served as tiles. Replaces any existing cache.
+        Inputs:
+            start : Datetime of start of window
+            end   : Datetime of end of window
+        Outputs:
+            None; sets frames and frameStart
+        '''
+        s0    = int( self._segment( max( int( (start - self.start) // self.dt ), 0 ) ) )
+        s1    = int( self._segment( min( int( (end   - self.start) // self.dt ), self.nsteps-1 ) ) )
+        self.frames = None                                                      # Frames are burned from runs
+        if (s1 < s0): return
+        cube  = open_memmap( self._base + '.frames.tmp.npy', mode = 'w+', dtype = np.uint8,
+                             shape = (s1 - s0 + 1, self.shape[0], (self.shape[1] + 7) // 8) )
+        for i in range( cube.shape[0] ):
+            cube[i] = self._frame( s0 + i )
+        cube.flush()
+        del cube
+        os.replace( self._base + '.frames.tmp.npy', self._base + _frames )
+        with open( self._base + '.json', 'r' ) as fid:
+            info = json.load( fid )
+        info['frameStart'] = s0
+        with open( self._base + '.json.tmp', 'w' ) as fid:
+            json.dump( info, fid )
+        os.replace( self._base + '.json.tmp', self._base + '.json' )
+        self.frames     = np.load( self._base + _frames, mmap_mode = 'r' )
+        self.frameStart = s0
+
+    ###########################################################################
+    def index(self, times, lons, lats):
+        '''
+        Purpose:
+            Convert times and locations to segment, row, and column indices
+        Inputs:
+            times : datetime64 array (or datetime) of time(s)
+            lons  : Longitude(s)
+            lats  : Latitude(s)
+        Outputs:
+            Returns segment, row, and column arrays, and boolean array that
+            is False where the point is outside the grid or time range.
+            Inputs are broadcast against each other
+        '''
+        times      = np.asarray( times, dtype = 'datetime64[s]' )
+        step       = (times - np.datetime64(self.start, 's')) // np.timedelta64(self.dt)
+        col        = np.floor( (np.asarray(lons) - self.extent[0]) / self.resolution ).astype(np.int64)
+        row        = np.floor( (np.asarray(lats) - self.extent[2]) / self.resolution ).astype(np.int64)
+        step, row, col = np.broadcast_arrays( step, row, col )
+        valid      = (step >= 0) & (step < self.nsteps) & \
+                     (row  >= 0) & (row  < self.shape[0]) & \
+                     (col  >= 0) & (col  < self.shape[1])
+        segment    = self._segment( np.where(valid, step, 0) )
+        return segment, np.where(valid, row, 0), np.where(valid, col, 0), valid
+
+    ###########################################################################
+    def lookup(self, times, lons, lats):
+        '''
+        Purpose:
+            Determine if points are inside a warning at given times. Each
+            point is resolved to the warnings active at its time, then to
+            the run of grid cells of each of those warnings in its row by a
+            binary search; points in a cached window are one array index
+        Inputs:
+            times : datetime64 array (or datetime) of time(s)
+            lons  : Longitude(s)
+            lats  : Latitude(s)
+        Outputs:
+            Returns boolean array; False outside of grid or time range
+        '''
+        segment, row, col, valid = self.index( times, lons, lats )
+        out     = np.zeros( valid.shape, dtype = bool )
+        flat    = out.reshape( -1 )
+        segment, row, col = segment.ravel(), row.ravel(), col.ravel()
+        points  = np.flatnonzero( valid.ravel() )
+        if self.frames is not None:                                             # Points in the cached window
+            frame  = segment[points] - self.frameStart
+            cached = (frame >= 0) & (frame < self.frames.shape[0])
+            p      = points[cached]
+            bits   = self.frames[frame[cached], row[p], col[p] >> 3]
+            flat[p] = ((bits >> (7 - (col[p] & 7))) & 1) == 1
+            points = points[~cached]
+
+        nx, ny = self.shape[1], self.shape[0]
+        if (self.keys.size == 0) or (points.size == 0): return out              # No warning covers any cell, or nothing left to look up
+        band    = segment[points] * ny + row[points]                            # Points sorted by segment, then row
+        order   = np.argsort( band, kind = 'stable' )
+        points, band = points[order], band[order]
+        present = np.unique( segment[points] )                                  # Segments with points
+        count   = self.first[present+1] - self.first[present]                   # Warnings active in each
+        for seg in _chunks( present, count ):
+            n      = self.first[seg+1] - self.first[seg]
+            pseg   = np.repeat( seg, n )                                        # (segment, active warning) pairs
+            warn   = self.active[ _ranges( self.first[seg], n ) ].astype(np.int64)
+            lo     = np.searchsorted( band, pseg * ny + self._rows[warn,0] )           # Points in the rows of the warning
+            hi     = np.searchsorted( band, pseg * ny + self._rows[warn,1], side = 'right' )
+            for sel in _chunks( np.arange( warn.size ), hi - lo ):
+                p    = points[ _ranges( lo[sel], hi[sel] - lo[sel] ) ]
+                w    = np.repeat( warn[sel], hi[sel] - lo[sel] )
+                key  = (w * ny + row[p]) * (nx + 1) + col[p]
+                run  = np.maximum( np.searchsorted( self.keys, key, side = 'right' ) - 1, 0 )  # Last run of warning and row starting at or before the column
+                head = self.keys[run]
+                hit  = (head <= key) & (head // (nx + 1) == key // (nx + 1)) & (col[p] < self.ends[run])
+                flat[ p[hit] ] = True
+        return out
+
+    ###########################################################################
+    def mask(self, time):
+        '''
+        Purpose:
+            Get the full (unpacked) mask for a time
+        Inputs:
+            time : Datetime to get mask for
+        Outputs:
+            Returns [nlat, nlon] boolean array; row 0 is the southern edge
+        '''
+        step = int( (time - self.start) // self.dt )
+        if (step < 0) or (step >= self.nsteps):
+            return np.zeros( self.shape, dtype = bool )
+        return np.unpackbits( self._frame( self._segment( step ) ), axis = 1, count = self.shape[1] ).astype( bool )
+
+    ###########################################################################
+    def _row_range(self, nwarn):
+        '''Return [nwarn, 2] first and last row of each warning; empty warnings get no rows'''
+        nx, ny = self.shape[1], self.shape[0]
+        w      = np.arange( nwarn, dtype = np.int64 )
+        lo     = np.searchsorted( self.keys, w * ny * (nx + 1) )
+        hi     = np.searchsorted( self.keys, (w + 1) * ny * (nx + 1) )
+        rows   = np.column_stack( [np.full( nwarn, ny ), np.full( nwarn, -1 )] )
+        ok     = hi > lo
+        rows[ok,0] = self.keys[lo[ok]]   // (nx + 1) - w[ok] * ny
+        rows[ok,1] = self.keys[hi[ok]-1] // (nx + 1) - w[ok] * ny
+        return rows
+
+    def _segment(self, step):
+        '''Return segment of time step(s)'''
+        return np.searchsorted( self.steps, step, side = 'right' ) - 1
+
+    def _frame(self, segment):
+        '''Return [nlat, ceil(nlon/8)] packed bits of warnings active in segment'''
+        if (self.frames is not None) and (0 <= segment - self.frameStart < self.frames.shape[0]):
+            return self.frames[segment - self.frameStart]
+        nx, ny = self.shape[1], self.shape[0]
+        runs   = []
+        for w in self.active[self.first[segment]:self.first[segment+1]]:
+            lo, hi = np.searchsorted( self.keys, [int(w) * ny * (nx + 1), (int(w) + 1) * ny * (nx + 1)] )
+            key    = np.asarray( self.keys[lo:hi] )
+            runs.append( (key // (nx + 1) - int(w) * ny, key % (nx + 1), np.asarray( self.ends[lo:hi] )) )
+        return _burn( runs, nx, ny )
@@ -0,0 +1,549 @@
+import logging
+import os, json, hashlib
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+import shapely
+from shapely import wkb as shapelyWKB
+from shapely.geometry import shape, mapping
+
+from WeatherRadarML.wwaVTEC import wwaVTEC, points_in_geometry
+from WeatherRadarML.readWarnings import _read_shapefile, _count_shapefile, clean_record
+from WeatherRadarML.profiling import timer
+
+_dateFMT = '%Y%m%d%H%M'                                                         # Format of dates in IEM shapefiles
+
+# Property name, dtype, and fill value of the columns kept for each record
+COLUMNS = (
+    ('WFO',        '<U3',           ''),
+    ('ETN',        np.int32,        -1),
+    ('PHENOM',     '<U2',           ''),
+    ('SIG',        '<U1',           ''),
+    ('GTYPE',      '<U1',           ''),
+    ('STATUS',     '<U3',           ''),
+    ('NWS_UGC',    '<U6',           ''),
+    ('ISSUED',     'datetime64[m]', None),
+    ('EXPIRED',    'datetime64[m]', None),
+    ('INIT_ISS',   'datetime64[m]', None),
+    ('INIT_EXP',   'datetime64[m]', None),
+    ('AREA_KM2',   np.float64,      np.nan),
+    ('NVERTS_RAW', np.int32,        -1),
+    ('NVERTS',     np.int32,        -1),
+)
+
+###############################################################################
+def _parse_times(values):
+    """Private function to convert YYYYMMDDHHMM strings (or None) to datetime64[m] without per-record datetime parsing"""
+    vals = np.asarray( [v or '0' for v in values], dtype = '<U12' )
+    good = np.char.str_len( vals ) == 12
+    iv   = np.where( good, vals, '197001010000' ).astype( np.int64 )
+    mon  = ((iv // 10**8) - 1970) * 12 + (iv // 10**6 % 100) - 1                 # Months since epoch
+    out  = mon.astype('datetime64[M]').astype('datetime64[m]') + \
+           ((iv // 10**4 % 100 - 1) * 1440 + (iv // 100 % 100) * 60 + iv % 100).astype('timedelta64[m]')
+    out[~good] = np.datetime64('NaT')
+    return out
+
+def _column(name, dtype, fill, values):
+    """Private function to build one column from property values"""
+    if (name in ('ISSUED', 'EXPIRED', 'INIT_ISS', 'INIT_EXP')):
+        return _parse_times( values )
+    values = [fill if v is None else v for v in values]
+    if (np.dtype(dtype).kind in 'if'):
+        return np.asarray( [float(v) if np.dtype(dtype).kind == 'f' else int(v) for v in values], dtype = dtype )
+    return np.asarray( values, dtype = dtype )
+
+###############################################################################
+class warningStore( object ):
+    def __init__(self, columns, wkb, offsets, hashes, bbox, meta = None):
+        '''
+        Purpose:
+            Columnar store of warnings. Each record property is a NumPy
+            array, and geometries are interned: identical geometries (e.g.,
+            the county and zone polygons that GTYPE 'C' warnings repeat
+            thousands of times a year), matched by a hash of their WKB, are
+            stored once in a geometry table that records reference by ID.
+            Point-in-geometry tests are run once per unique geometry.
+            Use from_records, load, or concatenate to create a store.
+        Inputs:
+            columns : Dictionary of record columns, including GEOM_ID
+            wkb     : uint8 array of WKB of all geometries, back to back
+            offsets : [ngeom+1] offsets of each geometry in wkb
+            hashes  : [ngeom] SHA1 digests of WKB
+            bbox    : [ngeom, 4] bounding boxes (minx, miny, maxx, maxy)
+        Keywords:
+            meta    : Dictionary saved with the store; e.g., the source file
+                       and settings it was ingested with (see update_store)
+        Attributes:
+            columns : Record columns; also available as store[name]
+            bbox    : Geometry bounding boxes
+            ngeom   : Number of unique geometries
+            meta    : See Keywords
+        '''
+        self.columns   = columns
+        self.bbox      = bbox
+        self.hashes    = hashes
+        self._wkb      = wkb
+        self._offsets  = offsets
+        self.meta      = {} if meta is None else meta
+        self._table    = None                                                   # Geometry ID of each hash; built on first append
+        self._index    = None                                                   # Row of each record key; built on first use
+        self._geoms    = {}                                                     # Geometries built from WKB on first use
+        self._prepared = {}                                                     # Prepared geometries built on first use
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_geoms']    = {}                                                 # Rebuilt from WKB on first use, so workers get only the arrays
+        state['_prepared'] = {}
+        return state
+
+    def __len__(self):
+        return self.columns['GEOM_ID'].size
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def ngeom(self):
+        return self.hashes.size
+
+    ###########################################################################
+    @classmethod
+    def from_records(cls, records):
+        '''
+        Purpose:
+            Build a store from records
+        Inputs:
+            records : Records with GeoJSON-like geometry and IEM properties;
+                       e.g., from readWarnings.ingest_warnings. wwaVTEC
+                       objects are also accepted
+        Outputs:
+            Returns warningStore instance
+        '''
+        records = [getattr(r, '_record', r) for r in records]
+        props   = [r['properties'] for r in records]
+        columns = {name : _column( name, dtype, fill, [p.get(name, None) for p in props] )
+                    for name, dtype, fill in COLUMNS}
+
+        table   = {}                                                            # Geometry ID of each hash
+        wkbs    = []
+        hashes  = []
+        bbox    = []
+        gid     = np.empty( len(records), dtype = np.int32 )
+        for i, record in enumerate( records ):
+            geom = shape( record['geometry'] )
+            data = geom.wkb
+            key  = hashlib.sha1( data ).digest()
+            j    = table.get( key, None )
+            if j is None:
+                j = table[key] = len(wkbs)
+                wkbs.append( data )
+                hashes.append( key )
+                bbox.append( geom.bounds )
+            gid[i] = j
+        columns['GEOM_ID'] = gid
+        return cls( columns, *_pack( wkbs ), np.asarray( hashes, dtype = 'S20' ),
+                    np.asarray( bbox, dtype = np.float64 ).reshape( -1, 4 ) )
+
+    @classmethod
+    def concatenate(cls, stores):
+        '''
+        Purpose:
+            Join stores, interning geometries across them
+        Inputs:
+            stores : List of warningStore instances
+        Outputs:
+            Returns warningStore instance
+        '''
+        table   = {}
+        wkbs    = []
+        hashes  = []
+        bbox    = []
+        gids    = []
+        for store in stores:
+            remap = np.empty( store.ngeom, dtype = np.int32 )                   # New ID of each geometry of the store
+            for g, key in enumerate( store.hashes ):
+                j = table.get( key, None )
+                if j is None:
+                    j = table[key] = len(wkbs)
+                    wkbs.append( store.wkb( g ) )
+                    hashes.append( key )
+                    bbox.append( store.bbox[g] )
+                remap[g] = j
+            gids.append( remap[ store['GEOM_ID'] ] )
+        columns = {name : np.concatenate( [store[name] for store in stores] ) for name, _, _ in COLUMNS}
+        columns['GEOM_ID'] = np.concatenate( gids ).astype( np.int32 ) if gids else np.zeros( 0, dtype = np.int32 )
+        return cls( columns, *_pack( wkbs ), np.asarray( hashes, dtype = 'S20' ),
+                    np.asarray( bbox, dtype = np.float64 ).reshape( -1, 4 ) )
+
+    ###########################################################################
+    @classmethod
+    def load(cls, path):
+        '''
+        Purpose:
+            Read a store written by save
+        Inputs:
+            path : Path to .npz file
+        Outputs:
+            Returns warningStore instance
+        '''
+        with np.load( path, allow_pickle = False ) as data:
+            columns = {name : data[name] for name, _, _ in COLUMNS}
+            columns['GEOM_ID'] = data['GEOM_ID']
+            meta = json.loads( str( data['META'] ) ) if 'META' in data.files else {}
+            return cls( columns, data['GEOM_WKB'], data['GEOM_OFFSETS'], data['GEOM_HASH'], data['GEOM_BBOX'], meta )
+
+    def save(self, path):
+        '''
+        Purpose:
+            Write store to an .npz file; the file is replaced atomically
+        Inputs:
+            path : Path to write to
+        '''
+        dirname = os.path.dirname( path )
+        if dirname and not os.path.isdir( dirname ): os.makedirs( dirname )
+        tmp = '{}.{}.tmp.npz'.format(os.path.splitext(path)[0], os.getpid())
+        np.savez( tmp, GEOM_WKB = self._wkb, GEOM_OFFSETS = self._offsets,
+                  GEOM_HASH = self.hashes, GEOM_BBOX = self.bbox, META = np.asarray( json.dumps( self.meta ) ),
+                  **self.columns )
+        os.replace( tmp, path )
+
+    ###########################################################################
+    def wkb(self, gid):
+        '''Return WKB of geometry as bytes'''
+        return self._wkb[ self._offsets[gid]:self._offsets[gid+1] ].tobytes()
+
+    def geometry(self, gid):
+        '''Return shapely geometry; built from WKB on first use'''
+        geom = self._geoms.get( gid, None )
+        if geom is None:
+            geom = self._geoms[gid] = shapelyWKB.loads( self.wkb( gid ) )
+        return geom
+
+    def prepared(self, gid):
+        '''Return prepared geometry; built on first use'''
+        geom = self._prepared.get( gid, None )
+        if geom is None:
+            geom = self._prepared[gid] = self.geometry( gid )
+            shapely.prepare( geom )                                             # In place; geometry is shared with _geoms
+        return geom
+
+    ###########################################################################
+    @property
+    def index(self):
+        '''Dictionary of record key (see record_keys) to row; built on first use and kept up to date by append'''
+        if self._index is None:
+            self._index = {key : i for i, key in enumerate( _keys( self.columns ) )}
+        return self._index
+
+    def append(self, records):
+        '''
+        Purpose:
+            Add records to the store in place. Geometries are interned
+            against those already in the store, and the key index is
+            updated rather than rebuilt.
+        Inputs:
+            records : Records as for from_records
+        Outputs:
+            Returns number of records added
+        '''
+        new = warningStore.from_records( records )
+        if (len(new) == 0): return 0
+        if self._table is None:
+            self._table = {key : g for g, key in enumerate( self.hashes.tolist() )}
+        remap = np.empty( new.ngeom, dtype = np.int32 )
+        add   = []                                                              # Geometries of new that are not in the store
+        for g, key in enumerate( new.hashes.tolist() ):
+            j = self._table.get( key, None )
+            if j is None:
+                j = self._table[key] = self.ngeom + len(add)
+                add.append( g )
+            remap[g] = j
+        if add:
+            wkb, offsets  = _pack( [new.wkb( g ) for g in add] )
+            self._wkb     = np.concatenate( [self._wkb, wkb] )
+            self._offsets = np.concatenate( [self._offsets, self._offsets[-1] + offsets[1:]] )
+            self.hashes   = np.concatenate( [self.hashes, new.hashes[add]] )
+            self.bbox     = np.concatenate( [self.bbox,   new.bbox[add]] )
+
+        nrow = len(self)
+        if self._index is not None:
+            for i, key in enumerate( _keys( new.columns ) ):
+                self._index[key] = nrow + i
+        new.columns['GEOM_ID'] = remap[ new['GEOM_ID'] ]
+        self.columns = {name : np.concatenate( [self.columns[name], new.columns[name]] ) for name in self.columns}
+        return len(new)
+
+    ###########################################################################
+    def select(self, start = None, end = None, phenom = None, sig = None):
+        '''
+        Purpose:
+            Find records active at any time between start and end
+        Keywords:
+            start  : Datetime; records expiring before are skipped
+            end    : Datetime; records issued after are skipped
+            phenom : 2 character VTEC phenomenon code(s) to keep
+            sig    : 1 character VTEC significance code(s) to keep
+        Outputs:
+            Returns index array of records
+        '''
+        keep = np.ones( len(self), dtype = bool )
+        if start  is not None: keep &= self['EXPIRED'] >= np.datetime64(start, 'm')
+        if end    is not None: keep &= self['ISSUED']  <= np.datetime64(end,   'm')
+        if phenom is not None: keep &= np.isin( self['PHENOM'], np.atleast_1d( phenom ) )
+        if sig    is not None: keep &= np.isin( self['SIG'],    np.atleast_1d( sig ) )
+        return np.flatnonzero( keep )
+
+    def contains(self, lons, lats, index = None):
+        '''
+        Purpose:
+            Find which records contain which points. Each unique geometry
+            is tested once, with a bounding box prefilter, and the result
+            is shared by all records that use it.
+        Inputs:
+            lons  : Longitudes of points
+            lats  : Latitudes of points
+        Keywords:
+            index : Records to test; default is all
+        Outputs:
+            Returns record index and point index arrays of the
+            (record, point) pairs where the point is inside the record
+        '''
+        lons  = np.asarray( lons, dtype = np.float64 ).ravel()
+        lats  = np.asarray( lats, dtype = np.float64 ).ravel()
+        index = np.arange( len(self) ) if index is None else np.asarray( index )
+        gids  = self['GEOM_ID'][index]
+        order = np.argsort( gids, kind = 'stable' )
+        ugid, first, nrec = np.unique( gids[order], return_index = True, return_counts = True )
+        bbox  = self.bbox[ugid]
+        near  = (bbox[:,0] <= lons.max()) & (bbox[:,2] >= lons.min()) & \
+                (bbox[:,1] <= lats.max()) & (bbox[:,3] >= lats.min()) if lons.size else np.zeros( ugid.size, dtype = bool )
+        recs  = []
+        pts   = []
+        for k in np.flatnonzero( near ):                                        # Iterate over unique geometries near any point
+            g      = ugid[k]
+            inside = np.flatnonzero( points_in_geometry( self.geometry( g ), lons, lats,
+                                        bbox = self.bbox[g], prepared = self.prepared( g ) ) )
+            if (inside.size == 0): continue
+            r = index[ order[first[k]:first[k]+nrec[k]] ]                       # Records with this geometry
+            recs.append( np.repeat( r, inside.size ) )
+            pts.append(  np.tile( inside, r.size ) )
+        if (len(recs) == 0):
+            return np.zeros( 0, dtype = np.int64 ), np.zeros( 0, dtype = np.int64 )
+        return np.concatenate( recs ), np.concatenate( pts )
+
+    def label(self, times, lons, lats, phenom = None, sig = None):
+        '''
+        Purpose:
+            Label observations that are inside a warning active at the time
+            of the observation. Observations at the same location (e.g.,
+            one station at many times) are tested against geometries once.
+        Inputs:
+            times : Observation times
+            lons  : Observation longitudes
+            lats  : Observation latitudes
+        Keywords:
+            phenom : See select
+            sig    : See select
+        Outputs:
+            Returns boolean array, True where observation is in a warning
+        '''
+        times = np.asarray( times ).astype( 'datetime64[m]' )
+        out   = np.zeros( times.size, dtype = bool )
+        if (times.size == 0): return out
+        index = self.select( times.min().astype(datetime), times.max().astype(datetime), phenom, sig )
+        if (index.size == 0): return out
+
+        xy, inv  = np.unique( np.column_stack( [np.ravel(lons), np.ravel(lats)] ), axis = 0, return_inverse = True )
+        inv      = inv.ravel()
+        rec, upt = self.contains( xy[:,0], xy[:,1], index )
+        order    = np.argsort( inv, kind = 'stable' )                           # Observations grouped by location
+        first    = np.searchsorted( inv[order], np.arange( xy.shape[0] ) )
+        nobs     = np.bincount( inv, minlength = xy.shape[0] )[upt]             # Observations at location of each pair
+        pair     = np.repeat( np.arange( rec.size ), nobs )
+        offset   = np.arange( pair.size ) - np.repeat( np.cumsum( nobs ) - nobs, nobs )
+        row      = order[ first[ upt[pair] ] + offset ]                         # Observation of each (record, observation) pair
+        rec      = rec[pair]
+        active   = (times[row] >= self['ISSUED'][rec]) & (times[row] <= self['EXPIRED'][rec])
+        out[ row[active] ] = True
+        return out
+
+    ###########################################################################
+    def record(self, i):
+        '''Return record i as a dictionary with GeoJSON-like geometry and IEM properties'''
+        props = {}
+        for name, dtype, fill in COLUMNS:
+            val = self.columns[name][i]
+            if isinstance(val, np.datetime64):
+                val = None if np.isnat(val) else val.astype(datetime).strftime(_dateFMT)
+            elif isinstance(val, np.floating):
+                val = None if np.isnan(val) else float(val)
+            elif isinstance(val, np.integer):
+                val = None if (val == fill) else int(val)
+                if (name == 'ETN') and (val is not None): val = str(val)
+            else:
+                val = str(val) or None
+            props[name] = val
+        return {'type' : 'Feature', 'id' : str(i), 'properties' : props,
+                'geometry' : mapping( self.geometry( self.columns['GEOM_ID'][i] ) )}
+
+    def warnings(self, index = None):
+        '''Return list of wwaVTEC objects for records in index; default is all; e.g., for plotting or warningMask.build'''
+        index = range( len(self) ) if index is None else index
+        return [wwaVTEC( self.record( i ) ) for i in index]
+
+###############################################################################
+KEY = ('WFO', 'ETN', 'PHENOM', 'SIG', 'ISSUED', 'GTYPE', 'NWS_UGC')             # Properties that identify a record
+
+def _keys(columns):
+    """Private function to get the key of each record from columns; times as integer minutes so keys of raw records match"""
+    cols = [columns[name].astype( np.int64 ) if (name == 'ISSUED') else columns[name] for name in KEY]
+    return list( zip( *[col.tolist() for col in cols] ) )
+
+def record_keys(records):
+    """
+    Name:
+        record_keys
+    Purpose:
+        Function to get the keys identifying records; the VTEC event (WFO,
+        ETN, PHENOM, SIG), ISSUED time, and, as county/zone records of an
+        event share those, GTYPE and NWS_UGC
+    Inputs:
+        records : Records with IEM properties
+    Keywords:
+        None.
+    Outputs:
+        Returns list of tuples
+    """
+    props = [r['properties'] for r in records]
+    return _keys( {name : _column( name, dtype, fill, [p.get(name, None) for p in props] )
+                    for name, dtype, fill in COLUMNS if name in KEY} )
+
+def ingest_store(zipfile, repair = True, tolerance = None, concurrency = 4, nchunks = None):
+    """
+    Name:
+        ingest_store
+    Purpose:
+        Function to read and clean all records of an IEM zip file into a
+        warningStore using a process pool. The records are split into
+        index ranges; each worker reads its range of the shapefile, cleans
+        the records, and returns a columnar chunk. Chunks are joined in
+        order with warningStore.concatenate, which interns geometries
+        across chunks.
+    Inputs:
+        zipfile     : Path to zipped IEM shapefile
+    Keywords:
+        repair      : See readWarnings.clean_geometry
+        tolerance   : See readWarnings.clean_geometry
+        concurrency : Number of worker processes; 1 reads in this process
+        nchunks     : Number of index ranges; default is 4 per worker so
+                       workers stay busy if some ranges are slower
+    Outputs:
+        Returns warningStore instance
+    """
+    log     = logging.getLogger(__name__)
+    t0      = timer('warnings.ingest_store').start()
+    nrecord = _count_shapefile( zipfile )
+    nchunks = max( min( nchunks or 4 * concurrency, nrecord ), 1 )
+    bounds  = np.linspace( 0, nrecord, nchunks + 1 ).astype( int )
+    tasks   = [(zipfile, start, stop, repair, tolerance,) for start, stop in zip( bounds[:-1], bounds[1:] )]
+    if (concurrency > 1) and (nchunks > 1):
+        with Pool( min(concurrency, nchunks) ) as pool:
+            chunks = pool.map( _ingest_range, tasks, chunksize = 1 )
+    else:
+        chunks = [_ingest_range( task ) for task in tasks]
+    store = warningStore.concatenate( chunks )
+    log.info( 'Ingested {} of {} records in {} chunks in {:0.1f} s: {}'.format(
+        len(store), nrecord, nchunks, t0.stop(), zipfile) )
+    return store
+
+def _ingest_range(args):
+    """Private worker function to read and clean records start to stop of a zip file into a warningStore"""
+    zipfile, start, stop, repair, tolerance = args
+    records = [clean_record( r, repair = repair, tolerance = tolerance ) for r in _read_shapefile( zipfile, int(start), int(stop) )]
+    return warningStore.from_records( [r for r in records if r is not None] )
+
+def update_store(zipfile, path, repair = True, tolerance = None, concurrency = 1):
+    """
+    Name:
+        update_store
+    Purpose:
+        Function to keep a persistent warning store up to date with a
+        yearly IEM zip file. Only records whose key (see record_keys) is
+        not yet in the store are cleaned and appended, and records already
+        in the store get their EXPIRED and STATUS updated, so a daily
+        refresh of the current year costs seconds rather than a rebuild.
+        Nothing is done if the zip file is the same size and age as the
+        one last ingested. The store is rebuilt if it was made with other
+        repair/tolerance settings.
+    Inputs:
+        zipfile     : Path to zipped IEM shapefile
+        path        : Path to .npz store; created if it does not exist
+    Keywords:
+        repair      : See readWarnings.clean_geometry
+        tolerance   : See readWarnings.clean_geometry
+        concurrency : Number of processes used to build a new store; see
+                       ingest_store
+    Outputs:
+        Returns warningStore instance
+    """
+    log      = logging.getLogger(__name__)
+    info     = os.stat( zipfile )
+    source   = {'name' : os.path.basename( zipfile ), 'size' : info.st_size, 'mtime' : info.st_mtime}
+    settings = {'repair' : repair, 'tolerance' : tolerance}
+
+    store = warningStore.load( path ) if os.path.isfile( path ) else None
+    if (store is not None) and any( store.meta.get(k, None) != v for k, v in settings.items() ):
+        log.info( 'Store made with other settings, rebuilding: {}'.format(path) )
+        store = None
+    if (store is not None) and (store.meta.get('source', None) == source):
+        log.debug( 'Store is up to date: {}'.format(path) )
+        return store
+    if (store is None) and (concurrency > 1):                                   # Nothing to diff against; ingest whole file in parallel
+        store = ingest_store( zipfile, repair = repair, tolerance = tolerance, concurrency = concurrency )
+        store.meta.update( settings, source = source )
+        store.save( path )
+        return store
+    if store is None:
+        store = warningStore.from_records( [] )
+
+    with timer('warnings.update_store'):
+        records = _read_shapefile( zipfile )
+        keys    = record_keys( records )
+        rows    = np.asarray( [store.index.get( key, -1 ) for key in keys], dtype = np.int64 )
+        old     = np.flatnonzero( rows >= 0 )
+        if old.size > 0:                                                        # Warnings may be extended or cancelled after they are ingested
+            for name, dtype, fill in COLUMNS:
+                if name in ('EXPIRED', 'STATUS'):
+                    store.columns[name][ rows[old] ] = _column( name, dtype, fill,
+                            [records[i]['properties'].get(name, None) for i in old] )
+        new     = [clean_record( records[i], repair = repair, tolerance = tolerance ) for i in np.flatnonzero( rows < 0 )]
+        nadd    = store.append( [r for r in new if r is not None] )
+    store.meta.update( settings, source = source )
+    store.save( path )
+    log.info( 'Added {} of {} records ({} dropped); {} records, {} geometries: {}'.format(
+        nadd, len(records), len(new) - nadd, len(store), store.ngeom, path) )
+    return store
+
+###############################################################################
+def _pack(wkbs):
+    """Private function to put WKB of geometries back to back; returns uint8 array and offsets"""
+    offsets = np.zeros( len(wkbs)+1, dtype = np.int64 )
+    offsets[1:] = np.cumsum( [len(w) for w in wkbs] )
+    return np.frombuffer( b''.join( wkbs ), dtype = np.uint8 ).copy(), offsets
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser( description = 'Add new records of IEM warning zip files to persistent warning stores' )
+    parser.add_argument( 'zipfiles',    nargs = '+', help = 'YYYY_all.zip files to ingest' )
+    parser.add_argument( '--store-dir', help = 'Directory of stores; default is directory of each zip file' )
+    parser.add_argument( '--tolerance', type = float, help = 'Simplify geometries to this tolerance (degrees)' )
+    parser.add_argument( '--no-repair', action = 'store_true', help = 'Do not repair invalid geometries' )
+    parser.add_argument( '--concurrency', type = int, default = 1, help = 'Number of processes used to build new stores' )
+    args = parser.parse_args()
+    logging.basicConfig( level = logging.INFO )
+    for zipfile in args.zipfiles:
+        name = os.path.splitext( os.path.basename( zipfile ) )[0] + '.npz'
+        update_store( zipfile, os.path.join( args.store_dir or os.path.dirname( zipfile ), name ),
+                      repair = not args.no_repair, tolerance = args.tolerance, concurrency = args.concurrency )
@@ -1,23 +1,54 @@
+import shapely
 from shapely.geometry import MultiPolygon, Polygon
 from datetime import datetime
 from matplotlib.colors import to_rgba
 import numpy as np
 from . import vtec
 
-class wwaVTEC( MultiPolygon ):
+def points_in_geometry(geometry, lons, lats, bbox = None, prepared = None):
+    '''
+    Purpose:
+        Function to test which points are inside a geometry. Points
+        outside the bounding box are rejected with NumPy, and the exact
+        test is only run on the rest.
+    Inputs:
+        geometry : shapely geometry
+        lons     : Longitudes of points
+        lats     : Latitudes of points
+    Keywords:
+        bbox     : (minx, miny, maxx, maxy) of geometry; computed if not set
+        prepared : Geometry prepared with shapely.prepare; used for the
+                    exact test if set
+    Output:
+        Boolean array, same shape as lons, True where point is inside
+    '''
+    lons = np.asarray( lons, dtype = np.float64 )
+    lats = np.asarray( lats, dtype = np.float64 )
+    out  = np.zeros( lons.shape, dtype = bool )
+    x0, y0, x1, y1 = geometry.bounds if bbox is None else bbox
+    near = (lons >= x0) & (lons <= x1) & (lats >= y0) & (lats <= y1)             # Points in bounding box
+    if near.any():
+        out[near] = shapely.contains_xy( geometry if prepared is None else prepared,
+                                         lons[near], lats[near] )
+    return out
+
+class wwaVTEC( object ):
     def __init__(self, record):
         '''
         Purpose:
-            To initialize the wwaVTEC class
+            To initialize the wwaVTEC class. The polygon(s) of the warning
+            are kept as a shapely MultiPolygon in the geometry attribute;
+            geometry attributes and methods (e.g., bounds, geoms,
+            contains) can also be used on the instance directly.
         Inputs:
             record : A record from an IEM shapefile containing NWS WWa VTEC
                       records
         '''
         coords = record['geometry']['coordinates']                              # Coordinages for polygon(s)
         if (record['geometry']['type'] == 'Polygon'):                           # If type is Polygon
-            super().__init__( [ Polygon( coords[0] ) ] )                        # Use coordinates to create Polygon in list and then initiailze super class (MulitPolygon) with list of single Polygon
+            self.geometry = MultiPolygon( [ Polygon( coords[0], coords[1:] ) ] )   # Use coordinates (shell and holes) to create Polygon in list and then initiailze MulitPolygon with list of single Polygon
         else:                                                                   # Else, assume type is MultiPolygon
-            super().__init__( [ Polygon( coord[0] ) for coord in coords ] )     # Iterate over all coordinates, initializing Polygon for each coordinate; all Polygons go in list; initialize super class
+            self.geometry = MultiPolygon( [ Polygon( coord[0], coord[1:] ) for coord in coords ] )  # Iterate over all coordinates, initializing Polygon for each coordinate; all Polygons go in list; initialize MultiPolygon
  
         for key, val in record['properties'].items():                           # Iterate over key/value pairs in record properties
             if (key == 'ISSUED') or (key == 'EXPIRED'):                         # If key is 'ISSUED' or 'EXPIRED'
@@ -30,7 +61,60 @@ class wwaVTEC( MultiPolygon ):
                 else:                                                           # Else
                     setattr(self, key, val)                                     # Set class attribute with name key to value val
         
-        self._record = record
+        self._record   = record
+        self._bbox     = None                                                   # Cached bounding box; see bbox
+
+    def __getattr__(self, attr):
+        '''Use attributes of the geometry for names not set on the instance'''
+        if attr.startswith('_') or (attr == 'geometry'):                        # Not set yet; e.g., while unpickling
+            raise AttributeError( attr )
+        return getattr( self.geometry, attr )
+
+    def __iter__(self):
+        '''Iterate over the polygons of the warning'''
+        return iter( self.geometry.geoms )
+
+    def __len__(self):
+        return len( self.geometry.geoms )
+
+    @property
+    def __geo_interface__(self):
+        return self.geometry.__geo_interface__
+
+    @property
+    def bbox(self):
+        '''
+        Purpose:
+            Property to return cached bounding box (minx, miny, maxx, maxy)
+        '''
+        if self._bbox is None:
+            self._bbox = self.bounds
+        return self._bbox
+
+    @property
+    def prepared(self):
+        '''
+        Purpose:
+            Property to return geometry prepared for fast repeated
+            predicates; prepared in place on first use
+        '''
+        if not shapely.is_prepared( self.geometry ):
+            shapely.prepare( self.geometry )
+        return self.geometry
+
+    def contains_points(self, lons, lats):
+        '''
+        Purpose:
+            Method to test which points are inside the warning. Points
+            outside the bounding box are rejected first, so most points
+            never reach the polygon test.
+        Inputs:
+            lons : Longitudes of points
+            lats : Latitudes of points
+        Output:
+            Boolean array, True where point is inside
+        '''
+        return points_in_geometry( self.geometry, lons, lats, bbox = self.bbox, prepared = self.prepared )
 
     @property
     def xy(self):
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import logging
+import argparse
+from datetime import datetime
+
+from WeatherRadarML.benchmarks import BENCHMARKS, SIZES, run_benchmarks, compare_results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description = 'Benchmark radar extraction and warning join hot paths on synthetic data' )
+    parser.add_argument( 'names', nargs = '*', help = 'Benchmarks to run; default is all of: {}'.format(', '.join(BENCHMARKS)) )
+    parser.add_argument( '--size',     default = 'small', choices = list(SIZES), help = 'Problem size' )
+    parser.add_argument( '--repeat',   default = 3, type = int, help = 'Number of timed runs of each benchmark' )
+    parser.add_argument( '--data-dir', default = None, help = 'Directory to keep synthetic data in' )
+    parser.add_argument( '--output',   default = None, help = 'JSON file to write results to; default is benchmarks_<size>_<date>.json' )
+    parser.add_argument( '--compare',  default = None, help = 'JSON file of a previous run to compare against' )
+    args   = parser.parse_args()
+
+    logging.basicConfig( level = logging.INFO, format = '%(message)s' )
+    output  = args.output or 'benchmarks_{}_{}.json'.format(args.size, datetime.now().strftime('%Y%m%dT%H%M%S'))
+    results = run_benchmarks( args.names or None, size = args.size, repeat = args.repeat,
+                              data_dir = args.data_dir, outfile = output )
+
+    print( '{:32}{:>10}{:>12}{:>14}{:>10}'.format('Benchmark', 'Items', 'Best (s)', 'Items/s', 'Peak MB') )
+    for name, res in results['results'].items():
+        if res['error']:
+            print( '{:32}  {}'.format(name, res['error']) )
+            continue
+        print( '{:32}{:>10}{:12.4f}{:>14}{:10.1f}'.format(name, res['items'] or '',  res['best'],
+                '{:0.1f}'.format(res['throughput']) if res['throughput'] else '', res['peak_mb']) )
+    print( 'Results written to: {}'.format(output) )
+
+    if args.compare:
+        print( '\n{:32}{:>12}{:>12}{:>8}'.format('Benchmark', 'Base (s)', 'New (s)', 'Ratio') )
+        for name, t0, t1, ratio, flag in compare_results( args.compare, results ):
+            print( '{:32}{:12.4f}{:12.4f}{:8.2f}  {}'.format(name, t0, t1, ratio, flag) )
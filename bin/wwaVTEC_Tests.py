@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import os
+import numpy as np
 from WeatherRadarML import plotUtils as utils
 from WeatherRadarML.readWarnings import read_warnings
+from WeatherRadarML.warningStore import warningStore
 from WeatherRadarML.ASOSInfo import ASOSInfo
 from datetime import datetime
 from shapely.geometry import Polygon, Point, shape
@@ -25,26 +27,19 @@ def show_warnings(zipfile, start=None, end=None, show_only_stations_inside=True)
 
     # Get the stations and their locations
     stations, locations = ASOSInfo().get_stations()
+    lons = [location[0] for location in locations]
+    lats = [location[1] for location in locations]
 
-    for record in records:
-        # Plot the warning
-        record.plot(ax)
-        for location in locations:
-            if show_only_stations_inside:
-                # Convert location to a Point object
-                station_location = Point(location)
-                # Check if the station is within the bounds of the warning
-                if record.is_valid and station_location.within(record):
-                    # Plot the station
-                    utils.plotStation(ax, stations[locations.index(location)], location, color='r')
-            else:
-                # Break the loop if show_only_stations_inside is False
-                break
-    
-    # Plot all stations if show_only_stations_inside is False
-    if not show_only_stations_inside:
-        for location in locations:
-            utils.plotStation(ax, stations[locations.index(location)], location, color='r')
+    # Plot all warnings as one collection
+    store = warningStore.from_records(records)
+    utils.plotWarnings(ax, store)
+
+    # Plot stations inside any warning, or all stations, as one scatter
+    if show_only_stations_inside:                                               # Geometries are repaired by read_warnings
+        index = np.unique(store.contains(lons, lats)[1])                        # Tested once per unique geometry
+    else:
+        index = np.arange(len(locations))
+    utils.plotStations(ax, [stations[i] for i in index], [locations[i] for i in index], color='r')
     
     # Show plot to user
     utils.plt.show()
@@ -61,8 +56,7 @@ def show_stations_by_state(state):
             stations.append(item['CALL'])
             locations.append((float(item['LON']), float(item['LAT'])))
 
-    for location in locations:
-            utils.plotStation(ax, stations[locations.index(location)], location, color='r')
+    utils.plotStations(ax, stations, locations, color='r')
 
     utils.plt.show()
 
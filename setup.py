@@ -15,10 +15,11 @@ setuptools.setup(
         author              = 'Allen Dawodu',
         version             = main_ns['__version__'],
         packages            = setuptools.find_packages(),
-        install_requires    = [ 'fiona',     'shapely', 'boto3', 
+        install_requires    = [ 'fiona',     'shapely>=2.0', 'boto3', 
                                 'arm-pyart', 'numpy',   'scipy', 'xarray',  
-                                'geopy',     'matplotlib', 'cartopy'],
-        package_data        = { '' : ['data/*.txt']},
+                                'geopy',     'matplotlib', 'cartopy',
+                                'pyproj'],
+        package_data        = { '' : ['data/*.txt', 'data/*.npz']},
         zip_save            = False
 )
 
@@ -0,0 +1,36 @@
+import numpy as np
+
+from WeatherRadarML.ASOSInfo import ASOSInfo
+
+_csv = '''station,valid,lon,lat,tmpc,skyc1,wxcodes,p01i,metar
+OKC,2017-08-28 00:00,-97.6,35.4,26.0,BKN,M,T,"KOKC 280000Z 18010KT 10SM BKN050 26/20 A2990"
+OKC,2017-08-28 01:00,-97.6,35.4,M,CLR,-RA,0.01,M
+'''
+
+def test_read_data_text_columns(tmp_path):
+    path = tmp_path / 'asos.csv'
+    path.write_text( _csv )
+    obs  = ASOSInfo().read_data( str(path) )
+    assert obs['tmpc'].dtype == np.float32 and np.isnan( obs['tmpc'][1] )
+    assert obs['p01i'][0] == np.float32(0.0001)                                 # Trace
+    assert obs['skyc1'].tolist()   == ['BKN', 'CLR']
+    assert obs['wxcodes'].tolist() == ['', '-RA']                               # Missing text is empty
+    assert obs['metar'][0].startswith('KOKC')
+
+def test_day_index_ranges(tmp_path):
+    path  = tmp_path / 'asos.csv'
+    lines = ['station,valid,lon,lat,tmpc']
+    for station in ('OKC', 'TUL'):                                              # IEM files are sorted by station, then time
+        for hour in range(0, 72, 5):
+            lines.append( '{},2017-08-{:02d} {:02d}:53,-97.6,35.4,{}'.format(station, 27 + hour // 24, hour % 24, hour) )
+    path.write_bytes( ('\r\n'.join(lines) + '\r\n').encode() )
+
+    index = ASOSInfo.day_index( str(path) )
+    assert sorted(index) == ['2017-08-27', '2017-08-28', '2017-08-29']
+    assert all( len(runs) == 2 for runs in index.values() )                     # One run per station
+    for day, runs in index.items():
+        obs = ASOSInfo.read_data( str(path), ranges = runs )
+        assert set( obs['time'].astype('datetime64[D]').astype(str) ) == {day}
+        assert sorted( set( obs['station'] ) ) == ['OKC', 'TUL']
+    total = sum( ASOSInfo.read_data( str(path), ranges = runs )['tmpc'].size for runs in index.values() )
+    assert total == len(lines) - 1
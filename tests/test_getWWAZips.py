@@ -0,0 +1,132 @@
+import os, json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from WeatherRadarML import getWWAZips as wwa
+
+_lastModified = 'Mon, 28 Aug 2017 00:00:00 GMT'
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serve files from server.files with ETag, Last-Modified, and Range support"""
+
+    def do_GET(self):
+        self.server.requests.append( (self.path, dict(self.headers), ) )
+        name = self.path.lstrip('/')
+        if name not in self.server.files:
+            self.send_error( 404 )
+            return
+        data = self.server.files[name]
+        etag = '"{}-{}"'.format( name, len(data) )
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response( 304 )
+            self.send_header( 'ETag', etag )
+            self.end_headers()
+            return
+
+        status, body = 200, data
+        rng = self.headers.get('Range')
+        if rng and self.headers.get('If-Range', etag) == etag:
+            start  = int( rng.split('=')[1].split('-')[0] )
+            status = 206
+            body   = data[start:]
+
+        self.send_response( status )
+        self.send_header( 'ETag', etag )
+        self.send_header( 'Last-Modified', _lastModified )
+        self.send_header( 'Content-Length', str(len(body)) )
+        if status == 206:
+            self.send_header( 'Content-Range', 'bytes {}-{}/{}'.format(len(data)-len(body), len(data)-1, len(data)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer( ('127.0.0.1', 0), _Handler )
+    srv.files    = {}
+    srv.requests = []
+    thread = threading.Thread( target = srv.serve_forever, daemon = True )
+    thread.start()
+    srv.url = 'http://127.0.0.1:{}/'.format( srv.server_address[1] )
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+def _manifest(outDir):
+    with open( os.path.join( outDir, wwa._manifest ), 'r' ) as fid:
+        return json.load( fid )
+
+def test_download_then_not_modified(server, tmp_path):
+    name = wwa._fileFMT.format( 2017 )
+    data = os.urandom( 3 * wwa._chunkSize + 123 )
+    server.files[name] = data
+
+    status = wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017] )
+    assert status['downloaded'] == 1 and status['failed'] == 0
+    assert (tmp_path / name).read_bytes() == data
+    entry = _manifest( tmp_path )[name]
+    assert entry['etag'] == '"{}-{}"'.format( name, len(data) )
+    assert entry['last_modified'] == _lastModified
+    assert entry['size'] == len(data)
+
+    status = wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017] )
+    assert status['skipped'] == 1                                                # Complete past year is not requested again
+    assert len(server.requests) == 1
+
+    status = wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017], refresh = True )
+    assert status['not_modified'] == 1
+    assert server.requests[-1][1].get('If-None-Match') == entry['etag']
+    assert (tmp_path / name).read_bytes() == data
+    assert _manifest( tmp_path )[name] == entry
+
+def test_changed_file_updates_manifest(server, tmp_path):
+    name = wwa._fileFMT.format( 2017 )
+    server.files[name] = b'a' * 1000
+    wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017] )
+
+    server.files[name] = b'b' * 2000                                            # New version on the server
+    status = wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017], refresh = True )
+    assert status['downloaded'] == 1
+    assert (tmp_path / name).read_bytes() == server.files[name]
+    entry = _manifest( tmp_path )[name]
+    assert entry['etag'] == '"{}-2000"'.format( name )
+    assert entry['size'] == 2000
+
+def test_resume_partial(server, tmp_path):
+    name = wwa._fileFMT.format( 2017 )
+    data = os.urandom( 50000 )
+    etag = '"{}-{}"'.format( name, len(data) )
+    server.files[name] = data
+
+    offset = 12345
+    (tmp_path / (name + wwa._partial)).write_bytes( data[:offset] )             # State left by an interrupted download
+    wwa._write_manifest( str(tmp_path), {name : {'etag' : etag, 'last_modified' : _lastModified,
+                                                 'size' : None, 'url' : server.url + name}} )
+
+    status = wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017] )
+    assert status['downloaded'] == 1
+    headers = server.requests[-1][1]
+    assert headers.get('Range') == 'bytes={}-'.format( offset )
+    assert headers.get('If-Range') == etag
+    assert (tmp_path / name).read_bytes() == data
+    assert not (tmp_path / (name + wwa._partial)).exists()
+    assert _manifest( tmp_path )[name]['size'] == len(data)
+
+def test_resume_stale_partial(server, tmp_path):
+    name = wwa._fileFMT.format( 2017 )
+    data = os.urandom( 50000 )
+    server.files[name] = data
+
+    (tmp_path / (name + wwa._partial)).write_bytes( b'x' * 1000 )               # Partial file of an older version
+    wwa._write_manifest( str(tmp_path), {name : {'etag' : '"old"', 'last_modified' : None,
+                                                 'size' : None, 'url' : server.url + name}} )
+
+    status = wwa.getWWAZips( str(tmp_path), baseURL = server.url, years = [2017] )
+    assert status['downloaded'] == 1                                            # If-Range fails, so the full file is sent
+    assert (tmp_path / name).read_bytes() == data
+    assert _manifest( tmp_path )[name]['etag'] == '"{}-{}"'.format( name, len(data) )
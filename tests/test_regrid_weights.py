@@ -0,0 +1,23 @@
+import numpy as np
+
+from WeatherRadarML.nexrad.utils.regrid_weights import canonical_sweep
+
+class _Sweep(object):
+    """Minimal radar with one sweep of given ray azimuths"""
+    def __init__(self, azimuth):
+        self.azimuth = np.asarray( azimuth, dtype = np.float32 )
+    def get_azimuth(self, sweep):
+        return self.azimuth
+
+def test_canonical_sweep_nearest_ray_wins():
+    radar = _Sweep( [10.9, 10.4, 10.1, 359.6, 0.2, 45.5] )
+    vals  = np.arange( radar.azimuth.size, dtype = np.float32 )[:,None] * np.ones( (1, 3) )
+    for order in (slice(None), slice(None, None, -1)):                          # Result must not depend on ray order
+        radar.azimuth = radar.azimuth[order]
+        vals          = vals[order]
+        out = canonical_sweep( radar, 0, vals, 360 )
+        assert out.shape == (360, 3)
+        assert (out[10] == 1).all()                                             # 10.4 is nearest to the 10.5 center
+        assert (out[359] == 3).all() and (out[0] == 4).all()                    # Wraps around north
+        assert (out[45] == 5).all()
+        assert np.isnan( out[[1, 11, 200]] ).all()
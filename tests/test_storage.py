@@ -0,0 +1,58 @@
+import os, glob
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from WeatherRadarML.syntheticData import write_bucket, level2_key
+from WeatherRadarML.nexrad.storage import local_storage, memory_storage
+from WeatherRadarML.nexrad.nexrad_level2_aws_download import nexrad_level2_aws_download
+from WeatherRadarML.nexrad.utils.nexrad_level2_reader import nexrad_level2_reader
+
+_start  = datetime(2017, 8, 28)
+_angles = (0.5, 1.5)                                                            # Two sweeps keeps volumes small
+
+def test_local_storage_roundtrip(tmp_path):
+    storage = local_storage( str(tmp_path) )
+    storage.put( '2017/08/28/KTLX/a', b'abc' )
+    storage.put( '2017/08/28/KTLX/b', b'defg' )
+    assert list( storage.list( '2017/08/28/KTLX/' ) ) == [('2017/08/28/KTLX/a', 3), ('2017/08/28/KTLX/b', 4)]
+    assert storage.read( '2017/08/28/KTLX/b' ) == b'defg'
+    storage.get( '2017/08/28/KTLX/a', str(tmp_path / 'a') )
+    assert (tmp_path / 'a').read_bytes() == b'abc'
+
+def test_local_storage_concurrent_put(tmp_path):
+    storage = local_storage( str(tmp_path) )
+    key     = '2017/08/28/KTLX/a'
+    with ThreadPool( 8 ) as pool:                                               # Errors in writers are raised here
+        pool.map( lambda i: storage.put( key, bytes([i]) * 100000 ), range(32) )
+    data = storage.read( key )
+    assert len(data) == 100000 and len(set(data)) == 1                          # One whole write won
+    assert [k for k, _ in storage.list()] == [key]                              # No temporary files left
+
+def test_synthetic_bucket_download(tmp_path):
+    storage = local_storage( str(tmp_path / 'bucket') )
+    keys    = write_bucket( storage, stations = ('KTLX', 'KFWS'), start = _start,
+                            end = _start + timedelta(minutes = 10), angles = _angles )
+    assert len(keys) == 4
+    assert level2_key( 'KTLX', _start ) in keys
+    listed = [key for key, _ in storage.list( '2017/08/28/KTLX/' )]
+    assert listed == sorted( listed ) and len(listed) == 3                      # Two volumes and the MDM file
+
+    outdir, _, size = nexrad_level2_aws_download( date1 = _start, date2 = _start + timedelta(hours = 1),
+                            station = 'KTLX', outroot = str(tmp_path / 'data'), storage = storage, concurrency = 1 )
+    files = sorted( glob.glob( os.path.join( outdir, 'KTLX', '*' ) ) )
+    assert [os.path.basename(f) for f in files] == [k.split('/')[-1] for k in keys if '/KTLX/' in k]
+    for path in files:
+        with open( path, 'rb' ) as fid:
+            assert fid.read() == storage.read( '2017/08/28/KTLX/' + os.path.basename(path) )
+
+    radar = nexrad_level2_reader( files[0] )
+    assert radar.nsweeps == len(_angles)
+    np.testing.assert_allclose( radar.fixed_angle['data'], _angles, atol = 0.1 )
+    assert np.ma.count( radar.get_field( 0, 'reflectivity' ) ) > 0
+
+def test_memory_storage_bucket():
+    storage = memory_storage()
+    keys    = write_bucket( storage, start = _start, end = _start + timedelta(minutes = 5), angles = _angles, mdm = False )
+    assert [key for key, _ in storage.list()] == keys
@@ -0,0 +1,19 @@
+from multiprocessing.pool import ThreadPool
+
+from WeatherRadarML import tileServer as ts
+
+def test_pool_started_once(tmp_path, monkeypatch):
+    started = []
+    def pool(*args, **kwargs):
+        started.append( ts.Pool.__wrapped__( *args, **kwargs ) )
+        return started[-1]
+    pool.__wrapped__ = ts.Pool
+    monkeypatch.setattr( ts, 'Pool', pool )
+
+    server = ts.tileServer( str(tmp_path), {}, concurrency = 1 )
+    with ThreadPool( 16 ) as threads:                                           # Like a map client asking for many tiles at once
+        pools = threads.map( lambda i: server.pool, range(64) )
+    assert len(started) == 1
+    assert all( p is started[0] for p in pools )
+    server.close()
+    assert server._pool is None
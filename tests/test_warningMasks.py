@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import shapely
+
+from WeatherRadarML.wwaVTEC import wwaVTEC
+from WeatherRadarML.warningMasks import warningMask
+
+_start = datetime(2017, 8, 28)
+
+def _warning(coords, phenom, issued, expired):
+    return wwaVTEC( {'geometry'   : {'type' : 'Polygon', 'coordinates' : coords},
+                     'properties' : {'PHENOM'  : phenom, 'SIG' : 'W',
+                                     'ISSUED'  : (_start + issued).strftime('%Y%m%d%H%M'),
+                                     'EXPIRED' : (_start + expired).strftime('%Y%m%d%H%M')}} )
+
+def _records():
+    box  = [(-100, 30), (-90, 30), (-90, 40), (-100, 40), (-100, 30)]
+    hole = [(-97, 33), (-93, 33), (-93, 37), (-97, 37), (-97, 33)]
+    return [_warning( [box, hole], 'TO', timedelta(hours = 1), timedelta(hours = 3) ),
+            _warning( [[(-95, 35), (-85, 35), (-85, 38), (-95, 38), (-95, 35)]], 'TO',
+                      timedelta(hours = 2), timedelta(hours = 5) ),                   # Overlaps the first and its hole
+            _warning( [[(-120.03, 30.02), (-110.01, 30.04), (-115.07, 44.93), (-120.03, 30.02)]], 'FF',
+                      timedelta(hours = 0), timedelta(hours = 1) )]
+
+def _expected(records, mask, times, lons, lats):
+    """Brute force: cell center inside any warning active during the time step"""
+    res  = mask.resolution
+    lon  = mask.extent[0] + (np.floor( (lons - mask.extent[0]) / res ) + 0.5) * res
+    lat  = mask.extent[2] + (np.floor( (lats - mask.extent[2]) / res ) + 0.5) * res
+    step = (times - np.datetime64(_start, 's')) // np.timedelta64(mask.dt)
+    out  = np.zeros( times.size, dtype = bool )
+    for r in records:
+        s0 = (r.ISSUED - _start) // mask.dt
+        s1 = (r.EXPIRED - _start) // mask.dt
+        out |= (step >= s0) & (step <= s1) & shapely.contains_xy( r.geometry, lon, lat )
+    return out
+
+def test_lookup_matches_polygons(tmp_path):
+    records = _records()
+    mask    = warningMask.build( str(tmp_path / 'mask.npy'), records, _start, _start + timedelta(hours = 6),
+                                 resolution = 0.1 )
+    assert mask.nwarnings == 3 and mask.phenom is None
+    rng   = np.random.default_rng( 0 )
+    n     = 200000
+    times = np.datetime64(_start, 's') + rng.integers( 0, 6 * 3600, n ).astype('timedelta64[s]')
+    lons  = rng.uniform( -125, -80, n )
+    lats  = rng.uniform( 25, 50, n )
+    truth = _expected( records, mask, times, lons, lats )
+    assert truth.sum() > 1000
+    assert (mask.lookup( times, lons, lats ) == truth).all()
+
+    mask.cache( _start + timedelta(hours = 2), _start + timedelta(hours = 3) )  # Dense frames for part of the time range
+    assert mask.frames is not None
+    assert (mask.lookup( times, lons, lats ) == truth).all()
+    assert (warningMask( str(tmp_path / 'mask.npy') ).lookup( times, lons, lats ) == truth).all()
+
+    t    = _start + timedelta(hours = 2, minutes = 30)
+    grid = mask.mask( t )
+    assert grid.shape == mask.shape
+    assert not grid[ int((35 - 25) / 0.1), int((-96 + 130) / 0.1) ]             # In the hole, not in the second warning
+    assert grid[ int((36 - 25) / 0.1), int((-94 + 130) / 0.1) ]                 # In the hole and the second warning
+
+def test_phenom_code(tmp_path):
+    records = _records()
+    mask    = warningMask.build( str(tmp_path / 'mask.npy'), records, _start, _start + timedelta(hours = 6),
+                                 resolution = 0.1, phenom = 'FF' )
+    assert mask.phenom == ['FF'] and mask.nwarnings == 1
+    times = np.full( 2, np.datetime64(_start + timedelta(minutes = 30), 's') )
+    assert mask.lookup( times, [-115, -95], [35, 31] ).tolist() == [True, False]